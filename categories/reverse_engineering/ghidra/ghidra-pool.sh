@@ -0,0 +1,6 @@
+#!/bin/bash
+# Analyze a binary on a warm headless Ghidra worker of the CLI server (JSON summary:
+# functions, imports, format); falls back to a one-off analyzeHeadless run
+# Usage: ./ghidra-pool.sh <file>
+
+exec python3 "$(dirname "$(readlink -f "$0")")/../../../server/ghidra_pool.py" "$@"
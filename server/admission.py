@@ -0,0 +1,255 @@
+# Admission control: per-tool concurrency limits with a bounded priority queue
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+
+from metrics import REGISTRY
+from parsers import detect_tool
+
+# Commands that answer instantly and are typed by a person; they jump the queue
+INTERACTIVE_TOOLS = {
+    'ls', 'cat', 'head', 'tail', 'echo', 'pwd', 'whoami', 'id', 'uname', 'file', 'stat',
+    'wc', 'grep', 'which', 'du', 'df', 'date', 'env', 'printenv', 'hostname', 'true', 'false',
+}
+TOOL_CLASSES = {
+    'nmap': 'nmap', 'quick-scan.sh': 'nmap',
+    'sqlmap': 'sqlmap',
+    'peframe': 'peframe',
+    'ghidra': 'ghidra', 'analyzeHeadless': 'ghidra', 'ghidra-pool.sh': 'ghidra',
+}
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, str(default)))
+
+
+# Concurrent runs allowed per class (CLI_LIMIT_<CLASS>) and queue priority (lower runs first)
+CLASS_LIMITS = {
+    'interactive': _env_int('CLI_LIMIT_INTERACTIVE', 16),
+    'nmap': _env_int('CLI_LIMIT_NMAP', 4),
+    'sqlmap': _env_int('CLI_LIMIT_SQLMAP', 2),
+    'peframe': _env_int('CLI_LIMIT_PEFRAME', 4),
+    'ghidra': _env_int('CLI_LIMIT_GHIDRA', 1),
+    'other': _env_int('CLI_LIMIT_OTHER', 4),
+}
+CLASS_PRIORITY = {'interactive': 0, 'peframe': 1, 'other': 1, 'nmap': 2, 'sqlmap': 2, 'ghidra': 3}
+
+MAX_RUNNING = _env_int('CLI_MAX_RUNNING', 16)
+MAX_WAITING = _env_int('CLI_MAX_WAITING', 32)
+QUEUE_TIMEOUT = float(os.environ.get('CLI_QUEUE_TIMEOUT', '20'))
+
+
+QUEUE_WAIT = REGISTRY.histogram('cli_admission_wait_seconds', 'Time commands waited for a run slot',
+                                ('tool_class',))
+REJECTED = REGISTRY.counter('cli_admission_rejected_total', 'Commands turned away by admission control',
+                            ('tool_class', 'reason'))
+
+
+def classify(command):
+    tool = detect_tool(command) or ''
+    if tool in INTERACTIVE_TOOLS:
+        return 'interactive'
+    return TOOL_CLASSES.get(tool, 'other')
+
+
+class AdmissionRejected(Exception):
+    """Queue full or wait timed out; retry_after is a whole number of seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionCancelled(Exception):
+    """The waiter's cancelled() check turned true before it was granted a slot"""
+
+
+class Ticket:
+    """A granted slot; release it exactly once (or use it as a context manager)"""
+
+    def __init__(self, controller, tool_class, priority, seq):
+        self.controller = controller
+        self.tool_class = tool_class
+        self.priority = priority
+        self.seq = seq
+        self.granted = False
+        self.abandoned = False
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.released = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def queue_seconds(self):
+        """Time spent waiting for the slot"""
+        return None if self.started_at is None else self.started_at - self.enqueued_at
+
+    def release(self):
+        self.controller.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Grants run slots under a global cap and per-class caps. Waiters are served
+    by priority, then arrival order; a waiter whose class is at its cap does not
+    block lower-priority waiters of other classes behind it.
+    """
+
+    def __init__(self, limits=None, max_running=MAX_RUNNING, max_waiting=MAX_WAITING,
+                 queue_timeout=QUEUE_TIMEOUT):
+        self.limits = dict(limits or CLASS_LIMITS)
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = []          # heap of Tickets
+        self._running = {c: 0 for c in self.limits}
+        self._avg_runtime = {c: 1.0 for c in self.limits}
+        self.rejected = 0
+
+    def _has_capacity(self, tool_class):
+        return (sum(self._running.values()) < self.max_running
+                and self._running[tool_class] < self.limits[tool_class])
+
+    def _dispatch(self):
+        # Grant slots to waiters in priority order (caller holds the lock)
+        skipped = []
+        while self._waiting and sum(self._running.values()) < self.max_running:
+            ticket = heapq.heappop(self._waiting)
+            if ticket.abandoned:
+                continue
+            if self._running[ticket.tool_class] < self.limits[ticket.tool_class]:
+                self._grant(ticket)
+            else:
+                skipped.append(ticket)
+        for ticket in skipped:
+            heapq.heappush(self._waiting, ticket)
+        self._cond.notify_all()
+
+    def _grant(self, ticket):
+        ticket.granted = True
+        ticket.started_at = time.monotonic()
+        self._running[ticket.tool_class] += 1
+
+    def _retry_after(self, tool_class):
+        # Rough time until a slot frees: queued work for the class spread over its slots
+        queued = sum(1 for t in self._waiting if t.tool_class == tool_class and not t.abandoned)
+        estimate = self._avg_runtime[tool_class] * (queued + 1) / max(1, self.limits[tool_class])
+        return int(min(300, max(1, math.ceil(estimate))))
+
+    def acquire(self, command, timeout=None, bounded=True, cancelled=None):
+        """
+        Block until a slot for the command's class is free and return a Ticket.
+        Raises AdmissionRejected if the wait queue is full (bounded=True) or
+        the slot is not granted within timeout (default CLI_QUEUE_TIMEOUT;
+        pass float('inf') to wait indefinitely), and AdmissionCancelled once
+        cancelled() returns True (checked on every wake-up; see wake()).
+        """
+        tool_class = classify(command)
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._cond:
+            ticket = Ticket(self, tool_class, CLASS_PRIORITY.get(tool_class, 1), next(self._seq))
+            # Every waiter left after a dispatch is blocked by a cap, so a free
+            # slot for this class can be taken without jumping anyone eligible
+            if self._has_capacity(tool_class):
+                self._grant(ticket)
+                QUEUE_WAIT.observe(ticket.queue_seconds, tool_class=tool_class)
+                return ticket
+            if bounded and sum(1 for t in self._waiting if not t.abandoned) >= self.max_waiting:
+                self.rejected += 1
+                REJECTED.inc(tool_class=tool_class, reason="queue_full")
+                raise AdmissionRejected("run queue full", self._retry_after(tool_class))
+            heapq.heappush(self._waiting, ticket)
+            self._dispatch()
+            deadline = time.monotonic() + timeout
+            while not ticket.granted:
+                if cancelled is not None and cancelled():
+                    ticket.abandoned = True
+                    raise AdmissionCancelled("cancelled while waiting for a run slot")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    ticket.abandoned = True
+                    self.rejected += 1
+                    REJECTED.inc(tool_class=tool_class, reason="timeout")
+                    raise AdmissionRejected("timed out waiting for a run slot", self._retry_after(tool_class))
+                self._cond.wait(min(remaining, 5.0))
+            QUEUE_WAIT.observe(ticket.queue_seconds, tool_class=tool_class)
+            return ticket
+
+    def wake(self):
+        """Make waiters re-check their cancelled() condition now"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def release(self, ticket):
+        with self._cond:
+            if ticket.released or not ticket.granted:
+                return
+            ticket.released = True
+            self._running[ticket.tool_class] -= 1
+            runtime = time.monotonic() - ticket.started_at
+            # EWMA of run time per class, used for Retry-After estimates
+            self._avg_runtime[ticket.tool_class] = 0.8 * self._avg_runtime[ticket.tool_class] + 0.2 * runtime
+            self._dispatch()
+
+    def stats(self):
+        with self._cond:
+            waiting = {c: 0 for c in self.limits}
+            for t in self._waiting:
+                if not t.abandoned:
+                    waiting[t.tool_class] += 1
+            return {
+                "max_running": self.max_running,
+                "max_waiting": self.max_waiting,
+                "rejected": self.rejected,
+                "classes": {
+                    c: {
+                        "limit": self.limits[c],
+                        "running": self._running[c],
+                        "waiting": waiting[c],
+                        "avg_runtime": round(self._avg_runtime[c], 2),
+                    }
+                    for c in self.limits
+                },
+            }
+
+
+class ReleasingIterator:
+    """
+    Wraps a response iterable so the ticket is released when the server closes
+    it, even if the client disconnects before the first chunk is produced.
+    """
+
+    def __init__(self, iterable, ticket):
+        self._it = iter(iterable)
+        self._ticket = ticket
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._it)
+        except StopIteration:
+            self._ticket.release()
+            raise
+
+    def close(self):
+        try:
+            close = getattr(self._it, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._ticket.release()
@@ -0,0 +1,262 @@
+# Content-addressed sample store, and analyses of samples cached by (sha256, tool, version)
+import hashlib
+import os
+import re
+import shlex
+import subprocess
+import tempfile
+import threading
+import uuid
+
+from capture import READ_SIZE
+from ghidra_pool import GHIDRA_POOL_SIZE, GHIDRA_PROJECT_DIR, missing_requirements
+from jobs import ACTIVE_STATES, FINISHED
+from parsers import PARSERS, detect_tool
+from result_store import DEFAULT_DB_DIR
+from utils import registry
+
+ARTIFACT_DIR = os.environ.get('CLI_ARTIFACT_DIR') or os.path.join(DEFAULT_DB_DIR, 'artifacts')
+ARTIFACT_MAX_BYTES = int(os.environ.get('CLI_ARTIFACT_MAX_BYTES', str(512 * 1024 * 1024)))
+ANALYSIS_TIMEOUT = int(os.environ.get('CLI_ANALYSIS_TIMEOUT', '1800'))
+# Extra analyzeHeadless arguments (e.g. "-postScript ExportDecompiled.java"); part of the
+# cache key. Warm pool workers (ghidra_pool.py) do not take them, so setting them bypasses the pool
+GHIDRA_ARGS = os.environ.get('CLI_GHIDRA_ARGS', '')
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Analyses that can run on a stored sample. "command" is formatted with the
+# sample path (and a fresh Ghidra project name); "binary" is what has to be on
+# PATH; "version" is a command printing the tool version, if it has one.
+# "pooled" is used instead of "command" while the warm worker pool is enabled;
+# {script} is that tool's category script
+ANALYZERS = {
+    'peframe': {
+        'binary': 'peframe',
+        'command': 'peframe --json {path}',
+        'version': 'peframe --version',
+    },
+    'ghidra': {
+        'binary': 'analyzeHeadless',
+        'command': 'analyzeHeadless {project_dir} {project} -import {path} -deleteProject'
+                   + (' ' + GHIDRA_ARGS if GHIDRA_ARGS else ''),
+        'version': None,
+        'pooled': '{script} {path}',
+        'script': 'ghidra-pool.sh',
+    },
+}
+
+
+class ArtifactTooLarge(Exception):
+    """Upload exceeded CLI_ARTIFACT_MAX_BYTES"""
+
+
+class DigestMismatch(Exception):
+    """The uploaded bytes do not hash to the sha256 the client announced"""
+
+
+class ArtifactStore:
+    """
+    Samples live at <root>/<first two hex digits>/<sha256>, read-only, one
+    copy per distinct content. Uploads are written to a temp file and hashed
+    chunk by chunk as they arrive, then renamed into place, so memory use does
+    not depend on sample size and a half-received file is never visible.
+    """
+
+    def __init__(self, root=ARTIFACT_DIR, max_bytes=ARTIFACT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._tmp = os.path.join(root, 'tmp')
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def _path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def path(self, sha256):
+        """Path of a stored sample, or None if the hash is unknown (or not a sha256)"""
+        if not SHA256_RE.match(sha256 or ''):
+            return None
+        path = self._path(sha256)
+        return path if os.path.isfile(path) else None
+
+    def put(self, stream, expected=None):
+        """
+        Read a file-like stream to the end and store it.
+        Returns (sha256, size, created); created is False if it was already stored.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self._tmp, prefix='upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ArtifactTooLarge(f"sample is larger than {self.max_bytes} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+            sha256 = digest.hexdigest()
+            if expected and expected.lower() != sha256:
+                raise DigestMismatch(f"received data hashes to {sha256}")
+            final = self._path(sha256)
+            if os.path.exists(final):
+                os.unlink(tmp)
+                return sha256, size, False
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, final)
+            return sha256, size, True
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def info(self, sha256):
+        path = self.path(sha256)
+        if path is None:
+            return None
+        st = os.stat(path)
+        return {"sha256": sha256, "size": st.st_size, "stored_at": st.st_mtime}
+
+    def delete(self, sha256):
+        path = self.path(sha256)
+        if path is None:
+            return False
+        os.unlink(path)
+        return True
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def _ghidra_version(binary):
+    # analyzeHeadless is <install>/support/analyzeHeadless; the version is in Ghidra/application.properties
+    root = os.path.dirname(os.path.dirname(os.path.realpath(binary)))
+    try:
+        with open(os.path.join(root, 'Ghidra', 'application.properties')) as f:
+            for line in f:
+                if line.startswith('application.version='):
+                    return line.split('=', 1)[1].strip()
+    except OSError:
+        pass
+    return None
+
+
+def tool_version(tool):
+    """
+    Version string of an analyzer, or None if it is not installed. Asked once
+    per installed binary (path, size, mtime), so an upgrade is picked up and
+    invalidates cached analyses without a restart.
+    """
+    analyzer = ANALYZERS[tool]
+    binary = registry.which(analyzer['binary'])
+    if binary is None:
+        return None
+    st = os.stat(binary)
+    signature = (binary, st.st_size, st.st_mtime_ns)
+    with _versions_lock:
+        if signature in _versions:
+            return _versions[signature]
+    version = None
+    if analyzer['version']:
+        try:
+            out = subprocess.run(analyzer['version'], shell=True, capture_output=True, timeout=15).stdout
+            version = next((line.strip() for line in out.decode(errors='replace').splitlines() if line.strip()), None)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+    elif tool == 'ghidra':
+        version = _ghidra_version(binary)
+    # Without a readable version, the binary itself identifies the build
+    version = version or f"build-{hashlib.sha256(repr(signature).encode()).hexdigest()[:12]}"
+    with _versions_lock:
+        _versions[signature] = version
+    return version
+
+
+def _script(tool):
+    analyzer = ANALYZERS[tool]
+    if not analyzer.get('pooled') or GHIDRA_POOL_SIZE <= 0 or GHIDRA_ARGS or missing_requirements():
+        return None
+    return registry.snapshot()["tools"].get(tool, {}).get("scripts", {}).get(analyzer['script'])
+
+
+def analysis_template(tool):
+    """Command template an analysis runs with, which is also part of its cache key"""
+    analyzer = ANALYZERS[tool]
+    return analyzer['pooled'] if _script(tool) else analyzer['command']
+
+
+def analysis_command(tool, path, sha256):
+    project = f"a{sha256[:12]}_{uuid.uuid4().hex[:6]}"
+    script = _script(tool)
+    return analysis_template(tool).format(path=shlex.quote(path), project_dir=shlex.quote(GHIDRA_PROJECT_DIR),
+                                          project=project, script=shlex.quote(script or ''))
+
+
+class AnalysisRunner:
+    """
+    Starts analyses of stored samples as background jobs and answers repeats
+    from the result store. A run is cached under (sha256, tool, version,
+    profile), where profile is the analyzer's command template; see record()
+    for which runs are kept. Concurrent requests for the same
+    uncached analysis share one job.
+    """
+
+    def __init__(self, artifacts, jobs, store=None, timeout=ANALYSIS_TIMEOUT):
+        self.artifacts = artifacts
+        self.jobs = jobs
+        self.store = store
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._running = {}
+
+    @staticmethod
+    def key(sha256, tool, version):
+        return sha256, tool, version, analysis_template(tool)
+
+    def record(self, job):
+        """
+        Remember a stored analysis job for its sample. Only clean runs are
+        reused: exit status 0, and a parsed result when the tool has a parser
+        (so a ghidra-pool.sh run that fell back to analyzeHeadless is not kept).
+        """
+        if job.status != FINISHED or job.exit_code != 0:
+            return False
+        if job.parsed is None and detect_tool(job.command) in PARSERS:
+            return False
+        self.store.save_analysis(*job.analysis, job.result_id)
+        return True
+
+    def cached(self, sha256):
+        """Stored analyses of a sample, newest first"""
+        return self.store.analyses(sha256) if self.store is not None else []
+
+    def analyze(self, sha256, tool, refresh=False, task=None):
+        """
+        Returns ("hit", result_id) for a cached analysis, or ("job", Job) for
+        a running one. Raises KeyError for an unknown sample and LookupError
+        if the tool is not installed; QueueFullError comes from the job queue.
+        """
+        path = self.artifacts.path(sha256)
+        if path is None:
+            raise KeyError(sha256)
+        version = tool_version(tool)
+        if version is None:
+            raise LookupError(f"{ANALYZERS[tool]['binary']} is not installed")
+        key = self.key(sha256, tool, version)
+        with self._lock:
+            job = self._running.get(key)
+            if job is not None and job.status in ACTIVE_STATES:
+                return "job", job
+            if not refresh and self.store is not None:
+                result_id = self.store.find_analysis(*key)
+                if result_id is not None:
+                    return "hit", result_id
+            job = self.jobs.submit(analysis_command(tool, path, sha256), self.timeout, parse=True,
+                                   task=task, store=self.store is not None, analysis=key)
+            self._running = {k: j for k, j in self._running.items() if j.status in ACTIVE_STATES}
+            self._running[key] = job
+            return "job", job
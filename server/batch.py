@@ -0,0 +1,267 @@
+# Fan-out of multi-target commands into shards that run in parallel
+import ipaddress
+import math
+import os
+import shlex
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from admission import AdmissionCancelled
+from jobs import ACTIVE_STATES, CANCELLED, FINISHED, Job
+from parsers import detect_tool
+
+# Threads that drive shards. They mostly wait on child processes; how many shards
+# actually run at once is set by admission control (CLI_LIMIT_<TOOL>)
+BATCH_WORKERS = int(os.environ.get('CLI_BATCH_WORKERS', '16'))
+BATCH_MAX_SHARDS = int(os.environ.get('CLI_BATCH_MAX_SHARDS', '16'))
+# Do not split ranges into shards smaller than this many addresses
+BATCH_MIN_SHARD_HOSTS = int(os.environ.get('CLI_BATCH_MIN_SHARD_HOSTS', '32'))
+
+_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+
+# nmap options whose value is the next word (so it is not mistaken for a target)
+NMAP_VALUE_OPTIONS = {
+    '-p', '-e', '-S', '-D', '-g', '-b', '--source-port', '--exclude-ports', '--top-ports',
+    '--port-ratio', '--script', '--script-args', '--script-args-file', '--max-retries',
+    '--host-timeout', '--scan-delay', '--max-scan-delay', '--min-rate', '--max-rate',
+    '--min-parallelism', '--max-parallelism', '--min-hostgroup', '--max-hostgroup',
+    '--min-rtt-timeout', '--max-rtt-timeout', '--initial-rtt-timeout', '--exclude',
+    '--data', '--data-string', '--data-length', '--ttl', '--mtu', '--spoof-mac', '--proxies',
+    '--dns-servers', '--version-intensity', '--datadir', '--servicedb', '--versiondb',
+    '--stats-every', '--stylesheet', '--ip-options', '-sI', '--scanflags', '--max-os-tries',
+}
+# Options that conflict with sharding: output files would be overwritten by every
+# shard, and target lists/resume state live in files we do not split
+NMAP_UNSHARDABLE = {'-oN', '-oX', '-oG', '-oA', '-oS', '-oM', '-iL', '-iR', '--resume', '--excludefile'}
+
+
+class BatchError(ValueError):
+    """The command cannot be split into shards"""
+
+
+def split_nmap(command):
+    """Split an nmap command into (words without targets, targets)"""
+    try:
+        words = shlex.split(command)
+    except ValueError as e:
+        raise BatchError(f"cannot parse command: {e}")
+    try:
+        start = next(i for i, w in enumerate(words) if os.path.basename(w) == 'nmap')
+    except StopIteration:
+        raise BatchError("not an nmap command")
+    options, targets = words[:start + 1], []
+    takes_value = False
+    for word in words[start + 1:]:
+        if takes_value:
+            options.append(word)
+            takes_value = False
+        elif word.startswith('-'):
+            if word.split('=', 1)[0] in NMAP_UNSHARDABLE or word[:3] in NMAP_UNSHARDABLE:
+                raise BatchError(f"{word} is not supported in batch mode")
+            options.append(word)
+            takes_value = word in NMAP_VALUE_OPTIONS
+        else:
+            targets.append(word)
+    if not targets:
+        raise BatchError("no targets in command")
+    return options, targets
+
+
+def _network(target):
+    try:
+        return ipaddress.ip_network(target, strict=False)
+    except ValueError:
+        return None
+
+
+def plan_shards(targets, max_shards=BATCH_MAX_SHARDS, min_hosts=BATCH_MIN_SHARD_HOSTS):
+    """
+    Group targets into at most max_shards lists of roughly equal address count,
+    splitting CIDR ranges into subnets where needed. Target order is kept, so
+    concatenating shard results gives the same order as one scan of everything.
+    """
+    units = []
+    for target in targets:
+        net = _network(target)
+        units.append((target, net, net.num_addresses if net else 1))
+    total = sum(n for _, _, n in units)
+    wanted = max(1, min(max_shards, math.ceil(total / max(1, min_hosts))))
+    per_shard = math.ceil(total / wanted)
+
+    pieces = []
+    for target, net, count in units:
+        if net is not None and count > per_shard:
+            prefix = max(net.prefixlen, net.max_prefixlen - int(math.log2(per_shard)))
+            pieces.extend((str(sub), sub.num_addresses) for sub in net.subnets(new_prefix=prefix))
+        else:
+            pieces.append((target, count))
+
+    shards, current, size = [], [], 0
+    for target, count in pieces:
+        if current and size + count > per_shard:
+            shards.append(current)
+            current, size = [], 0
+        current.append(target)
+        size += count
+    if current:
+        shards.append(current)
+    return shards
+
+
+def plan_batch(command, targets=None, max_shards=BATCH_MAX_SHARDS, wordlist_shards=None):
+    """
+    Return [(targets, command), ...]. With an explicit target list the command is
+    a template containing "{target}" and each target gets its own shard; with
+    wordlist_shards (paths of a split wordlist) it contains "{wordlist}" and each
+    slice gets its own shard; otherwise the command must be an nmap scan, whose
+    targets are sharded.
+    """
+    if wordlist_shards is not None:
+        if '{wordlist}' not in command:
+            raise BatchError('command must contain "{wordlist}" when a wordlist is given')
+        return [([path], command.replace('{wordlist}', shlex.quote(path))) for path in wordlist_shards]
+    if targets is not None:
+        if '{target}' not in command:
+            raise BatchError('command must contain "{target}" when targets are given')
+        if not isinstance(targets, list) or not targets:
+            raise BatchError("targets must be a non-empty list")
+        if len(targets) > max_shards:
+            raise BatchError(f"at most {max_shards} targets per batch")
+        return [([str(t)], command.replace('{target}', shlex.quote(str(t)))) for t in targets]
+    if detect_tool(command) != 'nmap':
+        raise BatchError('only nmap commands are sharded automatically; pass "targets" for other tools')
+    options, nmap_targets = split_nmap(command)
+    return [(shard, shlex.join(options + shard)) for shard in plan_shards(nmap_targets, max_shards)]
+
+
+def merge_reports(parsed_list):
+    """Combine per-shard parse results; nmap reports merge into one report"""
+    parsed_list = [p for p in parsed_list if p]
+    if not parsed_list:
+        return None
+    if all(p.get("tool") == "nmap" for p in parsed_list):
+        hosts = [h for p in parsed_list for h in p.get("hosts", [])]
+        stats = [p.get("stats") or {} for p in parsed_list]
+        merged_stats = {}
+        if stats and all(stats):
+            merged_stats = {
+                "total": sum(s.get("total", 0) for s in stats),
+                "up": sum(s.get("up", 0) for s in stats),
+            }
+        return {"tool": "nmap", "hosts": hosts, "stats": merged_stats}
+    return {"tool": "batch", "shards": parsed_list}
+
+
+class Batch:
+    """A sharded command: one Job per shard, driven by the batch pool"""
+
+    def __init__(self, command, shards, timeout):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.targets = [targets for targets, _ in shards]
+        self.jobs = [Job(cmd, timeout, parse=True) for _, cmd in shards]
+        # Eviction leaves the shards alone until close(): report() and iter_output() read them
+        for job in self.jobs:
+            job.pinned = True
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def plan(self):
+        return {
+            "batch_id": self.id,
+            "command": self.command,
+            "shards": [
+                {"index": i, "targets": targets, "command": job.command, "job_id": job.id}
+                for i, (targets, job) in enumerate(zip(self.targets, self.jobs))
+            ],
+        }
+
+    def shard_result(self, index):
+        job = self.jobs[index]
+        return {
+            "index": index,
+            "job_id": job.id,
+            "targets": self.targets[index],
+            "status": job.status,
+            "exit_code": job.exit_code,
+            "error": job.error,
+            "output": job.capture.preview(),
+            "truncated": job.capture.truncated,
+            "output_bytes": job.capture.total,
+            "parsed": job.parsed,
+        }
+
+    def report(self):
+        report = merge_reports(job.parsed for job in self.jobs)
+        if report is not None and report.get("tool") == "nmap" and report["stats"]:
+            report["stats"]["elapsed"] = round((self.finished_at or time.time()) - self.started_at, 2)
+        return report
+
+    def iter_output(self):
+        """Every shard's full output in shard order, each under a "# shard N" header"""
+        for index, job in enumerate(self.jobs):
+            yield f"# shard {index}: {job.command}\n".encode()
+            yield from job.capture.iter_bytes()
+
+    @property
+    def status(self):
+        return FINISHED if all(job.status == FINISHED for job in self.jobs) else "failed"
+
+    def summary(self):
+        statuses = [job.status for job in self.jobs]
+        return {
+            "batch_id": self.id,
+            "shards": len(self.jobs),
+            "finished": statuses.count(FINISHED),
+            "failed": len(statuses) - statuses.count(FINISHED),
+            "elapsed": round((self.finished_at or time.time()) - self.started_at, 2),
+        }
+
+    def close(self, jobs):
+        """Release the shards to the job manager's normal retention"""
+        jobs.unpin(self.jobs)
+
+    def run(self, jobs, admission, heartbeat=None):
+        """
+        Start every shard and yield shard indexes as they finish. Closing the
+        generator early (client went away) cancels the shards still running.
+        With a heartbeat (seconds), None is yielded whenever that long passes
+        without a shard finishing, so a streaming caller can write something.
+        """
+        def run_shard(index):
+            job = self.jobs[index]
+            if admission is None:
+                jobs.run_job(job)
+            else:
+                try:
+                    ticket = admission.acquire(job.command, timeout=float('inf'), bounded=False,
+                                               cancelled=lambda: job.status == CANCELLED)
+                except AdmissionCancelled:
+                    # The batch was abandoned while this shard waited for a slot
+                    job.finished_at = job.finished_at or time.time()
+                    return index
+                with ticket:
+                    jobs.run_job(job)
+            return index
+
+        futures = [_pool.submit(run_shard, i) for i in range(len(self.jobs))]
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=heartbeat, return_when=FIRST_COMPLETED)
+                if not done:
+                    yield None
+                # Same order as submission among shards that finished together
+                for future in sorted(done, key=futures.index):
+                    yield future.result()
+        finally:
+            self.finished_at = time.time()
+            for future, job in zip(futures, self.jobs):
+                future.cancel()
+                if job.status in ACTIVE_STATES:
+                    jobs.cancel(job.id)
+                    job.status = CANCELLED
+            if admission is not None:
+                # Shards still waiting for a run slot give the wait up
+                admission.wake()
@@ -0,0 +1,122 @@
+# Bounded-memory capture of command output
+import os
+import tempfile
+import threading
+
+# In-memory preview sizes and the point at which the spool rolls over to disk
+HEAD_BYTES = int(os.environ.get('CLI_CAPTURE_HEAD_BYTES', str(16 * 1024)))
+TAIL_BYTES = int(os.environ.get('CLI_CAPTURE_TAIL_BYTES', str(48 * 1024)))
+SPOOL_BYTES = int(os.environ.get('CLI_CAPTURE_SPOOL_BYTES', str(256 * 1024)))
+# Largest page a single read() may return
+MAX_PAGE_BYTES = int(os.environ.get('CLI_CAPTURE_MAX_PAGE_BYTES', str(1024 * 1024)))
+
+READ_SIZE = 64 * 1024
+
+
+class OutputCapture:
+    """
+    Keeps the first HEAD_BYTES and last TAIL_BYTES of a stream in memory and
+    writes every byte to a SpooledTemporaryFile, which moves to disk once it
+    exceeds SPOOL_BYTES. Memory use is therefore bounded regardless of how much
+    a command prints, while read() still gives access to the full output.
+    """
+
+    def __init__(self, head_bytes=HEAD_BYTES, tail_bytes=TAIL_BYTES, spool_bytes=SPOOL_BYTES):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.closed = False
+        self._spool = tempfile.SpooledTemporaryFile(max_size=spool_bytes, prefix="cli-output-")
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        if not data:
+            return
+        with self._lock:
+            if self.closed:
+                return
+            self._spool.seek(0, os.SEEK_END)
+            self._spool.write(data)
+            self.total += len(data)
+            if len(self.head) < self.head_bytes:
+                self.head += data[:self.head_bytes - len(self.head)]
+            # Tail ring: append then trim to the newest tail_bytes
+            self.tail += data
+            if len(self.tail) > self.tail_bytes:
+                del self.tail[:len(self.tail) - self.tail_bytes]
+
+    @property
+    def truncated(self):
+        """True when head + tail no longer cover the whole output"""
+        return self.total > self.head_bytes + self.tail_bytes
+
+    def read(self, offset=0, length=MAX_PAGE_BYTES):
+        """Return up to length bytes starting at offset (capped at MAX_PAGE_BYTES)"""
+        length = max(0, min(length, MAX_PAGE_BYTES))
+        with self._lock:
+            if self.closed or offset >= self.total:
+                return b""
+            self._spool.seek(offset)
+            return self._spool.read(length)
+
+    def iter_bytes(self, offset=0, end=None):
+        """Yield the stored output in READ_SIZE pieces without loading all of it"""
+        end = self.total if end is None else min(end, self.total)
+        while offset < end:
+            data = self.read(offset, min(READ_SIZE, end - offset))
+            if not data:
+                break
+            offset += len(data)
+            yield data
+
+    def preview(self):
+        """Whole output if small, else head + a marker + tail, decoded as text"""
+        with self._lock:
+            if not self.truncated:
+                data = bytes(self.head) + bytes(self.tail[max(0, len(self.tail) - (self.total - len(self.head))):])
+                return data.decode(errors='ignore')
+            skipped = self.total - len(self.head) - len(self.tail)
+            return (
+                self.head.decode(errors='ignore')
+                + f"\n... [{skipped} bytes omitted, fetch the full output by range] ...\n"
+                + self.tail.decode(errors='ignore')
+            )
+
+    def close(self):
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                self._spool.close()
+                self.head = bytearray()
+                self.tail = bytearray()
+
+
+def pump(proc, capture, timeout, on_timeout):
+    """
+    Copy proc.stdout into capture until EOF. on_timeout is called (from a timer
+    thread) if the process runs longer than timeout seconds.
+    Returns True if the timeout fired.
+    """
+    fired = threading.Event()
+
+    def expire():
+        fired.set()
+        on_timeout()
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    fd = proc.stdout.fileno()
+    try:
+        while True:
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                break
+            capture.write(chunk)
+        proc.wait()
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+    return fired.is_set()
@@ -0,0 +1,427 @@
+# Pool of warm headless Ghidra workers (ghidra_worker.py) served on a Unix socket, and the
+# client that categories/reverse_engineering/ghidra/ghidra-pool.sh runs to use it
+import atexit
+import functools
+import importlib.util
+import json
+import os
+import queue
+import select
+import shutil
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from metrics import REGISTRY
+
+# Warm workers kept (each is a JVM); 0 (the default) disables the pool and the client always runs analyzeHeadless
+GHIDRA_POOL_SIZE = int(os.environ.get('CLI_GHIDRA_POOL_SIZE', '0'))
+GHIDRA_SOCKET = os.environ.get('CLI_GHIDRA_SOCKET', '/tmp/ghidra-pool.sock')
+# A worker is replaced after this many samples or once its RSS grows past the threshold
+WORKER_MAX_JOBS = int(os.environ.get('CLI_GHIDRA_WORKER_MAX_JOBS', '50'))
+WORKER_MAX_RSS_MB = int(os.environ.get('CLI_GHIDRA_WORKER_MAX_RSS_MB', '3072'))
+# Interpreter with pyghidra installed, if not the server's own
+WORKER_PYTHON = os.environ.get('CLI_GHIDRA_PYTHON') or sys.executable
+WORKER_STARTUP_TIMEOUT = float(os.environ.get('CLI_GHIDRA_STARTUP_TIMEOUT', '180'))
+# After a worker failed to start, clients fall back to analyzeHeadless for this long
+WORKER_RETRY_AFTER = float(os.environ.get('CLI_GHIDRA_RETRY_AFTER', '300'))
+# Projects of analyzeHeadless runs (fallback, and analyses of stored artifacts without the pool)
+GHIDRA_PROJECT_DIR = os.environ.get('CLI_GHIDRA_PROJECT_DIR', '/tmp/ghidra-projects')
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ghidra_worker.py')
+
+POOL_JOBS = REGISTRY.counter('cli_ghidra_pool_jobs_total', 'Samples sent to warm Ghidra workers', ('outcome',))
+POOL_RECYCLED = REGISTRY.counter('cli_ghidra_pool_recycled_total', 'Ghidra workers replaced', ('reason',))
+POOL_SECONDS = REGISTRY.histogram('cli_ghidra_pool_analysis_seconds', 'Import and analysis time on a warm worker')
+POOL_STARTUP_SECONDS = REGISTRY.histogram('cli_ghidra_pool_startup_seconds', 'Time for a worker JVM to be ready')
+
+
+class WorkerError(Exception):
+    """A worker died, did not start, or did not answer in time"""
+
+
+class ClientGone(Exception):
+    """The client hung up (its job was cancelled or timed out) while its sample was analyzed"""
+
+
+class PoolUnavailable(Exception):
+    """No warm worker can be had; the client runs analyzeHeadless instead"""
+
+
+def ghidra_install_dir():
+    # analyzeHeadless is <install>/support/analyzeHeadless
+    binary = shutil.which('analyzeHeadless')
+    return os.path.dirname(os.path.dirname(os.path.realpath(binary))) if binary else None
+
+
+@functools.lru_cache(maxsize=None)
+def missing_requirements():
+    """Why workers cannot run here (no Ghidra install, or no pyghidra for WORKER_PYTHON), else None"""
+    if not os.environ.get('GHIDRA_INSTALL_DIR') and ghidra_install_dir() is None:
+        return "GHIDRA_INSTALL_DIR is not set and analyzeHeadless is not on PATH"
+    if WORKER_PYTHON == sys.executable:
+        found = any(importlib.util.find_spec(name) for name in ('pyghidra', 'pyhidra'))
+    else:
+        probe = "import importlib.util as u, sys; sys.exit(not (u.find_spec('pyghidra') or u.find_spec('pyhidra')))"
+        try:
+            found = subprocess.run([WORKER_PYTHON, '-c', probe], capture_output=True, timeout=30).returncode == 0
+        except (OSError, subprocess.TimeoutExpired):
+            found = False
+    return None if found else f"pyghidra is not installed for {WORKER_PYTHON}"
+
+
+class Worker:
+    """One ghidra_worker.py process, spoken to over a pair of pipes (its stdout is Ghidra's log)"""
+
+    def __init__(self):
+        requests_r, self._requests = os.pipe()
+        self._replies, replies_w = os.pipe()
+        env = dict(os.environ)
+        if not env.get('GHIDRA_INSTALL_DIR') and ghidra_install_dir():
+            env['GHIDRA_INSTALL_DIR'] = ghidra_install_dir()
+        try:
+            self.process = subprocess.Popen(
+                [WORKER_PYTHON, WORKER_SCRIPT, str(requests_r), str(replies_w)],
+                pass_fds=(requests_r, replies_w),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+                env=env,
+            )
+        except OSError as e:
+            os.close(self._requests)
+            os.close(self._replies)
+            raise WorkerError(str(e))
+        finally:
+            os.close(requests_r)
+            os.close(replies_w)
+        self._buffer = b""
+        self.jobs = 0
+
+    def wait_ready(self, timeout=WORKER_STARTUP_TIMEOUT):
+        start = time.perf_counter()
+        reply = self._reply(timeout=timeout)
+        if not reply.get("ready"):
+            raise WorkerError(reply.get("error") or "worker did not start")
+        POOL_STARTUP_SECONDS.observe(time.perf_counter() - start)
+
+    def call(self, request, client=None):
+        self.jobs += 1
+        try:
+            os.write(self._requests, json.dumps(request).encode() + b"\n")
+        except OSError as e:
+            # The worker died while idle: its end of the request pipe is gone
+            raise WorkerError(f"cannot send to worker: {e}")
+        return self._reply(client)
+
+    def _reply(self, client=None, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while b"\n" not in self._buffer:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self._replies] + ([client] if client else []), [], [], wait)
+            if not ready:
+                raise WorkerError(f"no answer within {timeout:g}s")
+            # The client sends nothing after its request, so a readable socket means it hung up
+            if client in ready:
+                try:
+                    gone = not client.recv(1, socket.MSG_PEEK)
+                except OSError:
+                    gone = True
+                if gone:
+                    raise ClientGone()
+            if self._replies in ready:
+                data = os.read(self._replies, 65536)
+                if not data:
+                    raise WorkerError(f"worker exited with status {self.process.wait()}")
+                self._buffer += data
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    def rss_mb(self):
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) // 1024
+        except (OSError, ValueError):
+            pass
+        return 0
+
+    def stop(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+        for fd in (self._requests, self._replies):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            path = request["path"]
+        except (ValueError, KeyError, TypeError):
+            reply = {"ok": False, "error": "expected a JSON line {\"path\": ...}"}
+        else:
+            reply = self.server.pool.analyze(path, self.connection)
+        if reply is not None:
+            try:
+                self.wfile.write(json.dumps(reply).encode() + b"\n")
+            except OSError:
+                # The client hung up after the analysis finished; nobody is left to tell
+                pass
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class GhidraPool:
+    """
+    Keeps `size` ghidra_worker.py processes warm so a sample costs its import
+    and analysis only, not a JVM start and project creation. Requests come in
+    on a Unix socket, one JSON line each, so analyses run as ordinary commands
+    (ghidra-pool.sh) with the usual admission, timeouts and cancellation: a
+    client that hangs up mid-analysis gets its worker killed and replaced.
+    Workers are recycled after max_jobs samples or past max_rss_mb of RSS.
+    """
+
+    def __init__(self, size=GHIDRA_POOL_SIZE, socket_path=GHIDRA_SOCKET,
+                 max_jobs=WORKER_MAX_JOBS, max_rss_mb=WORKER_MAX_RSS_MB):
+        self.size = size
+        self.socket_path = socket_path
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        # Workers alive or starting
+        self._count = 0
+        self._busy = 0
+        self._unavailable_until = 0.0
+        self.last_error = None
+        self._server = None
+        self._workers = set()
+        self.started = False
+
+    def start(self):
+        """
+        Listen on the socket and warm up the workers in the background. Only
+        the first call does anything. Raises PoolUnavailable (on that call) if
+        workers cannot run here; ghidra-pool.sh then always runs analyzeHeadless.
+        """
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+        missing = missing_requirements()
+        if missing is not None:
+            with self._lock:
+                self.last_error = missing
+            raise PoolUnavailable(missing)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = _Server(self.socket_path, _Handler)
+        self._server.pool = self
+        threading.Thread(target=self._server.serve_forever, name="ghidra-pool", daemon=True).start()
+        atexit.register(self.close)
+        for _ in range(self.size):
+            self._spawn_async()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+        with self._lock:
+            workers, self._workers = list(self._workers), set()
+        for worker in workers:
+            worker.stop()
+
+    def _spawn(self):
+        # Caller has counted the worker in self._count
+        try:
+            worker = Worker()
+            with self._lock:
+                self._workers.add(worker)
+            try:
+                worker.wait_ready()
+            except (WorkerError, ValueError) as e:
+                with self._lock:
+                    self._workers.discard(worker)
+                worker.stop()
+                raise WorkerError(str(e))
+        except WorkerError as e:
+            with self._lock:
+                self._count -= 1
+                self._unavailable_until = time.monotonic() + WORKER_RETRY_AFTER
+                self.last_error = str(e)
+            raise
+        with self._lock:
+            self.last_error = None
+        return worker
+
+    def _spawn_async(self):
+        with self._lock:
+            if self._count >= self.size:
+                return
+            self._count += 1
+
+        def run():
+            try:
+                self._idle.put(self._spawn())
+            except WorkerError:
+                pass
+
+        threading.Thread(target=run, name="ghidra-spawn", daemon=True).start()
+
+    def _check_available(self):
+        with self._lock:
+            if time.monotonic() < self._unavailable_until:
+                raise PoolUnavailable(f"Ghidra workers cannot start: {self.last_error}")
+
+    def acquire(self, timeout=WORKER_STARTUP_TIMEOUT):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        self._check_available()
+        with self._lock:
+            spawn = self._count < self.size
+            if spawn:
+                self._count += 1
+        if spawn:
+            try:
+                return self._spawn()
+            except WorkerError as e:
+                raise PoolUnavailable(str(e))
+        # Every worker is busy or starting; wait, but give up early if they cannot start
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self._check_available()
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                pass
+        raise PoolUnavailable(f"no Ghidra worker free within {timeout:g}s")
+
+    def release(self, worker, reason=None):
+        """Return a worker to the pool, or replace it (reason: cancelled, crashed, jobs, rss)"""
+        if reason is None:
+            if worker.jobs >= self.max_jobs:
+                reason = "jobs"
+            elif self.max_rss_mb and worker.rss_mb() > self.max_rss_mb:
+                reason = "rss"
+        if reason is None:
+            self._idle.put(worker)
+            return
+        POOL_RECYCLED.inc(reason=reason)
+        with self._lock:
+            self._workers.discard(worker)
+            self._count -= 1
+        worker.stop()
+        self._spawn_async()
+
+    def analyze(self, path, client=None):
+        """
+        Reply for one sample: {"ok": true, "result": {...}}, {"ok": false, "error"},
+        or {"fallback": reason} when the client should run analyzeHeadless itself.
+        None if the client went away.
+        """
+        try:
+            worker = self.acquire()
+        except PoolUnavailable as e:
+            POOL_JOBS.inc(outcome="fallback")
+            return {"fallback": str(e)}
+        with self._lock:
+            self._busy += 1
+        reason = None
+        start = time.perf_counter()
+        try:
+            reply = worker.call({"path": path}, client)
+        except ClientGone:
+            reason = "cancelled"
+            POOL_JOBS.inc(outcome="cancelled")
+            return None
+        except (WorkerError, ValueError) as e:
+            reason = "crashed"
+            POOL_JOBS.inc(outcome="crashed")
+            return {"ok": False, "error": f"Ghidra worker failed: {e}"}
+        finally:
+            with self._lock:
+                self._busy -= 1
+            self.release(worker, reason)
+        POOL_SECONDS.observe(time.perf_counter() - start)
+        POOL_JOBS.inc(outcome="ok" if reply.get("ok") else "error")
+        return reply
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "workers": self._count,
+                "busy": self._busy,
+                "idle": self._idle.qsize(),
+                "available": time.monotonic() >= self._unavailable_until,
+                "last_error": self.last_error,
+            }
+
+
+def run_headless(path, reason=None):
+    """Replace this process with a one-off analyzeHeadless run (the cold path)"""
+    binary = shutil.which('analyzeHeadless')
+    if binary is None:
+        print("ghidra-pool: no warm Ghidra worker and analyzeHeadless is not installed", file=sys.stderr)
+        return 127
+    if reason:
+        print(f"ghidra-pool: {reason}; running analyzeHeadless", file=sys.stderr)
+    sys.stderr.flush()
+    os.makedirs(GHIDRA_PROJECT_DIR, exist_ok=True)
+    project = f"hpta_{uuid.uuid4().hex[:8]}"
+    os.execv(binary, [binary, GHIDRA_PROJECT_DIR, project, '-import', path, '-deleteProject'])
+
+
+def main(argv):
+    """Client: analyze one file on a warm worker and print the JSON summary"""
+    if len(argv) != 2:
+        print("Usage: ghidra-pool.sh <file>", file=sys.stderr)
+        return 2
+    path = os.path.abspath(argv[1])
+    if not os.path.isfile(path):
+        print(f"ghidra-pool: {path}: no such file", file=sys.stderr)
+        return 2
+    if GHIDRA_POOL_SIZE <= 0:
+        return run_headless(path)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(GHIDRA_SOCKET)
+            sock.sendall(json.dumps({"path": path}).encode() + b"\n")
+            line = sock.makefile('rb').readline()
+    except OSError as e:
+        return run_headless(path, f"pool not reachable ({e})")
+    reply = json.loads(line) if line else {"fallback": "pool closed the connection"}
+    if "fallback" in reply:
+        return run_headless(path, reply["fallback"])
+    if not reply.get("ok"):
+        print(f"ghidra-pool: {reply.get('error')}", file=sys.stderr)
+        return 1
+    print(json.dumps(reply["result"], indent=1))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,102 @@
+# Long-lived headless Ghidra worker started by ghidra_pool.py: one JVM (via pyghidra) and
+# one project, reused for every sample it is sent.
+#
+# Usage: ghidra_worker.py <requests fd> <replies fd>
+# Requests are JSON lines {"path": "..."}; each gets one JSON reply line. The first
+# line written is {"ready": true} once the JVM is up, or {"error": "..."} if it cannot start.
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+# Longest function list returned per sample; function_count is always exact
+MAX_FUNCTIONS = int(os.environ.get('CLI_GHIDRA_MAX_FUNCTIONS', '5000'))
+
+
+def start_jvm():
+    try:
+        import pyghidra
+    except ImportError:
+        import pyhidra as pyghidra  # older name of the same package
+    pyghidra.start()
+
+
+def summarize(program):
+    functions = []
+    manager = program.getFunctionManager()
+    for function in manager.getFunctions(True):
+        if len(functions) >= MAX_FUNCTIONS:
+            break
+        functions.append({
+            "name": str(function.getName()),
+            "entry": str(function.getEntryPoint()),
+            "size": int(function.getBody().getNumAddresses()),
+            "thunk": bool(function.isThunk()),
+        })
+    imports = [{"library": str(symbol.getParentNamespace().getName()), "name": str(symbol.getName())}
+               for symbol in program.getSymbolTable().getExternalSymbols()]
+    return {
+        "tool": "ghidra",
+        "name": str(program.getName()),
+        "format": str(program.getExecutableFormat()),
+        "language": str(program.getLanguageID()),
+        "compiler": str(program.getCompilerSpec().getCompilerSpecID()),
+        "image_base": str(program.getImageBase()),
+        "md5": str(program.getExecutableMD5()),
+        "function_count": int(manager.getFunctionCount()),
+        "functions": functions,
+        "imports": imports,
+    }
+
+
+def analyze(project, path):
+    from java.io import File
+
+    program = project.importProgram(File(path))
+    if program is None:
+        raise ValueError("no Ghidra loader accepts this file")
+    try:
+        project.analyze(program)
+        return summarize(program)
+    finally:
+        # Imported programs are never saved, so the project stays empty between samples
+        project.close(program)
+
+
+def main(argv):
+    requests_fd, replies_fd = int(argv[1]), int(argv[2])
+    with os.fdopen(requests_fd, 'r') as requests, os.fdopen(replies_fd, 'w') as replies:
+        def reply(body):
+            replies.write(json.dumps(body) + "\n")
+            replies.flush()
+
+        try:
+            start_jvm()
+            from ghidra.base.project import GhidraProject
+
+            project_dir = tempfile.mkdtemp(prefix='ghidra-worker-')
+            # Temporary: Ghidra deletes it when the project is closed
+            project = GhidraProject.createProject(project_dir, 'pool', True)
+        except Exception as e:
+            reply({"error": f"{type(e).__name__}: {e}"})
+            return 1
+        reply({"ready": True, "pid": os.getpid()})
+
+        # Ends when the pool closes the pipe (recycling, or the CLI server exiting)
+        for line in requests:
+            start = time.perf_counter()
+            try:
+                body = {"ok": True, "result": analyze(project, json.loads(line)["path"])}
+            except Exception as e:
+                traceback.print_exc()
+                body = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            body["seconds"] = round(time.perf_counter() - start, 3)
+            reply(body)
+        project.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
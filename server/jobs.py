@@ -0,0 +1,268 @@
+# Background job execution for the CLI server
+import os
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import AdmissionCancelled, classify
+from capture import OutputCapture, pump
+from metrics import REGISTRY
+from parsers import parse_output
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+COMMAND_SECONDS = REGISTRY.histogram('cli_command_seconds', 'Run time of commands, from spawn to exit',
+                                     ('tool_class', 'status'))
+OUTPUT_BYTES = REGISTRY.counter('cli_command_output_bytes_total', 'Bytes of output commands printed',
+                                ('tool_class',))
+
+
+def record_run(command, status, seconds, output_bytes):
+    """Count one finished command in the run time and output metrics"""
+    tool_class = classify(command)
+    COMMAND_SECONDS.observe(seconds, tool_class=tool_class, status=status)
+    OUTPUT_BYTES.inc(output_bytes, tool_class=tool_class)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot accept more work"""
+
+
+class Job:
+    """A single shell command scheduled on the worker pool"""
+
+    def __init__(self, command, timeout, parse=False, task=None, store=False, analysis=None):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.timeout = timeout
+        self.parse = parse
+        self.parsed = None
+        # Natural-language task that produced the command, and whether the
+        # result goes to the result store (see JobManager on_finish)
+        self.task = task
+        self.store = store
+        # (sha256, tool, version, profile) when this is an analysis of a stored sample
+        self.analysis = analysis
+        self.result_id = None
+        self.status = QUEUED
+        self.exit_code = None
+        self.capture = OutputCapture()
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+        self.future = None
+        # Seconds per stage ("exec", and "parse" when parsed), for Server-Timing
+        self.timings = {}
+        # Set while a batch still reads this job's output; see JobManager.unpin
+        self.pinned = False
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "command": self.command,
+            "timeout": self.timeout,
+            "status": self.status,
+            "exit_code": self.exit_code,
+            "output": self.capture.preview(),
+            "output_bytes": self.capture.total,
+            "truncated": self.capture.truncated,
+            "parsed": self.parsed,
+            "error": self.error,
+            "result_id": self.result_id,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def kill_process_group(proc):
+    """Kill a shell started with start_new_session=True and all its children"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class JobManager:
+    """Runs commands on a bounded thread pool and keeps their results"""
+
+    def __init__(self, max_workers=4, max_queued=64, max_retained=200, admission=None, on_finish=None):
+        self.admission = admission
+        # Called with each background job once it has ended (e.g. to store its result)
+        self.on_finish = on_finish
+        self.max_queued = max_queued
+        self.max_retained = max_retained
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, command, timeout, parse=False, task=None, store=False, analysis=None):
+        """Queue a command and return its Job without waiting for it"""
+        job = Job(command, timeout, parse, task, store, analysis)
+        with self._lock:
+            queued = sum(1 for j in self._jobs.values() if j.status == QUEUED)
+            if queued >= self.max_queued:
+                raise QueueFullError(f"{queued} jobs already queued")
+            self._jobs[job.id] = job
+            self._evict_finished()
+            job.future = self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job. Jobs that already ended are forgotten.
+        Returns the Job, or None if the id is unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status not in ACTIVE_STATES:
+                del self._jobs[job_id]
+                if not job.pinned:
+                    job.capture.close()
+                return job
+            if job.status == QUEUED and (job.future is None or job.future.cancel()):
+                job.finished_at = time.time()
+            elif job.process is not None:
+                kill_process_group(job.process)
+            job.status = CANCELLED
+        if self.admission is not None:
+            # A job still waiting for its admission slot gives the wait up
+            self.admission.wake()
+        return job
+
+    def _evict_finished(self):
+        # Drop the oldest finished jobs once we retain too many (caller holds the lock)
+        excess = len(self._jobs) - self.max_retained
+        if excess <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values()
+                       if j.status not in ACTIVE_STATES and not j.pinned][:excess]:
+            self._jobs.pop(job_id).capture.close()
+
+    def unpin(self, pinned_jobs):
+        """
+        Hand pinned jobs back to normal retention once their batch is done with
+        them; outputs of the ones already forgotten are closed now.
+        """
+        with self._lock:
+            for job in pinned_jobs:
+                job.pinned = False
+                if job.id not in self._jobs:
+                    job.capture.close()
+            self._evict_finished()
+
+    def run_inline(self, command, timeout, parse=False):
+        """
+        Run a command in the calling thread (used by the synchronous /run, which
+        has already been admitted). The job is only retained, so its output can
+        be paged, when the output was too large to return inline.
+        """
+        job = Job(command, timeout, parse)
+        self._execute(job)
+        if job.capture.truncated:
+            with self._lock:
+                self._jobs[job.id] = job
+                self._evict_finished()
+        return job
+
+    def run_job(self, job):
+        """
+        Register an already-built Job and run it in the calling thread (used by
+        batch shards, which are admitted by their caller). While it runs it can
+        be inspected and cancelled through /jobs/<id> like any other job.
+        """
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict_finished()
+        self._execute(job)
+        return job
+
+    def _run(self, job):
+        # Background jobs wait for their tool's slot as long as needed (or until
+        # cancelled); their own queue (max_queued) is what bounds them
+        ticket = None
+        if self.admission is not None:
+            try:
+                ticket = self.admission.acquire(job.command, timeout=float('inf'), bounded=False,
+                                                cancelled=lambda: job.status == CANCELLED)
+            except AdmissionCancelled:
+                pass
+        try:
+            if job.status == CANCELLED:
+                # Cancelled before it started; it never runs
+                with self._lock:
+                    job.finished_at = job.finished_at or time.time()
+                return
+            self._execute(job)
+        finally:
+            if ticket is not None:
+                ticket.release()
+        if self.on_finish is not None and job.status != CANCELLED:
+            self.on_finish(job)
+
+    def _execute(self, job):
+        with self._lock:
+            if job.status == CANCELLED:
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                job.process = subprocess.Popen(
+                    job.command,
+                    shell=True,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=True,
+                )
+            except OSError as e:
+                job.status = FAILED
+                job.error = str(e)
+                job.finished_at = time.time()
+                return
+
+        proc = job.process
+        start = time.perf_counter()
+        timed_out = pump(proc, job.capture, job.timeout, lambda: kill_process_group(proc))
+        job.timings["exec"] = time.perf_counter() - start
+        parsed = None
+        if job.parse:
+            start = time.perf_counter()
+            parsed = parse_output(job.command, job.capture.iter_bytes())
+            job.timings["parse"] = time.perf_counter() - start
+
+        with self._lock:
+            job.parsed = parsed
+            job.exit_code = proc.returncode
+            job.finished_at = time.time()
+            job.process = None
+            # A cancelled job keeps its status
+            if job.status != CANCELLED:
+                if timed_out:
+                    job.status = TIMEOUT
+                    job.error = f"Command timed out after {job.timeout}s"
+                elif proc.returncode != 0:
+                    job.status = FAILED
+                    job.error = f"Command exited with status {proc.returncode}"
+                else:
+                    job.status = FINISHED
+        record_run(job.command, job.status, job.timings["exec"], job.capture.total)
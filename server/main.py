@@ -1,13 +1,196 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file
+from concurrent import futures
+import os
+import shlex
+import sqlite3
 import subprocess
+import time
+
+from artifacts import (ANALYZERS, AnalysisRunner, ArtifactStore, ArtifactTooLarge, DigestMismatch,
+                       SHA256_RE)
+from admission import AdmissionController, AdmissionRejected, ReleasingIterator, classify
+from batch import BATCH_MAX_SHARDS, Batch, BatchError, plan_batch
+from capture import MAX_PAGE_BYTES
+from ghidra_pool import GHIDRA_POOL_SIZE, GhidraPool, PoolUnavailable
+from jobs import FAILED, FINISHED, TIMEOUT, JobManager, QueueFullError, record_run
+from metrics import PROFILE_MAX_SECONDS, PROFILER_ENABLED, REGISTRY, ProfilerBusy, ServerTiming, profiler
+from parsers import parse_output
+from rescan import RESCAN_DEFAULT_OPTIONS, Rescan
+from result_cache import ResultCache
+from result_store import ResultStore
+from sessions import SessionBusyError, SessionClosedError, SessionLimitError, SessionManager
+from streaming import KEEPALIVE, STREAM_HEARTBEAT, sse_event, stream_command
+from utils import registry
+from wordlists import WordlistError, WordlistStore
 
 app = Flask(__name__)
 
+# Worker pool for /jobs; sized from env so heavy scanners can be tuned per deployment
+JOB_WORKERS = int(os.environ.get('CLI_JOB_WORKERS', '4'))
+JOB_MAX_QUEUED = int(os.environ.get('CLI_JOB_MAX_QUEUED', '64'))
+JOB_DEFAULT_TIMEOUT = int(os.environ.get('CLI_JOB_DEFAULT_TIMEOUT', '600'))
+JOB_MAX_TIMEOUT = int(os.environ.get('CLI_JOB_MAX_TIMEOUT', '7200'))
+RUN_TIMEOUT = 30
+# Keep results of tool runs in the SQLite result store (CLI_RESULT_STORE=0 disables it)
+RESULT_STORE_ENABLED = os.environ.get('CLI_RESULT_STORE', '1') != '0'
+
+store = ResultStore() if RESULT_STORE_ENABLED else None
+
+# Helper: store one result; a storage failure must never fail the command itself
+def save_result(command, chunks, status, exit_code, parsed=None, task=None, source="run"):
+    if store is None:
+        return None
+    try:
+        return store.add(command, chunks, status, exit_code, parsed, task, source)
+    except (sqlite3.Error, OSError) as e:
+        app.logger.warning("could not store result of %r: %s", command, e)
+        return None
+
+# Helper: tool runs are stored by default, interactive shell commands only when asked
+def should_store(data, cmd):
+    if store is None:
+        return False
+    if data.get('store') is None:
+        return classify(cmd) != 'interactive'
+    return bool(data.get('store'))
+
+# Helper: stream_command callback that stores the finished run
+def result_saver(cmd, task):
+    def on_finish(capture, exit_code, status, parsed):
+        return save_result(cmd, capture.iter_bytes(), status, exit_code, parsed, task)
+    return on_finish
+
+# Helper: JobManager callback for background jobs
+def store_job(job):
+    if job.store:
+        job.result_id = save_result(job.command, job.capture.iter_bytes(), job.status,
+                                    job.exit_code, job.parsed, job.task, "analysis" if job.analysis else "job")
+    if job.analysis and job.result_id is not None:
+        try:
+            analyses.record(job)
+        except sqlite3.Error as e:
+            app.logger.warning("could not record analysis of %s: %s", job.analysis[0], e)
+
+# Per-tool concurrency limits and a bounded priority queue shared by /run and /jobs
+admission = AdmissionController()
+jobs = JobManager(max_workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, admission=admission,
+                  on_finish=store_job)
+
+# Uploaded samples, stored by sha256, and their (cached) peframe/Ghidra analyses
+artifacts = ArtifactStore()
+analyses = AnalysisRunner(artifacts, jobs, store)
+
+# Sorted, deduplicated wordlists and their shards for parallel runs
+wordlists = WordlistStore()
+
+# Results of read-only commands (cat, ls, whois, ...) for requests that send "cache": true
+results = ResultCache()
+
+# Persistent bash sessions for interactive workflows (no fork+exec per command)
+sessions = SessionManager()
+
+# Warm headless Ghidra workers, used through categories/reverse_engineering/ghidra/ghidra-pool.sh.
+# Started by the first request (see start_ghidra_pool), not on import
+ghidra = GhidraPool()
+
+HTTP_SECONDS = REGISTRY.histogram('cli_http_request_seconds', 'Time to response headers per endpoint',
+                                  ('endpoint', 'method', 'status'))
+
+# Values kept by the components themselves, read when /metrics is scraped
+def collect_metrics():
+    classes = admission.stats()["classes"]
+    cache = results.stats()
+    pool = ghidra.stats()
+    return [
+        ("cli_admission_running", "gauge", "Commands holding a run slot",
+         [({"tool_class": c}, v["running"]) for c, v in classes.items()]),
+        ("cli_admission_waiting", "gauge", "Commands waiting for a run slot",
+         [({"tool_class": c}, v["waiting"]) for c, v in classes.items()]),
+        ("cli_result_cache_hits_total", "counter", "Read-only commands answered from the result cache",
+         [({}, cache["hits"])]),
+        ("cli_result_cache_misses_total", "counter", "Cacheable commands that had to run",
+         [({}, cache["misses"])]),
+        ("cli_result_cache_bytes", "gauge", "Bytes held by the result cache", [({}, cache["bytes"])]),
+        ("cli_sessions_open", "gauge", "Open persistent shell sessions", [({}, len(sessions.list()))]),
+        ("cli_ghidra_pool_workers", "gauge", "Warm Ghidra workers alive or starting", [({}, pool["workers"])]),
+        ("cli_ghidra_pool_busy", "gauge", "Warm Ghidra workers analyzing a sample", [({}, pool["busy"])]),
+    ]
+
+REGISTRY.register(collect_metrics)
+
+# Helper: bring the Ghidra pool up (socket and JVMs) once the server is actually serving
+@app.before_request
+def start_ghidra_pool():
+    if GHIDRA_POOL_SIZE > 0 and not ghidra.started:
+        try:
+            ghidra.start()
+        except PoolUnavailable as e:
+            app.logger.warning("Ghidra worker pool not started: %s", e)
+
+# Every response carries Server-Timing: the stages a handler recorded in g.timing, plus total
+@app.before_request
+def start_timing():
+    g.timing = ServerTiming()
+    g.started = time.perf_counter()
+
+@app.after_request
+def finish_timing(response):
+    timing = g.get('timing')
+    if timing is None:
+        return response
+    elapsed = time.perf_counter() - g.started
+    timing.add("total", elapsed)
+    response.headers["Server-Timing"] = timing.header()
+    HTTP_SECONDS.observe(elapsed, endpoint=request.endpoint or "unmatched", method=request.method,
+                         status=response.status_code)
+    return response
+
+# Helper: 429 with Retry-After when admission control turns a command away
+def rejected_response(e):
+    resp = jsonify({"error": "too many running commands", "detail": str(e), "retry_after": e.retry_after})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 429
+
+# Helper: read and bound the optional "timeout" field; returns (timeout, error)
+def parse_timeout(data):
+    try:
+        timeout = int(data.get('timeout', JOB_DEFAULT_TIMEOUT))
+    except (TypeError, ValueError):
+        return None, "timeout must be an integer"
+    if timeout <= 0 or timeout > JOB_MAX_TIMEOUT:
+        return None, f"timeout must be between 1 and {JOB_MAX_TIMEOUT}"
+    return timeout, None
+
+# Helper: check the optional session "env" field; returns (env, error)
+def parse_env(data):
+    env = data.get('env')
+    if env is None:
+        return None, None
+    if not isinstance(env, dict):
+        return None, "env must be an object of names to values"
+    for name, value in env.items():
+        if not name or '=' in name or '\0' in name:
+            return None, f"invalid environment variable name: {name!r}"
+        if not isinstance(value, str) or '\0' in value:
+            return None, f"env value for {name} must be a string"
+    return env, None
+
 @app.route('/run', methods=['POST'])
 def run_command():
     """
-    Accepts: { "command": "<shell command>" }
+    Accepts: { "command": "<shell command>", "stream": false, "timeout": <seconds, stream only>,
+               "parse": false, "cache": false, "task": "<optional>", "store": <optional> }
     Runs the command inside the container and returns the output.
+    With "stream": true the output is sent as Server-Sent Events while the
+    command runs (see streaming.stream_command) instead of after it exits.
+    With "parse": true, known tools (nmap, sqlmap, peframe --json) also get a
+    structured "parsed" result (see parsers.py); it is null for other commands.
+    With "cache": true, read-only commands are answered from the result cache
+    when possible (see result_cache.py); "cache" in the response is "hit", "miss",
+    or "bypass" for commands that are never cached.
+    Tool runs are kept in the result store (see result_store.py) and the response
+    carries their "result_id"; "store" forces storing on or off, "task" is
+    recorded with the result.
     """
     data = request.json or {}
     cmd = data.get('command', '').strip()
@@ -15,24 +198,697 @@ def run_command():
     if not cmd:
         return jsonify({"error": "command required"}), 400
 
+    # A cache hit answers without spawning a shell or taking a run slot
+    cache_key = None
+    if data.get('cache') and not data.get('stream'):
+        with g.timing.stage("cache"):
+            cache_key = results.key(cmd, bool(data.get('parse')))
+            cached = results.get(cache_key) if cache_key else None
+        if cached is not None:
+            return jsonify(dict(cached, cache="hit"))
+
+    timeout, error = parse_timeout(data) if data.get('stream') else (RUN_TIMEOUT, None)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Wait for a slot for this tool class; interactive commands are served first
     try:
-        # Execute the command in the container's shell
-        output = subprocess.check_output(
-            cmd,
-            shell=True,
-            stderr=subprocess.STDOUT,
-            timeout=30
+        ticket = admission.acquire(cmd)
+    except AdmissionRejected as e:
+        return rejected_response(e)
+    g.timing.add("queue", ticket.queue_seconds)
+
+    task = data.get('task')
+    if data.get('stream'):
+        on_finish = result_saver(cmd, task) if should_store(data, cmd) else None
+        return Response(
+            ReleasingIterator(stream_command(cmd, timeout, bool(data.get('parse')), on_finish), ticket),
+            mimetype='text/event-stream',
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
-        return jsonify({"output": output.decode(errors='ignore')})
-    except subprocess.CalledProcessError as e:
-        # Command returned non-zero exit code
-        return jsonify({
-            "output": e.output.decode(errors='ignore'),
-            "error": str(e)
-        }), 400
-    except subprocess.TimeoutExpired:
-        return jsonify({"output": "Command timed out"}), 408
+
+    # Execute the command in the container's shell; output goes through a
+    # bounded capture so huge outputs come back as head + tail plus a job id
+    prints = results.snapshot(cmd) if cache_key else ()
+    with ticket:
+        job = jobs.run_inline(cmd, timeout, bool(data.get('parse')))
+    for stage, seconds in job.timings.items():
+        g.timing.add(stage, seconds)
+    result_id = None
+    if should_store(data, cmd):
+        with g.timing.stage("store"):
+            result_id = save_result(cmd, job.capture.iter_bytes(), job.status, job.exit_code, job.parsed, task)
+    body = {"output": job.capture.preview()}
+    if result_id is not None:
+        body["result_id"] = result_id
+    if job.parse:
+        body["parsed"] = job.parsed
+    if job.capture.truncated:
+        body.update({"truncated": True, "output_bytes": job.capture.total, "job_id": job.id})
+    else:
+        job.capture.close()
+
+    if job.status == TIMEOUT:
+        body["output"] = "Command timed out"
+        return jsonify(body), 408
+    if job.status == FAILED:
+        # Command returned non-zero exit code (or could not be started)
+        body["error"] = job.error if job.exit_code is None else str(
+            subprocess.CalledProcessError(job.exit_code, cmd))
+        return jsonify(body), 400
+    if cache_key:
+        # Only complete, successful output is worth repeating
+        if job.status == FINISHED and not job.capture.truncated:
+            results.put(cache_key, cmd, dict(body), prints)
+        body["cache"] = "miss"
+    elif data.get('cache'):
+        body["cache"] = "bypass"
+    return jsonify(body)
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Accepts: { "command": "<shell command>", "timeout": <seconds, optional>, "parse": false,
+               "task": "<optional>", "store": <optional> }
+    Queues the command on the worker pool and returns immediately with the job id.
+    Once stored, the finished job reports its "result_id".
+    """
+    data = request.json or {}
+    cmd = data.get('command', '').strip()
+    if not cmd:
+        return jsonify({"error": "command required"}), 400
+
+    timeout, error = parse_timeout(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        job = jobs.submit(cmd, timeout, bool(data.get('parse')), data.get('task'), should_store(data, cmd))
+    except QueueFullError as e:
+        return jsonify({"error": "job queue full", "detail": str(e)}), 503
+
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Returns status, exit code and output of a job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """Cancels a queued/running job, or forgets a job that already ended"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.to_dict())
+
+# Helper: parse "Range: bytes=a-b" / "bytes=a-" into (start, end_exclusive)
+def parse_range(header, total):
+    if not header or not header.startswith('bytes='):
+        return None
+    first, _, last = header[6:].split(',')[0].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) + 1 if last else total
+        else:
+            # suffix range: last N bytes
+            start = max(0, total - int(last))
+            end = total
+    except ValueError:
+        return None
+    return start, min(end, total)
+
+@app.route('/jobs/<job_id>/output', methods=['GET'])
+def get_job_output(job_id):
+    """
+    Pages through the full captured output of a job.
+    Either ?offset=<n>&limit=<n> or a standard "Range: bytes=a-b" header.
+    Pages are capped at CLI_CAPTURE_MAX_PAGE_BYTES; X-Total-Bytes and
+    X-Next-Offset tell the client where to continue.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    total = job.capture.total
+
+    byte_range = parse_range(request.headers.get('Range'), total)
+    if byte_range is not None:
+        start, end = byte_range
+        if start >= total and total > 0:
+            return Response(status=416, headers={"Content-Range": f"bytes */{total}"})
+        end = min(end, start + MAX_PAGE_BYTES)
+        status = 206
+    else:
+        try:
+            start = max(0, int(request.args.get('offset', 0)))
+            limit = int(request.args.get('limit', MAX_PAGE_BYTES))
+        except ValueError:
+            return jsonify({"error": "offset and limit must be integers"}), 400
+        end = min(total, start + max(0, min(limit, MAX_PAGE_BYTES)))
+        status = 200
+
+    headers = {
+        "X-Total-Bytes": str(total),
+        "X-Next-Offset": str(max(start, end)),
+        "X-Job-Status": job.status,
+        "Accept-Ranges": "bytes",
+    }
+    if status == 206:
+        headers["Content-Range"] = f"bytes {start}-{max(start, end) - 1}/{total}"
+    return Response(job.capture.iter_bytes(start, end), status=status,
+                    mimetype='text/plain', headers=headers)
+
+@app.route('/admission', methods=['GET'])
+def admission_stats():
+    """Running/waiting counts and limits per tool class"""
+    return jsonify(admission.stats())
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    """
+    Accepts: { "cwd": "<dir, optional>", "env": {"NAME": "value", ...} }
+    Starts a long-lived shell; commands sent to /sessions/<id>/run share its
+    working directory and environment.
+    """
+    data = request.get_json(silent=True) or {}
+    cwd = data.get('cwd')
+    if cwd is not None and not isinstance(cwd, str):
+        return jsonify({"error": "cwd must be a string"}), 400
+    if cwd and not os.path.isdir(cwd):
+        return jsonify({"error": "cwd is not a directory"}), 400
+    env, error = parse_env(data)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        session = sessions.create(cwd, env)
+    except SessionLimitError as e:
+        return jsonify({"error": "too many sessions", "detail": str(e)}), 503
+    return jsonify(session.to_dict()), 201
+
+@app.route('/sessions', methods=['GET'])
+def list_sessions():
+    """Lists open sessions"""
+    return jsonify({"sessions": [s.to_dict() for s in sessions.list()],
+                    "max_sessions": sessions.max_sessions,
+                    "idle_timeout": sessions.idle_timeout})
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "session not found"}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/sessions/<session_id>/run', methods=['POST'])
+def run_in_session(session_id):
+    """
+    Accepts: { "command": "<shell command>", "timeout": <seconds, default 30>, "parse": false }
+    Runs the command in the session's shell and returns output and exit_code.
+    A command that times out closes the session (408).
+    """
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "session not found"}), 404
+    data = request.json or {}
+    cmd = data.get('command', '').strip()
+    if not cmd:
+        return jsonify({"error": "command required"}), 400
+    timeout, error = parse_timeout(data) if 'timeout' in data else (RUN_TIMEOUT, None)
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        ticket = admission.acquire(cmd)
+    except AdmissionRejected as e:
+        return rejected_response(e)
+    g.timing.add("queue", ticket.queue_seconds)
+    started = time.perf_counter()
+    try:
+        with ticket:
+            exit_code, capture, timed_out = session.run(cmd, timeout)
+    except SessionBusyError as e:
+        return jsonify({"error": "session busy", "detail": str(e)}), 409
+    except SessionClosedError as e:
+        sessions.close(session_id)
+        return jsonify({"error": "session closed", "detail": str(e)}), 410
+
+    elapsed = time.perf_counter() - started
+    g.timing.add("exec", elapsed)
+    record_run(cmd, "timeout" if timed_out else "finished" if exit_code == 0 else "failed",
+               elapsed, capture.total)
+    body = {"output": capture.preview(), "exit_code": exit_code, "session_id": session_id}
+    if data.get('parse'):
+        with g.timing.stage("parse"):
+            body["parsed"] = parse_output(cmd, capture.iter_bytes())
+    if capture.truncated:
+        body.update({"truncated": True, "output_bytes": capture.total})
+    capture.close()
+    if timed_out:
+        sessions.close(session_id)
+        body["error"] = "Command timed out; session closed"
+        return jsonify(body), 408
+    return jsonify(body)
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """Kills the session's shell and everything it started"""
+    session = sessions.close(session_id)
+    if session is None:
+        return jsonify({"error": "session not found"}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/batch', methods=['POST'])
+def run_batch():
+    """
+    Accepts: { "command": "nmap -sV 10.0.0.0/22", "shards": <max shards, optional>,
+               "timeout": <seconds per shard>, "stream": false }
+          or { "command": "whois {target}", "targets": ["a.com", "b.com"], ... }
+          or { "command": "sqlmap -m {wordlist} --batch", "wordlist": "<compiled list>", "shards": <optional> }
+    Splits the targets (CIDR ranges are cut into subnets) into shards that run in
+    parallel under the per-tool admission limits, then merges their results.
+    With "stream": true the response is SSE: a "plan" event, one "shard" event per
+    finished shard, then "report" (merged parse result), "stored" and "done".
+    """
+    data = request.json or {}
+    cmd = data.get('command', '').strip()
+    if not cmd:
+        return jsonify({"error": "command required"}), 400
+    timeout, error = parse_timeout(data)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        max_shards = min(BATCH_MAX_SHARDS, max(1, int(data.get('shards') or BATCH_MAX_SHARDS)))
+    except (TypeError, ValueError):
+        return jsonify({"error": "shards must be an integer"}), 400
+    try:
+        wordlist_shards = None
+        if data.get('wordlist'):
+            # One slice per run slot of the tool unless "shards" asks for a number
+            count = max_shards if data.get('shards') else min(BATCH_MAX_SHARDS, admission.limits.get(classify(cmd), 1))
+            wordlist_shards = wordlists.shard(data['wordlist'], count)
+        shards = plan_batch(cmd, data.get('targets'), max_shards, wordlist_shards)
+    except (BatchError, WordlistError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    batch = Batch(cmd, shards, timeout)
+    store_batch = should_store(data, cmd)
+
+    # Helper: one stored result for the whole batch, with the merged report
+    def save_batch(report):
+        if not store_batch:
+            return None
+        return save_result(cmd, batch.iter_output(), batch.status, None, report, data.get('task'), "batch")
+
+    if data.get('stream'):
+        def generate():
+            try:
+                yield sse_event("plan", batch.plan())
+                for index in batch.run(jobs, admission, heartbeat=STREAM_HEARTBEAT):
+                    if index is None:
+                        yield KEEPALIVE
+                        continue
+                    yield sse_event("shard", batch.shard_result(index))
+                report = batch.report()
+                yield sse_event("report", report)
+                result_id = save_batch(report)
+                if result_id is not None:
+                    yield sse_event("stored", {"result_id": result_id})
+                yield sse_event("done", batch.summary())
+            finally:
+                batch.close(jobs)
+
+        return Response(generate(), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    try:
+        for _ in batch.run(jobs, admission):
+            pass
+        report = batch.report()
+        body = dict(batch.summary(), shards=[batch.shard_result(i) for i in range(len(batch.jobs))],
+                    report=report)
+        result_id = save_batch(report)
+    finally:
+        batch.close(jobs)
+    if result_id is not None:
+        body["result_id"] = result_id
+    return jsonify(body)
+
+# Helper: 503 for the /results endpoints when the store is disabled
+def store_disabled():
+    return jsonify({"error": "result store disabled (CLI_RESULT_STORE=0)"}), 503
+
+@app.route('/rescan', methods=['POST'])
+def run_rescan():
+    """
+    Accepts: { "command": "nmap -sS -O -sV --top-ports 1000 10.0.0.0/24", "full": false,
+               "timeout": <seconds per shard>, "stream": false, "task": "<optional>" }
+          or { "targets": ["10.0.0.0/24"] } for the quick-scan.sh profile
+    Incremental scan against the snapshots of earlier rescans with the same
+    options: a discovery pass without -sV/-O/scripts, then detection only for
+    ports that are new or changed (and a full one for hosts seen for the first
+    time or not fully scanned for CLI_RESCAN_MAX_AGE). The response has the
+    merged "report", a "diff" against the previous snapshots and per-phase timings.
+    With "stream": true the response is SSE: "progress", "discovery", "plan",
+    "shard", "report", "diff", "stored" and "done" events ("error" if discovery fails).
+    """
+    if store is None:
+        return store_disabled()
+    data = request.json or {}
+    cmd = data.get('command', '').strip()
+    if not cmd:
+        targets = data.get('targets')
+        if not isinstance(targets, list) or not targets:
+            return jsonify({"error": "command or targets required"}), 400
+        cmd = shlex.join(['nmap'] + shlex.split(RESCAN_DEFAULT_OPTIONS) + [str(t) for t in targets])
+    timeout, error = parse_timeout(data)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        rescan = Rescan(cmd, store, timeout, full=bool(data.get('full')))
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Helper: the merged report is stored like any scan, then the snapshots point at it
+    def finish():
+        result_id = None
+        if data.get('store', True):
+            result_id = save_result(cmd, rescan.iter_output(), rescan.status, None,
+                                    rescan.report, data.get('task'), "rescan")
+        try:
+            rescan.save(result_id)
+        except sqlite3.Error as e:
+            app.logger.warning("could not save snapshots of %r: %s", cmd, e)
+        return result_id
+
+    if data.get('stream'):
+        def generate():
+            failed = False
+            for event, payload in rescan.run(jobs, admission, heartbeat=STREAM_HEARTBEAT):
+                if event == "keepalive":
+                    yield KEEPALIVE
+                    continue
+                failed = failed or event == "error"
+                yield sse_event(event, payload)
+            if not failed:
+                result_id = finish()
+                if result_id is not None:
+                    yield sse_event("stored", {"result_id": result_id})
+            yield sse_event("done", rescan.summary())
+
+        return Response(generate(), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    body = {"command": cmd, "shards": []}
+    for event, payload in rescan.run(jobs, admission):
+        if event == "shard":
+            body["shards"].append(payload)
+        elif event == "error":
+            body.update(payload)
+        elif event != "progress":
+            body[event] = payload
+    if "error" in body:
+        return jsonify(dict(body, **rescan.summary())), 502
+    result_id = finish()
+    if result_id is not None:
+        body["result_id"] = result_id
+    body.update(rescan.summary())
+    return jsonify(body)
+
+@app.route('/results', methods=['GET'])
+def list_results():
+    """
+    Stored results, newest first, without their output.
+    Filters: ?target=&tool=&task=&status=&since=<epoch>&until=<epoch>
+    Paging: ?limit=50&cursor=<next_cursor from the previous page>
+    """
+    if store is None:
+        return store_disabled()
+    args = request.args
+    try:
+        items, next_cursor = store.query(
+            target=args.get('target'), tool=args.get('tool'), task=args.get('task'),
+            status=args.get('status'), since=args.get('since'), until=args.get('until'),
+            before_id=args.get('cursor'), limit=args.get('limit', 50))
+    except ValueError:
+        return jsonify({"error": "since, until, cursor and limit must be numbers"}), 400
+    return jsonify({"results": items, "next_cursor": next_cursor})
+
+@app.route('/results/<int:result_id>', methods=['GET'])
+def get_result(result_id):
+    """One stored result with its parsed data and summary"""
+    if store is None:
+        return store_disabled()
+    item = store.get(result_id)
+    if item is None:
+        return jsonify({"error": "result not found"}), 404
+    return jsonify(item)
+
+@app.route('/results/<int:result_id>/output', methods=['GET'])
+def get_result_output(result_id):
+    """Full stored output, decompressed as it is sent"""
+    if store is None:
+        return store_disabled()
+    chunks = store.iter_output(result_id)
+    if chunks is None:
+        return jsonify({"error": "result not found"}), 404
+    return Response(chunks, mimetype='text/plain')
+
+@app.route('/results/<int:result_id>', methods=['PATCH'])
+def update_result(result_id):
+    """Accepts: { "summary": "...", "task": "..." } to annotate a stored result"""
+    if store is None:
+        return store_disabled()
+    data = request.json or {}
+    if not store.update(result_id, data.get('summary'), data.get('task')):
+        return jsonify({"error": "result not found"}), 404
+    return jsonify(store.get(result_id))
+
+@app.route('/results/<int:result_id>', methods=['DELETE'])
+def delete_result(result_id):
+    if store is None:
+        return store_disabled()
+    if not store.delete(result_id):
+        return jsonify({"error": "result not found"}), 404
+    return jsonify({"deleted": result_id})
+
+@app.route('/results/stats', methods=['GET'])
+def result_stats():
+    """Row/blob counts and raw vs compressed bytes"""
+    if store is None:
+        return store_disabled()
+    return jsonify(store.stats())
+
+@app.route('/artifacts', methods=['POST'])
+def upload_artifact():
+    """
+    Raw request body = the sample (Content-Type: application/octet-stream).
+    Optional ?sha256= or X-Content-SHA256: upload is rejected if the bytes hash differently.
+    The body is hashed while it is written to disk, never held in memory.
+    Returns 201 for a new sample, 200 if it was already stored, with its known analyses.
+    """
+    expected = request.args.get('sha256') or request.headers.get('X-Content-SHA256')
+    if expected and not SHA256_RE.match(expected.lower()):
+        return jsonify({"error": "sha256 must be 64 hex digits"}), 400
+    if request.content_length is not None and request.content_length > artifacts.max_bytes:
+        return jsonify({"error": f"sample is larger than {artifacts.max_bytes} bytes"}), 413
+    try:
+        with g.timing.stage("upload"):
+            sha256, size, created = artifacts.put(request.stream, expected)
+    except ArtifactTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except DigestMismatch as e:
+        return jsonify({"error": "sha256 mismatch", "detail": str(e)}), 400
+    body = {"sha256": sha256, "size": size, "created": created, "analyses": analyses.cached(sha256)}
+    return jsonify(body), 201 if created else 200
+
+@app.route('/artifacts/<sha256>', methods=['GET', 'HEAD'])
+def get_artifact(sha256):
+    """Size of a stored sample and its cached analyses; HEAD answers "is it known?" """
+    info = artifacts.info(sha256.lower())
+    if info is None:
+        return jsonify({"error": "artifact not found"}), 404
+    info["analyses"] = analyses.cached(info["sha256"])
+    return jsonify(info)
+
+@app.route('/artifacts/<sha256>/content', methods=['GET'])
+def get_artifact_content(sha256):
+    path = artifacts.path(sha256.lower())
+    if path is None:
+        return jsonify({"error": "artifact not found"}), 404
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=sha256.lower(), conditional=True)
+
+@app.route('/artifacts/<sha256>', methods=['DELETE'])
+def delete_artifact(sha256):
+    """Removes the sample; its stored analyses stay in /results"""
+    if not artifacts.delete(sha256.lower()):
+        return jsonify({"error": "artifact not found"}), 404
+    return jsonify({"deleted": sha256.lower()})
+
+@app.route('/artifacts/<sha256>/analyze', methods=['POST'])
+def analyze_artifact(sha256):
+    """
+    Accepts: { "tool": "peframe" | "ghidra", "refresh": false, "wait": false, "task": "<optional>" }
+    A sample already analyzed by the same tool version is answered from the
+    result store (200, "cache": "hit"). Otherwise the analysis runs as a
+    background job (202 with the job; poll /jobs/<id>), or, with "wait": true,
+    the response is held until it ends.
+    """
+    data = request.json or {}
+    tool = data.get('tool', 'peframe')
+    if tool not in ANALYZERS:
+        return jsonify({"error": f"tool must be one of {', '.join(ANALYZERS)}"}), 400
+    try:
+        with g.timing.stage("lookup"):
+            kind, found = analyses.analyze(sha256.lower(), tool, bool(data.get('refresh')), data.get('task'))
+    except KeyError:
+        return jsonify({"error": "artifact not found"}), 404
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 503
+    except QueueFullError as e:
+        return jsonify({"error": "job queue full", "detail": str(e)}), 503
+    if kind == "hit":
+        return jsonify({"cache": "hit", "result": store.get(found)})
+    if not data.get('wait'):
+        return jsonify(dict(found.to_dict(), cache="miss")), 202
+    with g.timing.stage("analyze"):
+        futures.wait([found.future])
+    body = dict(found.to_dict(), cache="miss")
+    if found.result_id is not None:
+        body["result"] = store.get(found.result_id)
+    return jsonify(body)
+
+@app.route('/wordlists', methods=['GET'])
+def list_wordlists():
+    """Compiled wordlists (entries, bytes, sources) and the source files that can be compiled"""
+    return jsonify(wordlists.list())
+
+@app.route('/wordlists', methods=['POST'])
+def compile_wordlist():
+    """
+    Accepts: { "name": "sqli-targets", "sources": ["urls.txt", "<compiled list>", "sub/dir.txt"],
+               "lowercase": false, "strip_comments": false }
+    Builds a compiled list: entries stripped, blank lines dropped, deduplicated and
+    sorted, from source files (sorted in parallel) and/or compiled lists (merged).
+    Source files must be inside CLI_WORDLIST_DIR; lowercase/strip_comments are
+    applied to them, and compiled lists must already have been built with them.
+    Compiling to an existing name replaces it.
+    """
+    data = request.json or {}
+    try:
+        with g.timing.stage("compile"):
+            meta = wordlists.compile(data.get('name'), data.get('sources'), bool(data.get('lowercase')),
+                                     bool(data.get('strip_comments')))
+    except WordlistError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(meta), 201
+
+@app.route('/wordlists/<name>', methods=['GET'])
+def get_wordlist(name):
+    """
+    Metadata of a compiled list. ?contains=<word> answers whether it is in the
+    list (binary search); ?offset=&limit= returns a page of entries.
+    """
+    try:
+        wordlist = wordlists.open(name)
+    except WordlistError as e:
+        return jsonify({"error": str(e)}), 400
+    if wordlist is None:
+        return jsonify({"error": "wordlist not found"}), 404
+    try:
+        body = wordlist.to_dict()
+        if 'contains' in request.args:
+            body["contains"] = request.args['contains'].encode() in wordlist
+        if 'offset' in request.args or 'limit' in request.args:
+            try:
+                offset = max(0, int(request.args.get('offset', 0)))
+                limit = min(10000, max(0, int(request.args.get('limit', 100))))
+            except ValueError:
+                return jsonify({"error": "offset and limit must be integers"}), 400
+            body["entries"] = [w.decode(errors='replace') for w in wordlist.entries(offset, offset + limit)]
+            body["offset"] = offset
+        return jsonify(body)
+    finally:
+        wordlist.close()
+
+@app.route('/wordlists/<name>/shards', methods=['POST'])
+def shard_wordlist(name):
+    """Accepts: { "shards": N }. Paths of N contiguous slices, for commands run outside /batch"""
+    data = request.json or {}
+    try:
+        count = int(data.get('shards', 2))
+    except (TypeError, ValueError):
+        return jsonify({"error": "shards must be an integer"}), 400
+    if not 1 <= count <= BATCH_MAX_SHARDS:
+        return jsonify({"error": f"shards must be between 1 and {BATCH_MAX_SHARDS}"}), 400
+    try:
+        return jsonify({"name": name, "shards": wordlists.shard(name, count)})
+    except WordlistError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/wordlists/<name>', methods=['DELETE'])
+def delete_wordlist(name):
+    try:
+        deleted = wordlists.delete(name)
+    except WordlistError as e:
+        return jsonify({"error": str(e)}), 400
+    if not deleted:
+        return jsonify({"error": "wordlist not found"}), 404
+    return jsonify({"deleted": name})
+
+@app.route('/tools', methods=['GET'])
+def list_tools():
+    """
+    Categories, tools, their scripts and resolved binary paths, from the
+    in-memory registry. Supports If-None-Match so pollers get a cheap 304.
+    """
+    tools = registry.snapshot()
+    etag = registry.etag
+    if etag and request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+    resp = jsonify(dict(tools, generation=registry.generation))
+    resp.headers["ETag"] = f'"{etag}"'
+    return resp
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    """Entries, bytes and hit/miss counters of the result cache"""
+    return jsonify(results.stats())
+
+@app.route('/cache', methods=['DELETE'])
+def cache_clear():
+    """Drops every cached result"""
+    results.clear()
+    return jsonify(results.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Queue waits, run times, output bytes, cache and HTTP counters in Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile', methods=['GET'])
+def profile():
+    """
+    ?seconds=N (default 10): samples every thread's stack for N seconds and
+    returns collapsed stacks for flamegraph.pl / speedscope. Needs CLI_PROFILER=1.
+    """
+    if not PROFILER_ENABLED:
+        return jsonify({"error": "profiler disabled (set CLI_PROFILER=1)"}), 404
+    try:
+        seconds = float(request.args.get('seconds', '10'))
+    except ValueError:
+        return jsonify({"error": "seconds must be a number"}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"error": f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}), 400
+    try:
+        return Response(profiler.profile(seconds), mimetype='text/plain')
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
 
 if __name__ == '__main__':
     # Listen on all interfaces so web container can reach it
-    app.run(host='0.0.0.0', port=5000)
+    app.run(host='0.0.0.0', port=int(os.environ.get('CLI_PORT', '5000')), threaded=True)
@@ -0,0 +1,362 @@
+# Structured parsers for known tool outputs
+import json
+import os
+import re
+import shlex
+import time
+import xml.etree.ElementTree as ET
+
+from metrics import REGISTRY
+
+PARSE_SECONDS = REGISTRY.histogram('cli_parse_seconds', 'Time spent parsing tool output', ('tool',))
+
+# Output is fed to parsers in chunks so large captures are never loaded whole
+
+
+# Commands that run another command, and their options that take a separate value
+WRAPPERS = {
+    'sudo': {'-u', '--user', '-g', '--group', '-C', '--close-from', '-D', '--chdir', '-h', '--host',
+             '-p', '--prompt', '-r', '--role', '-t', '--type', '-U', '--other-user', '-T', '--command-timeout'},
+    'env': {'-u', '--unset', '-C', '--chdir'},
+    'nice': {'-n', '--adjustment'},
+    'timeout': {'-s', '--signal', '-k', '--kill-after'},
+    'nohup': set(),
+    'stdbuf': {'-i', '--input', '-o', '--output', '-e', '--error'},
+}
+
+
+def detect_tool(command):
+    """
+    Name of the tool a shell command runs: the first word after any wrappers
+    (sudo -u USER, env VAR=x, nice -n N, timeout DURATION, ...), their options
+    and VAR=value assignments, without its directory
+    """
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        words = command.split()
+    i = 0
+    while i < len(words):
+        word = words[i]
+        name = os.path.basename(word)
+        i += 1
+        if name in WRAPPERS:
+            takes_value = WRAPPERS[name]
+            while i < len(words) and words[i].startswith('-'):
+                option = words[i]
+                i += 1
+                if option == '--':
+                    break
+                if option in takes_value:
+                    i += 1
+            if name == 'timeout':
+                i += 1  # the duration
+            continue
+        if '=' in word:
+            continue
+        return name
+    return None
+
+
+def iter_lines(chunks):
+    """Turn an iterable of byte chunks into decoded lines"""
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode(errors='ignore').rstrip("\r")
+    if pending:
+        yield pending.decode(errors='ignore').rstrip("\r")
+
+
+# ---- nmap ----
+
+NMAP_REPORT_RE = re.compile(r"^Nmap scan report for (?:(?P<name>\S+) \((?P<addr>[^)]+)\)|(?P<only>\S+))")
+NMAP_PORT_RE = re.compile(r"^(?P<port>\d+)/(?P<proto>tcp|udp|sctp)\s+(?P<state>\S+)\s+(?P<service>\S+)(?:\s+(?P<version>.+))?$")
+NMAP_GUESS_RE = re.compile(r"([^,]+?) \((\d+)%\)")
+NMAP_DONE_RE = re.compile(r"^Nmap done: (\d+) IP address(?:es)? \((\d+) hosts? up\) scanned in ([\d.]+) seconds")
+
+
+def _new_host(address, hostname=None):
+    return {"address": address, "hostname": hostname, "status": "up", "ports": [], "os": []}
+
+
+def parse_nmap_text(lines):
+    hosts = []
+    stats = {}
+    host = None
+    for line in lines:
+        m = NMAP_REPORT_RE.match(line)
+        if m:
+            if m.group('only'):
+                host = _new_host(m.group('only'))
+            else:
+                host = _new_host(m.group('addr'), m.group('name'))
+            hosts.append(host)
+            continue
+        m = NMAP_DONE_RE.match(line)
+        if m:
+            stats = {"total": int(m.group(1)), "up": int(m.group(2)), "elapsed": float(m.group(3))}
+            continue
+        if host is None:
+            continue
+        m = NMAP_PORT_RE.match(line)
+        if m:
+            host["ports"].append({
+                "port": int(m.group('port')),
+                "protocol": m.group('proto'),
+                "state": m.group('state'),
+                "service": m.group('service'),
+                "version": (m.group('version') or "").strip(),
+            })
+        elif line.startswith("Host is down") or "host down" in line.lower():
+            host["status"] = "down"
+        elif line.startswith("OS details:"):
+            host["os"] = [{"name": name.strip(), "accuracy": None}
+                          for name in line.split(":", 1)[1].split(",") if name.strip()]
+        elif line.startswith("Aggressive OS guesses:") and not host["os"]:
+            host["os"] = [{"name": name.strip(), "accuracy": int(acc)}
+                          for name, acc in NMAP_GUESS_RE.findall(line.split(":", 1)[1])]
+        elif line.startswith("Running:") and not host["os"]:
+            host["os"] = [{"name": line.split(":", 1)[1].strip(), "accuracy": None}]
+    return {"tool": "nmap", "hosts": hosts, "stats": stats}
+
+
+def parse_nmap_xml(chunks):
+    """Incremental parse of -oX output; each <host> is dropped once read"""
+    parser = ET.XMLPullParser(events=("end",))
+    hosts = []
+    stats = {}
+
+    def drain():
+        for _, elem in parser.read_events():
+            if elem.tag == "host":
+                hosts.append(_xml_host(elem))
+                elem.clear()
+            elif elem.tag == "finished":
+                stats["elapsed"] = float(elem.get("elapsed", 0))
+            elif elem.tag == "hosts" and elem.get("up") is not None:
+                stats["up"] = int(elem.get("up"))
+                stats["total"] = int(elem.get("total", 0))
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        drain()
+    try:
+        parser.close()
+    except ET.ParseError:
+        # Truncated XML (timeout/kill): keep the hosts we already have
+        pass
+    drain()
+    return {"tool": "nmap", "hosts": hosts, "stats": stats}
+
+
+def _xml_host(elem):
+    address = None
+    for addr in elem.findall("address"):
+        if addr.get("addrtype") in ("ipv4", "ipv6") or address is None:
+            address = addr.get("addr")
+    hostname = elem.find("hostnames/hostname")
+    status = elem.find("status")
+    host = _new_host(address, hostname.get("name") if hostname is not None else None)
+    if status is not None:
+        host["status"] = status.get("state", "up")
+    for port in elem.findall("ports/port"):
+        state = port.find("state")
+        service = port.find("service")
+        version = ""
+        if service is not None:
+            version = " ".join(filter(None, (service.get("product"), service.get("version"), service.get("extrainfo"))))
+        host["ports"].append({
+            "port": int(port.get("portid")),
+            "protocol": port.get("protocol"),
+            "state": state.get("state") if state is not None else "unknown",
+            "service": service.get("name") if service is not None else "unknown",
+            "version": version,
+        })
+    for match in elem.findall("os/osmatch"):
+        host["os"].append({"name": match.get("name"), "accuracy": int(match.get("accuracy", 0))})
+    return host
+
+
+def parse_nmap(chunks):
+    chunks = iter(chunks)
+    first = next(chunks, b"")
+    rest = _prepend(first, chunks)
+    if first.lstrip().startswith(b"<?xml") or b"<nmaprun" in first[:2048]:
+        return parse_nmap_xml(rest)
+    return parse_nmap_text(iter_lines(rest))
+
+
+def _prepend(first, chunks):
+    yield first
+    yield from chunks
+
+
+# ---- sqlmap ----
+
+SQLMAP_PARAM_RE = re.compile(r"^Parameter: (?P<name>.+?) \((?P<place>[^)]+)\)")
+SQLMAP_FIELD_RE = re.compile(r"^\s+(Type|Title|Payload): (.*)$")
+SQLMAP_DBMS_RE = re.compile(r"^back-end DBMS: (.+)$")
+SQLMAP_LIST_RE = re.compile(r"^available databases \[\d+\]:")
+SQLMAP_NOT_INJECTABLE_RE = re.compile(r"(?:parameter '?([^' ]+)'? does not seem to be injectable|all tested parameters do not appear to be injectable)", re.I)
+
+
+def parse_sqlmap(chunks):
+    points = []
+    point = None
+    technique = None
+    dbms = None
+    databases = []
+    in_db_list = False
+    not_injectable = []
+    for line in iter_lines(chunks):
+        m = SQLMAP_PARAM_RE.match(line)
+        if m:
+            point = {"parameter": m.group('name'), "place": m.group('place'), "techniques": []}
+            points.append(point)
+            technique = None
+            continue
+        if line.strip() == "---":
+            point = None
+            continue
+        m = SQLMAP_FIELD_RE.match(line)
+        if m and point is not None:
+            field, value = m.group(1).lower(), m.group(2).strip()
+            if field == "type":
+                technique = {"type": value, "title": "", "payload": ""}
+                point["techniques"].append(technique)
+            elif technique is not None:
+                technique[field] = value
+            continue
+        m = SQLMAP_DBMS_RE.match(line)
+        if m:
+            dbms = m.group(1).strip()
+            continue
+        if SQLMAP_LIST_RE.match(line):
+            in_db_list = True
+            continue
+        if in_db_list:
+            if line.startswith("[*] "):
+                databases.append(line[4:].strip())
+                continue
+            in_db_list = False
+        m = SQLMAP_NOT_INJECTABLE_RE.search(line)
+        if m:
+            not_injectable.append(m.group(1) or "*")
+    return {
+        "tool": "sqlmap",
+        "vulnerable": bool(points),
+        "injection_points": points,
+        "dbms": dbms,
+        "databases": databases,
+        "not_injectable": not_injectable,
+    }
+
+
+# ---- peframe ----
+
+def _find_key(obj, names):
+    # Depth-first search for the first value stored under any of `names`
+    if isinstance(obj, dict):
+        for name in names:
+            if name in obj:
+                return obj[name]
+        for value in obj.values():
+            found = _find_key(value, names)
+            if found is not None:
+                return found
+    elif isinstance(obj, list):
+        for value in obj:
+            found = _find_key(value, names)
+            if found is not None:
+                return found
+    return None
+
+
+def parse_peframe(chunks):
+    """Parses `peframe --json` output; plain-text reports return None"""
+    # peframe reports are a few KB of JSON, so reading them whole is fine
+    raw = b"".join(chunks)
+    start = raw.find(b"{")
+    if start < 0:
+        return None
+    try:
+        report = json.loads(raw[start:].decode(errors='ignore'))
+    except ValueError:
+        return None
+    sections = _find_key(report, ("sections",)) or []
+    if isinstance(sections, dict):
+        sections = sections.get("details", [])
+    imports = _find_key(report, ("imports", "import")) or {}
+    if isinstance(imports, list):
+        # [{"dll": "...", "functions": [...]}] or [{"library": ..., "function": ...}]
+        grouped = {}
+        for item in imports:
+            if isinstance(item, dict):
+                dll = item.get("dll") or item.get("library") or "?"
+                funcs = item.get("functions") or item.get("function") or []
+                grouped.setdefault(dll, []).extend(funcs if isinstance(funcs, list) else [funcs])
+        imports = grouped
+    return {
+        "tool": "peframe",
+        "filename": report.get("filename"),
+        "filetype": report.get("filetype"),
+        "filesize": report.get("filesize"),
+        "hashes": report.get("hashes") or {},
+        "imphash": _find_key(report, ("imphash",)),
+        "sections": [
+            {
+                "name": s.get("section_name") or s.get("name"),
+                "size": s.get("size_of_data") or s.get("size"),
+                "entropy": s.get("entropy"),
+                "suspicious": bool(s.get("suspicious")),
+            }
+            for s in sections if isinstance(s, dict)
+        ],
+        "imports": {dll: list(funcs) for dll, funcs in imports.items()} if isinstance(imports, dict) else {},
+    }
+
+
+# ---- ghidra ----
+
+def parse_ghidra_pool(chunks):
+    """The JSON summary of ghidra-pool.sh; analyzeHeadless logs (its fallback) return None"""
+    raw = b"".join(chunks)
+    start = raw.find(b"{")
+    if start < 0:
+        return None
+    try:
+        report = json.loads(raw[start:].decode(errors='ignore'))
+    except ValueError:
+        return None
+    return report if isinstance(report, dict) and report.get("tool") == "ghidra" else None
+
+
+PARSERS = {
+    "nmap": parse_nmap,
+    "quick-scan.sh": parse_nmap,
+    "sqlmap": parse_sqlmap,
+    "peframe": parse_peframe,
+    "ghidra-pool.sh": parse_ghidra_pool,
+}
+
+
+def parse_output(command, chunks):
+    """
+    Structured result for known tools, or None when no parser applies.
+    chunks is an iterable of bytes (e.g. OutputCapture.iter_bytes()).
+    """
+    tool = detect_tool(command) or ""
+    parser = PARSERS.get(tool)
+    if parser is None:
+        return None
+    start = time.perf_counter()
+    try:
+        return parser(chunks)
+    except Exception:
+        # A parser bug must never break command execution; fall back to no structure
+        return None
+    finally:
+        PARSE_SECONDS.observe(time.perf_counter() - start, tool=tool)
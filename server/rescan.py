@@ -0,0 +1,319 @@
+# Incremental nmap rescans: cheap port discovery, detection only where something changed
+import ipaddress
+import os
+import shlex
+import time
+
+from batch import NMAP_VALUE_OPTIONS, Batch, plan_batch, split_nmap
+
+# Same profile as categories/penetration_testing/nmap/quick-scan.sh
+RESCAN_DEFAULT_OPTIONS = os.environ.get('CLI_RESCAN_DEFAULT_OPTIONS', '-sS -O -sV --top-ports 1000')
+# Hosts whose last full service/OS detection is older than this get a full one again,
+# since a version change on an unchanged port is invisible to discovery
+RESCAN_MAX_AGE = int(os.environ.get('CLI_RESCAN_MAX_AGE', str(7 * 24 * 3600)))
+# Hosts per detection shard (hosts with the same ports to probe share a command)
+RESCAN_HOSTS_PER_SHARD = int(os.environ.get('CLI_RESCAN_HOSTS_PER_SHARD', '8'))
+
+# Dropped from the discovery pass; kept for the detection pass
+DETECTION_OPTIONS = {
+    '-sV', '-O', '-A', '-sC', '--version-light', '--version-all', '--version-trace',
+    '--version-intensity', '--osscan-guess', '--osscan-limit', '--fuzzy', '--max-os-tries',
+    '--script', '--script-args', '--script-args-file', '--script-trace', '--traceroute',
+}
+OS_OPTIONS = {'-O', '--osscan-guess', '--osscan-limit', '--fuzzy', '--max-os-tries'}
+# Replaced by an explicit -p list in the detection pass
+PORT_OPTIONS = {'-p', '-F', '--top-ports', '--port-ratio', '--exclude-ports'}
+
+
+def _groups(words):
+    """Option words as [flag] or [flag, value] lists"""
+    groups = []
+    for word in words:
+        if groups and len(groups[-1]) == 1 and groups[-1][0] in NMAP_VALUE_OPTIONS:
+            groups[-1].append(word)
+        else:
+            groups.append([word])
+    return groups
+
+
+def _flag(word):
+    flag = word.split('=', 1)[0]
+    # -p22,80 / -p- carry their value attached
+    return '-p' if flag.startswith('-p') else flag
+
+
+def _port_key(port):
+    return port["protocol"], port["port"]
+
+
+def _is_open(port):
+    return port["state"].startswith("open")
+
+
+def _port_spec(keys):
+    by_proto = {}
+    for proto, port in sorted(keys):
+        by_proto.setdefault(proto, []).append(str(port))
+    prefixes = {"tcp": "T", "udp": "U", "sctp": "S"}
+    return ",".join(f"{prefixes[proto]}:{','.join(ports)}" for proto, ports in by_proto.items())
+
+
+def _in_targets(address, hostname, targets):
+    for target in targets:
+        if target in (address, hostname):
+            return True
+        try:
+            if ipaddress.ip_address(address) in ipaddress.ip_network(target, strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+def _service(port):
+    return {"service": port["service"], "version": port["version"]}
+
+
+def diff_hosts(before, after):
+    """
+    What changed between two host records: opened/closed ports, ports whose
+    service or version differ, and the OS guess. None when nothing changed.
+    """
+    old = {_port_key(p): p for p in before["ports"] if _is_open(p)}
+    new = {_port_key(p): p for p in after["ports"] if _is_open(p)}
+    change = {
+        "ports_opened": [new[k] for k in sorted(new.keys() - old.keys())],
+        "ports_closed": [old[k] for k in sorted(old.keys() - new.keys())],
+        "services_changed": [
+            {"port": k[1], "protocol": k[0], "before": _service(old[k]), "after": _service(new[k])}
+            for k in sorted(old.keys() & new.keys()) if _service(old[k]) != _service(new[k])
+        ],
+    }
+    old_os = [o["name"] for o in before.get("os") or []]
+    new_os = [o["name"] for o in after.get("os") or []]
+    if old_os[:1] != new_os[:1]:
+        change["os"] = {"before": before.get("os") or [], "after": after.get("os") or []}
+    if not any(change.values()):
+        return None
+    return {k: v for k, v in change.items() if v}
+
+
+class Rescan:
+    """
+    An nmap scan run in two passes against the last snapshot of each host:
+    discovery (the scan without -sV/-O/scripts, sharded like /batch), then
+    detection with -p limited to ports that are new or whose state changed.
+    Hosts with nothing new keep their previous service and OS results.
+    Raises BatchError if the command is not a shardable nmap scan.
+    """
+
+    def __init__(self, command, store, timeout, full=False, max_age=RESCAN_MAX_AGE):
+        options, self.targets = split_nmap(command)
+        start = max(i for i, w in enumerate(options) if os.path.basename(w) == 'nmap')
+        self.prefix, groups = options[:start + 1], _groups(options[start + 1:])
+        self.command = command
+        # Snapshots are only comparable between scans with the same options
+        self.profile = shlex.join(w for group in groups for w in group)
+        self.store = store
+        self.timeout = timeout
+        self.full = full
+        self.max_age = max_age
+        self.detection = [g for g in groups if _flag(g[0]) in DETECTION_OPTIONS]
+        self.discovery_command = shlex.join(
+            self.prefix + [w for g in groups if _flag(g[0]) not in DETECTION_OPTIONS for w in g] + self.targets)
+        # Detection only targets hosts discovery found up, so host discovery is skipped
+        self._detail_groups = [g for g in groups if not g[0].startswith('-P') and g[0] != '-sn'] + [['-Pn']]
+        self.discovery = None
+        self.detail = None
+        self.report = None
+        self.timings = {}
+        self.stats = {"ports_probed": 0}
+        # Hosts that get (or got) a full detection in this run
+        self._full = set()
+        self._save, self._gone = [], []
+
+    def _detail_options(self, ports=None):
+        """
+        Full detection: the original scan. Incremental: the given ports only and
+        no OS fingerprinting, which needs the host's whole port profile to work.
+        """
+        if ports is None:
+            return [w for g in self._detail_groups for w in g]
+        words = []
+        for group in self._detail_groups:
+            flag = _flag(group[0])
+            if flag == '-A':
+                # -A without its OS detection
+                words.extend(['-sV', '-sC', '--traceroute'])
+            elif flag not in OS_OPTIONS and flag not in PORT_OPTIONS:
+                words.extend(group)
+        return words + ['-p', _port_spec(ports)]
+
+    def _plan_detail(self, hosts, snapshots, now):
+        """
+        Decide what each host needs. Hosts without a recent full detection get
+        one (the original scan, OS included); the rest only get their new or
+        changed ports probed and keep their previous OS guess.
+        Returns [(targets, command), ...].
+        """
+        groups = {}
+        for host in hosts:
+            address = host["address"]
+            open_ports = {_port_key(p): p for p in host["ports"] if _is_open(p)}
+            snapshot = snapshots.get(address)
+            full = self.full or snapshot is None or now - snapshot["full_at"] > self.max_age
+            if full:
+                self._full.add(address)
+                probe = set(open_ports)
+            else:
+                known = {_port_key(p): p["state"] for p in snapshot["host"]["ports"] if _is_open(p)}
+                probe = {k for k, p in open_ports.items() if known.get(k) != p["state"]}
+            if probe and self.detection:
+                # Hosts with the same ports to probe share a command
+                groups.setdefault(None if full else tuple(sorted(probe)), []).append(address)
+                self.stats["ports_probed"] += len(probe)
+        shards = []
+        for ports, addresses in groups.items():
+            options = self._detail_options(ports)
+            for i in range(0, len(addresses), RESCAN_HOSTS_PER_SHARD):
+                chunk = addresses[i:i + RESCAN_HOSTS_PER_SHARD]
+                shards.append((chunk, shlex.join(self.prefix + options + chunk)))
+        return shards
+
+    def _merge(self, host, snapshot, detailed, with_os):
+        """Discovery record + fresh detection for probed ports + snapshot for the rest"""
+        if with_os and detailed is not None:
+            # A full detection saw everything discovery did
+            return detailed
+        fresh = {_port_key(p): p for p in (detailed or {}).get("ports", [])}
+        known = {_port_key(p): p for p in snapshot["host"]["ports"]} if snapshot else {}
+        ports = []
+        for port in host["ports"]:
+            key = _port_key(port)
+            if key in fresh:
+                ports.append(fresh[key])
+            elif _is_open(port) and key in known and _is_open(known[key]):
+                ports.append(dict(known[key], state=port["state"]))
+            else:
+                ports.append(port)
+        os_guess = snapshot["host"].get("os") if snapshot is not None else host.get("os")
+        return dict(host, ports=ports, os=os_guess or [])
+
+    def run(self, jobs, admission, heartbeat=None):
+        """
+        Generator of (event, payload): "progress" per discovery shard, "discovery",
+        "plan", one "shard" per detection shard, then "report" and "diff" (or
+        "error" if discovery failed). Closing it cancels the shards still running.
+        With a heartbeat, ("keepalive", None) comes whenever no shard finished
+        for that many seconds.
+        """
+        started = time.time()
+        discovery = Batch(self.discovery_command, plan_batch(self.discovery_command), self.timeout)
+        self.discovery = discovery
+        done = 0
+        for index in discovery.run(jobs, admission, heartbeat):
+            if index is None:
+                yield "keepalive", None
+                continue
+            done += 1
+            yield "progress", {"phase": "discovery", "shard": index, "done": done, "shards": len(discovery.jobs)}
+        report = discovery.report() or {"tool": "nmap", "hosts": [], "stats": {}}
+        up = [h for h in report["hosts"] if h["status"] == "up"]
+        self.timings["discovery"] = round(time.time() - started, 2)
+        yield "discovery", {
+            "command": self.discovery_command,
+            "status": discovery.status,
+            "hosts_up": len(up),
+            "open_ports": sum(1 for h in up for p in h["ports"] if _is_open(p)),
+            "elapsed": self.timings["discovery"],
+        }
+        if discovery.status != "finished":
+            # Without a complete discovery every host would look gone
+            yield "error", {"error": "discovery scan did not finish", "detail": "; ".join(
+                filter(None, (job.error for job in discovery.jobs)))}
+            return
+
+        now = time.time()
+        snapshots = self.store.snapshots(self.profile)
+        shards = self._plan_detail(up, snapshots, now)
+        probed = {a for targets, _ in shards for a in targets}
+        yield "plan", {
+            "shards": [{"index": i, "targets": t, "command": c} for i, (t, c) in enumerate(shards)],
+            "reused": sorted(h["address"] for h in up if h["address"] not in probed),
+        }
+
+        detailed, failed = {}, set()
+        detail_started = time.time()
+        if shards:
+            self.detail = Batch(self.command, shards, self.timeout)
+            for index in self.detail.run(jobs, admission, heartbeat):
+                if index is None:
+                    yield "keepalive", None
+                    continue
+                result = self.detail.shard_result(index)
+                if result["status"] == "finished":
+                    for host in (result["parsed"] or {}).get("hosts", []):
+                        detailed[host["address"]] = host
+                else:
+                    failed.update(result["targets"])
+                yield "shard", result
+        self.timings["detection"] = round(time.time() - detail_started, 2)
+
+        hosts, save, diff = [], [], {"hosts_new": [], "hosts_gone": [], "changed": {}, "unchanged": 0}
+        for host in up:
+            address = host["address"]
+            snapshot = snapshots.get(address)
+            merged = self._merge(host, snapshot, detailed.get(address), address in self._full)
+            hosts.append(merged)
+            if address in failed:
+                # Leave the old snapshot so the next rescan probes these ports again
+                continue
+            full_at = now if address in self._full else snapshot["full_at"]
+            save.append((merged, full_at))
+            if snapshot is None:
+                diff["hosts_new"].append(address)
+                continue
+            change = diff_hosts(snapshot["host"], merged)
+            if change:
+                diff["changed"][address] = change
+            else:
+                diff["unchanged"] += 1
+        up_addresses = {h["address"] for h in up}
+        gone = [address for address, snapshot in snapshots.items()
+                if address not in up_addresses
+                and _in_targets(address, snapshot["hostname"], self.targets)]
+        diff["hosts_gone"] = sorted(gone)
+        self._save, self._gone = save, gone
+
+        stats = dict(report.get("stats") or {})
+        stats["elapsed"] = round(time.time() - started, 2)
+        self.report = {"tool": "nmap", "hosts": hosts, "stats": stats}
+        self.stats.update({
+            "hosts_up": len(up),
+            "hosts_probed": len(probed),
+            "hosts_reused": len(up) - len(probed),
+            "ports_open": sum(1 for h in up for p in h["ports"] if _is_open(p)),
+        })
+        yield "report", self.report
+        yield "diff", diff
+
+    def save(self, result_id=None):
+        """Record the new snapshots (after run() has completed)"""
+        self.store.save_snapshots(self.profile, self._save, self._gone, result_id)
+
+    def iter_output(self):
+        """Discovery output followed by the detection shards' output"""
+        yield from self.discovery.iter_output()
+        if self.detail is not None:
+            yield from self.detail.iter_output()
+
+    @property
+    def status(self):
+        if self.detail is None:
+            return self.discovery.status
+        return self.detail.status
+
+    def summary(self):
+        return dict(self.stats, timings=dict(self.timings, total=round(sum(self.timings.values()), 2)),
+                    profile=self.profile)
+
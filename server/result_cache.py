@@ -0,0 +1,216 @@
+# Opt-in cache of /run results for read-only commands
+import json
+import os
+import re
+import shlex
+import threading
+import time
+from collections import OrderedDict
+
+from parsers import detect_tool
+
+# Commands whose output only depends on the files/directories they name
+FILE_READERS = {
+    'cat', 'head', 'tail', 'wc', 'file', 'md5sum', 'sha1sum', 'sha256sum', 'strings',
+    'xxd', 'hexdump', 'readelf', 'objdump', 'sort', 'uniq',
+}
+# Only non-recursive listings: the fingerprint covers the named paths, not what is below them
+LISTERS = {'ls', 'stat'}
+# Network lookups that change rarely
+LOOKUPS = {'whois', 'dig', 'host', 'nslookup'}
+
+# Seconds a result stays fresh, per class (CLI_CACHE_TTL_<CLASS>)
+CACHE_TTLS = {
+    'file': int(os.environ.get('CLI_CACHE_TTL_FILE', '600')),
+    'listing': int(os.environ.get('CLI_CACHE_TTL_LISTING', '30')),
+    'lookup': int(os.environ.get('CLI_CACHE_TTL_LOOKUP', '3600')),
+}
+CACHE_MAX_BYTES = int(os.environ.get('CLI_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+CACHE_MAX_ENTRY_BYTES = int(os.environ.get('CLI_CACHE_MAX_ENTRY_BYTES', str(1024 * 1024)))
+
+# Redirection, pipes, chaining and substitutions could write or run anything
+SHELL_META = set(';&|<>`$(){}*?[]!\n')
+
+# Readers that write their result to a file given as a second operand ("uniq in out",
+# "xxd in out"), and the options of theirs that take a separate value
+SECOND_OPERAND_WRITERS = {
+    'uniq': {'-f', '-s', '-w', '--skip-fields', '--skip-chars', '--check-chars'},
+    'xxd': {'-c', '-g', '-l', '-o', '-s', '-cols', '-groupsize', '-len', '-offset', '-seek'},
+}
+
+
+def _writes(tool, args):
+    # True if these arguments make an otherwise read-only command write a file
+    if tool == 'sort':
+        # -o may be clustered (-uo out); -k/-t/-S/-T take the rest of the word as their value
+        return any(a.startswith('--output') or (a.startswith('-') and not a.startswith('--')
+                                                and 'o' in re.split('[ktST]', a[1:])[0]) for a in args)
+    if tool == 'xxd' and any(a in ('-r', '-revert') for a in args):
+        return True
+    if tool in SECOND_OPERAND_WRITERS:
+        takes_value = SECOND_OPERAND_WRITERS[tool]
+        operands = []
+        i = 0
+        while i < len(args):
+            if args[i] in takes_value:
+                i += 2
+                continue
+            if not args[i].startswith('-') or args[i] == '-':
+                operands.append(args[i])
+            i += 1
+        return len(operands) > 1
+    return False
+
+
+def _recursive(tool, args):
+    return tool == 'ls' and any(a == '--recursive' or (a.startswith('-') and not a.startswith('--') and 'R' in a)
+                                for a in args)
+
+
+def cache_class(command):
+    """Cache class of a command, or None if its result must never be cached"""
+    if any(ch in SHELL_META for ch in command):
+        return None
+    tool = detect_tool(command)
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return None
+    args = words[next((i for i, w in enumerate(words) if os.path.basename(w) == tool), len(words)) + 1:]
+    if _writes(tool, args) or _recursive(tool, args):
+        return None
+    if tool in FILE_READERS:
+        return 'file'
+    if tool in LISTERS:
+        return 'listing'
+    if tool in LOOKUPS:
+        return 'lookup'
+    return None
+
+
+def normalize(command):
+    """Canonical form of a command: same words, same quoting, single spaces"""
+    try:
+        return shlex.join(shlex.split(command))
+    except ValueError:
+        return None
+
+
+def _fingerprint(words, cwd, listing):
+    # (path, mtime_ns, size) of every argument that names an existing file or
+    # directory; a listing without path arguments depends on the working dir
+    prints = []
+    paths = [w for w in words[1:] if not w.startswith('-')]
+    if listing and not paths:
+        paths = ['.']
+    for word in paths:
+        path = os.path.join(cwd, os.path.expanduser(word))
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            continue
+        prints.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(prints)
+
+
+def _still_valid(prints):
+    for path, mtime_ns, size in prints:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_mtime_ns != mtime_ns or st.st_size != size:
+            return False
+    return True
+
+
+class ResultCache:
+    """
+    LRU of /run response bodies bounded by total bytes. Entries expire after
+    their class TTL, and file/listing entries are dropped as soon as the mtime
+    or size of a path they read changes.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_entry_bytes=CACHE_MAX_ENTRY_BYTES, ttls=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttls = dict(ttls or CACHE_TTLS)
+        self._entries = OrderedDict()   # key -> (body, size, expires_at, fingerprint)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def key(self, command, parse=False):
+        """Cache key for a command, or None if it is not cacheable"""
+        if cache_class(command) is None:
+            return None
+        normalized = normalize(command)
+        if normalized is None:
+            return None
+        return f"{int(bool(parse))}:{normalized}"
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            body, size, expires_at, prints = entry
+            if time.monotonic() >= expires_at or not _still_valid(prints):
+                self._drop(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    @staticmethod
+    def snapshot(command):
+        """
+        Fingerprint of the paths a command reads. Take it before running the
+        command so a file changed during the run is not cached as fresh.
+        """
+        tool_class = cache_class(command)
+        if tool_class in (None, 'lookup'):
+            return ()
+        return _fingerprint(shlex.split(command), os.getcwd(), tool_class == 'listing')
+
+    def put(self, key, command, body, prints):
+        """Store a response body with the fingerprint from snapshot()"""
+        tool_class = cache_class(command)
+        size = len(json.dumps(body))
+        if tool_class is None or size > self.max_entry_bytes:
+            return
+        expires_at = time.monotonic() + self.ttls[tool_class]
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (body, size, expires_at, prints)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        # Caller holds the lock
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "ttls": self.ttls,
+            }
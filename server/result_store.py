@@ -0,0 +1,456 @@
+# Persistent store of command results (SQLite, compressed and deduplicated output)
+import hashlib
+import json
+import os
+import shlex
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from batch import BatchError, split_nmap
+from capture import READ_SIZE
+from parsers import detect_tool
+
+DEFAULT_DB_DIR = '/app/data' if os.path.isdir('/app') else os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+RESULT_DB = os.environ.get('CLI_RESULT_DB') or os.path.join(DEFAULT_DB_DIR, 'results.db')
+# Largest page GET /results returns
+RESULTS_MAX_LIMIT = int(os.environ.get('CLI_RESULTS_MAX_LIMIT', '200'))
+# Retention: once either is exceeded the oldest results are dropped (0 = no limit).
+# Bytes are compressed output bytes in the blobs table
+RESULT_MAX_ROWS = int(os.environ.get('CLI_RESULT_MAX_ROWS', '100000'))
+RESULT_MAX_BYTES = int(os.environ.get('CLI_RESULT_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+# Compressed output up to this size is spooled in memory before it is written, larger goes to a temp file
+SPOOL_BYTES = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    command TEXT NOT NULL,
+    tool TEXT,
+    task TEXT,
+    source TEXT,
+    status TEXT,
+    exit_code INTEGER,
+    output_sha256 TEXT REFERENCES blobs(sha256),
+    output_bytes INTEGER,
+    parsed TEXT,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS result_targets (
+    result_id INTEGER NOT NULL REFERENCES results(id) ON DELETE CASCADE,
+    target TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS host_snapshots (
+    profile TEXT NOT NULL,
+    address TEXT NOT NULL,
+    hostname TEXT,
+    scanned_at REAL NOT NULL,
+    full_at REAL NOT NULL,
+    result_id INTEGER,
+    host TEXT NOT NULL,
+    PRIMARY KEY (profile, address)
+);
+CREATE TABLE IF NOT EXISTS analyses (
+    sha256 TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    version TEXT NOT NULL,
+    profile TEXT NOT NULL,
+    result_id INTEGER NOT NULL REFERENCES results(id) ON DELETE CASCADE,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (sha256, tool, version, profile)
+);
+CREATE INDEX IF NOT EXISTS results_created ON results(created_at);
+CREATE INDEX IF NOT EXISTS results_tool ON results(tool, created_at);
+CREATE INDEX IF NOT EXISTS results_task ON results(task, created_at);
+CREATE INDEX IF NOT EXISTS results_output ON results(output_sha256);
+CREATE INDEX IF NOT EXISTS result_targets_target ON result_targets(target, result_id);
+"""
+
+# Options whose value is the target, per tool
+TARGET_OPTIONS = {
+    'sqlmap': ('-u', '--url'),
+}
+
+
+def extract_targets(command):
+    """Hosts/URLs/files a command is aimed at, for the target index"""
+    tool = detect_tool(command)
+    if tool == 'nmap':
+        try:
+            return split_nmap(command)[1]
+        except BatchError:
+            return []
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return []
+    if tool in TARGET_OPTIONS:
+        names = TARGET_OPTIONS[tool]
+        targets = []
+        for i, word in enumerate(words):
+            if word in names and i + 1 < len(words):
+                targets.append(words[i + 1])
+            elif word.split('=', 1)[0] in names and '=' in word:
+                targets.append(word.split('=', 1)[1])
+        return targets
+    # Anything else: the plain (non-option) arguments after the tool name
+    try:
+        start = next(i for i, w in enumerate(words) if os.path.basename(w) == tool)
+    except StopIteration:
+        return []
+    return [w for w in words[start + 1:] if not w.startswith('-')][:16]
+
+
+def _compressor():
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=6).compressobj()
+    return 'gzip', zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def _decompressor(codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("output was stored with zstd but the zstandard module is not installed")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+def compress_chunks(chunks, out):
+    """
+    Compress an iterable of bytes into the file-like out while hashing it;
+    returns (sha256, codec, size, compressed size)
+    """
+    digest = hashlib.sha256()
+    codec, compressor = _compressor()
+    size = 0
+    stored = 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+        stored += out.write(compressor.compress(chunk))
+    stored += out.write(compressor.flush())
+    return digest.hexdigest(), codec, size, stored
+
+
+class ResultStore:
+    """
+    Results live in `results`, one row per run, with a separate `result_targets`
+    index so a multi-target scan can be found by any of its targets. Output
+    blobs are compressed (zstd if installed, else gzip) and keyed by the sha256
+    of the raw output, so identical outputs are stored once. Output is
+    compressed into a spool file and copied into the blob incrementally, so
+    neither step holds the whole output in memory.
+
+    Past max_rows results or max_bytes of stored output the oldest results
+    are deleted as new ones arrive.
+    """
+
+    def __init__(self, path=RESULT_DB, max_rows=RESULT_MAX_ROWS, max_bytes=RESULT_MAX_BYTES):
+        self.path = path
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.pruned = 0
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(SCHEMA)
+            self._db.commit()
+            # Running totals for the retention check, so add() does not rescan the tables
+            self._rows, = self._db.execute("SELECT COUNT(*) FROM results").fetchone()
+            self._stored_bytes, = self._db.execute(
+                "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM blobs").fetchone()
+
+    def add(self, command, chunks, status=None, exit_code=None, parsed=None,
+            task=None, source="run", summary=None):
+        """Store one result; chunks is an iterable of output bytes. Returns its id."""
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as spool:
+            # Compress outside the lock; only the inserts are serialized
+            sha, codec, size, stored = compress_chunks(chunks, spool)
+            with self._lock:
+                try:
+                    cursor = self._db.execute(
+                        "INSERT OR IGNORE INTO blobs (sha256, codec, size, data) VALUES (?, ?, ?, zeroblob(?))",
+                        (sha, codec, size, stored))
+                    new_blob = cursor.rowcount > 0
+                    if new_blob:
+                        # Fill the placeholder from the spool a chunk at a time
+                        spool.seek(0)
+                        with self._db.blobopen('blobs', 'data', cursor.lastrowid) as blob:
+                            for piece in iter(lambda: spool.read(READ_SIZE), b""):
+                                blob.write(piece)
+                    cursor = self._db.execute(
+                        "INSERT INTO results (created_at, command, tool, task, source, status, exit_code,"
+                        " output_sha256, output_bytes, parsed, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (time.time(), command, detect_tool(command), task, source, status, exit_code,
+                         sha, size, json.dumps(parsed) if parsed is not None else None, summary))
+                    result_id = cursor.lastrowid
+                    self._db.executemany(
+                        "INSERT INTO result_targets (result_id, target) VALUES (?, ?)",
+                        [(result_id, target) for target in dict.fromkeys(extract_targets(command))])
+                except BaseException:
+                    self._db.rollback()
+                    raise
+                self._rows += 1
+                self._stored_bytes += stored if new_blob else 0
+                self._prune(keep=result_id)
+                self._db.commit()
+        return result_id
+
+    def _over_limit(self):
+        return ((self.max_rows > 0 and self._rows > self.max_rows)
+                or (self.max_bytes > 0 and self._stored_bytes > self.max_bytes))
+
+    def _prune(self, keep):
+        # Delete the oldest results until back under the limits, never the one
+        # just added (caller holds the lock)
+        while self._over_limit():
+            ids = [row[0] for row in self._db.execute(
+                "SELECT id FROM results WHERE id != ? ORDER BY id LIMIT 64", (keep,))]
+            if not ids:
+                return
+            for result_id in ids:
+                self._delete(result_id)
+                self.pruned += 1
+                if not self._over_limit():
+                    return
+
+    def update(self, result_id, summary=None, task=None):
+        """Attach a summary (and/or the originating task) to a stored result"""
+        fields = {k: v for k, v in (("summary", summary), ("task", task)) if v is not None}
+        if not fields:
+            return self.get(result_id) is not None
+        with self._lock:
+            cursor = self._db.execute(
+                f"UPDATE results SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                (*fields.values(), result_id))
+            self._db.commit()
+            return cursor.rowcount > 0
+
+    @staticmethod
+    def _row(row, targets, full=False):
+        item = {
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "command": row["command"],
+            "tool": row["tool"],
+            "task": row["task"],
+            "source": row["source"],
+            "status": row["status"],
+            "exit_code": row["exit_code"],
+            "output_bytes": row["output_bytes"],
+            "output_sha256": row["output_sha256"],
+            "targets": targets,
+            "summary": row["summary"],
+        }
+        if full:
+            item["parsed"] = json.loads(row["parsed"]) if row["parsed"] else None
+        return item
+
+    def _targets(self, ids):
+        # Caller holds the lock
+        if not ids:
+            return {}
+        found = {i: [] for i in ids}
+        rows = self._db.execute(
+            f"SELECT result_id, target FROM result_targets WHERE result_id IN ({', '.join('?' * len(ids))})",
+            ids)
+        for row in rows:
+            found[row["result_id"]].append(row["target"])
+        return found
+
+    def get(self, result_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM results WHERE id = ?", (result_id,)).fetchone()
+            if row is None:
+                return None
+            return self._row(row, self._targets([row["id"]])[row["id"]], full=True)
+
+    def query(self, target=None, tool=None, task=None, status=None, since=None, until=None,
+              before_id=None, limit=50):
+        """
+        Newest first. Keyset pagination: pass the returned next_cursor as
+        before_id to get the following page. Returns (items, next_cursor).
+        """
+        limit = max(1, min(int(limit), RESULTS_MAX_LIMIT))
+        where, params = [], []
+        if target:
+            where.append("id IN (SELECT result_id FROM result_targets WHERE target = ?)")
+            params.append(target)
+        for column, value in (("tool", tool), ("task", task), ("status", status)):
+            if value:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(float(since))
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(float(until))
+        if before_id is not None:
+            where.append("id < ?")
+            params.append(int(before_id))
+        sql = "SELECT * FROM results"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(sql, (*params, limit + 1)).fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            targets = self._targets([row["id"] for row in rows])
+            items = [self._row(row, targets[row["id"]]) for row in rows]
+        return items, (items[-1]["id"] if more else None)
+
+    def iter_output(self, result_id):
+        """Decompressed output of a result as byte chunks, or None if unknown"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT b.codec, b.rowid FROM results r JOIN blobs b ON b.sha256 = r.output_sha256"
+                " WHERE r.id = ?", (result_id,)).fetchone()
+        if row is None:
+            return None
+        codec, rowid = row["codec"], row["rowid"]
+
+        def chunks():
+            # The stored blob is read READ_SIZE bytes at a time, never loaded whole
+            decompressor = _decompressor(codec)
+            with self._lock:
+                blob = self._db.blobopen('blobs', 'data', rowid, readonly=True)
+            try:
+                while True:
+                    with self._lock:
+                        data = blob.read(READ_SIZE)
+                    if not data:
+                        break
+                    out = decompressor.decompress(data)
+                    if out:
+                        yield out
+            finally:
+                with self._lock:
+                    blob.close()
+            flush = getattr(decompressor, 'flush', None)
+            tail = flush() if flush is not None else b""
+            if tail:
+                yield tail
+
+        return chunks()
+
+    def delete(self, result_id):
+        """Remove a result; its output blob goes too once nothing references it"""
+        with self._lock:
+            deleted = self._delete(result_id)
+            self._db.commit()
+            return deleted
+
+    def _delete(self, result_id):
+        # Caller holds the lock and commits
+        row = self._db.execute("SELECT output_sha256 FROM results WHERE id = ?", (result_id,)).fetchone()
+        if row is None:
+            return False
+        self._db.execute("DELETE FROM result_targets WHERE result_id = ?", (result_id,))
+        self._db.execute("DELETE FROM results WHERE id = ?", (result_id,))
+        self._rows -= 1
+        orphan = self._db.execute(
+            "SELECT LENGTH(data) FROM blobs WHERE sha256 = ? AND NOT EXISTS"
+            " (SELECT 1 FROM results WHERE output_sha256 = ?)", (row[0], row[0])).fetchone()
+        if orphan is not None:
+            self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (row[0],))
+            self._stored_bytes -= orphan[0]
+        return True
+
+    def snapshots(self, profile):
+        """
+        Last known state of every host scanned with this profile (the scan's
+        options): {address: {"host": {...}, "hostname", "scanned_at", "full_at", "result_id"}}
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM host_snapshots WHERE profile = ?", (profile,)).fetchall()
+        return {row["address"]: {
+            "host": json.loads(row["host"]),
+            "hostname": row["hostname"],
+            "scanned_at": row["scanned_at"],
+            "full_at": row["full_at"],
+            "result_id": row["result_id"],
+        } for row in rows}
+
+    def save_snapshots(self, profile, hosts, removed=(), result_id=None):
+        """
+        Replace the snapshots of the given hosts, a list of (host, full_at), and
+        drop the ones in removed (addresses that are no longer up)
+        """
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO host_snapshots (profile, address, hostname, scanned_at, full_at,"
+                " result_id, host) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(profile, host["address"], host.get("hostname"), now, full_at, result_id, json.dumps(host))
+                 for host, full_at in hosts])
+            self._db.executemany(
+                "DELETE FROM host_snapshots WHERE profile = ? AND address = ?",
+                [(profile, address) for address in removed])
+            self._db.commit()
+
+    def find_analysis(self, sha256, tool, version, profile):
+        """Result id of a stored analysis of a sample, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result_id FROM analyses WHERE sha256 = ? AND tool = ? AND version = ? AND profile = ?",
+                (sha256, tool, version, profile)).fetchone()
+        return row[0] if row is not None else None
+
+    def save_analysis(self, sha256, tool, version, profile, result_id):
+        """Record result_id as the analysis of a sample by this tool version and profile"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analyses (sha256, tool, version, profile, result_id, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)", (sha256, tool, version, profile, result_id, time.time()))
+            self._db.commit()
+
+    def analyses(self, sha256):
+        """Stored analyses of a sample, newest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT tool, version, result_id, created_at FROM analyses WHERE sha256 = ?"
+                " ORDER BY created_at DESC", (sha256,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self):
+        with self._lock:
+            results, = self._db.execute("SELECT COUNT(*) FROM results").fetchone()
+            snapshots, = self._db.execute("SELECT COUNT(*) FROM host_snapshots").fetchone()
+            analyses, = self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()
+            blobs, raw, stored = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM blobs").fetchone()
+        return {
+            "path": self.path,
+            "results": results,
+            "host_snapshots": snapshots,
+            "analyses": analyses,
+            "blobs": blobs,
+            "raw_bytes": raw,
+            "stored_bytes": stored,
+            "codec": "zstd" if zstandard is not None else "gzip",
+            "max_rows": self.max_rows,
+            "max_bytes": self.max_bytes,
+            "pruned": self.pruned,
+        }
@@ -0,0 +1,200 @@
+# Long-lived shell sessions: one bash per session, commands framed by a sentinel line
+import os
+import select
+import shlex
+import subprocess
+import threading
+import time
+import uuid
+
+from capture import READ_SIZE, OutputCapture
+from jobs import kill_process_group
+
+MAX_SESSIONS = int(os.environ.get('CLI_MAX_SESSIONS', '8'))
+# Sessions unused for this many seconds are closed by the reaper
+SESSION_IDLE_TIMEOUT = int(os.environ.get('CLI_SESSION_IDLE_TIMEOUT', '600'))
+
+SHELL = ['/bin/bash', '--noprofile', '--norc']
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class SessionBusyError(Exception):
+    pass
+
+
+class SessionClosedError(Exception):
+    pass
+
+
+class Session:
+    """
+    A bash process fed over a pipe. Each command is eval'd in that shell, so
+    cd/export/aliases persist, and is followed by a printf of a per-command
+    sentinel carrying the exit status; output up to the sentinel is the result.
+    """
+
+    def __init__(self, cwd=None, env=None):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.commands = 0
+        self.busy = False
+        self.closed = False
+        self._lock = threading.Lock()
+        full_env = dict(os.environ)
+        full_env.update({str(k): str(v) for k, v in (env or {}).items()})
+        self.process = subprocess.Popen(
+            SHELL,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=cwd or None,
+            env=full_env,
+            start_new_session=True,
+        )
+
+    def run(self, command, timeout):
+        """
+        Run a command in the session; returns (exit_code, capture, timed_out).
+        A command that times out takes the whole session down with it, since
+        there is no way to interrupt it without losing the shell state.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise SessionBusyError("session is running another command")
+        try:
+            if self.closed or self.process.poll() is not None:
+                self.closed = True
+                raise SessionClosedError("session has exited")
+            self.busy = True
+            sentinel = f"__CLI_SESSION_END_{uuid.uuid4().hex}__"
+            # stdin of the command is /dev/null so it cannot swallow the next frame
+            script = (f"eval {shlex.quote(command)} < /dev/null\n"
+                      f"printf '\\n{sentinel} %d\\n' $?\n")
+            try:
+                self.process.stdin.write(script.encode())
+                self.process.stdin.flush()
+            except OSError:
+                self.close()
+                raise SessionClosedError("session has exited")
+            return self._read_until(sentinel.encode(), timeout)
+        finally:
+            self.busy = False
+            self.last_used = time.monotonic()
+            self.commands += 1
+            self._lock.release()
+
+    def _read_until(self, sentinel, timeout):
+        capture = OutputCapture()
+        marker = b"\n" + sentinel + b" "
+        fd = self.process.stdout.fileno()
+        deadline = time.monotonic() + timeout
+        pending = b""
+        while True:
+            remaining = deadline - time.monotonic()
+            ready = select.select([fd], [], [], max(0, remaining))[0] if remaining > 0 else []
+            if not ready:
+                capture.write(pending)
+                self.close()
+                return None, capture, True
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                capture.write(pending)
+                self.close()
+                raise SessionClosedError("session exited while running the command")
+            pending += data
+            idx = pending.find(marker)
+            if idx >= 0:
+                status_line, newline, _ = pending[idx + len(marker):].partition(b"\n")
+                if newline:
+                    capture.write(pending[:idx])
+                    return int(status_line), capture, False
+                continue
+            # Hold back enough bytes to recognise a marker split across reads
+            keep = len(marker)
+            if len(pending) > keep:
+                capture.write(pending[:-keep])
+                pending = pending[-keep:]
+
+    def close(self):
+        self.closed = True
+        if self.process.poll() is None:
+            kill_process_group(self.process)
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self.process.wait()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "pid": self.process.pid,
+            "created_at": self.created_at,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            "commands": self.commands,
+            "busy": self.busy,
+            "closed": self.closed,
+        }
+
+
+class SessionManager:
+    """Caps the number of sessions and reaps the ones left idle"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._reaper = threading.Thread(target=self._reap_loop, name="session-reaper", daemon=True)
+        self._reaper.start()
+
+    def create(self, cwd=None, env=None):
+        with self._lock:
+            self._forget_closed()
+            if len(self._sessions) >= self.max_sessions:
+                raise SessionLimitError(f"{self.max_sessions} sessions already open")
+            session = Session(cwd, env)
+            self._sessions[session.id] = session
+            return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+        return session
+
+    def _forget_closed(self):
+        # Caller holds the lock
+        for session_id in [s.id for s in self._sessions.values() if s.closed]:
+            del self._sessions[session_id]
+
+    def _reap_loop(self):
+        interval = max(1, min(30, self.idle_timeout / 4))
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            with self._lock:
+                self._forget_closed()
+                # Taking the session's lock keeps a command from starting while it is reaped
+                idle = [s for s in self._sessions.values()
+                        if now - s.last_used > self.idle_timeout and s._lock.acquire(blocking=False)]
+                for session in idle:
+                    del self._sessions[session.id]
+            for session in idle:
+                try:
+                    session.close()
+                finally:
+                    session._lock.release()
@@ -0,0 +1,111 @@
+# Incremental command output as Server-Sent Events
+import codecs
+import json
+import os
+import select
+import subprocess
+import threading
+import time
+
+from capture import OutputCapture
+from jobs import kill_process_group, record_run
+from parsers import parse_output
+
+CHUNK_SIZE = 4096
+# Seconds of silence after which a keepalive comment is sent. Writing is the only
+# way to notice a client that went away, so a quiet command is killed within this long
+STREAM_HEARTBEAT = float(os.environ.get('CLI_STREAM_HEARTBEAT', '10'))
+KEEPALIVE = b": keepalive\n\n"
+
+
+def sse_event(event, data):
+    """Format one SSE frame; data is JSON-encoded so newlines in output are safe"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def stream_command(cmd, timeout, parse=False, on_finish=None):
+    """
+    Run cmd and yield SSE frames as output arrives:
+      event: output  data: {"text": "..."}
+      event: exit    data: {"exit_code": N, "status": "finished"|"failed"|"timeout"}
+      event: parsed  data: {...}   (only with parse=True and a parser for the tool)
+      event: stored  data: {"result_id": N}   (when on_finish returns an id)
+      event: error   data: {"error": "..."}   (instead of all the above if the shell could not start)
+    on_finish(capture, exit_code, status, parsed) is called once the command has
+    ended, with the full output still readable from the capture.
+    Nothing is accumulated; each chunk is yielded as soon as the pipe returns it.
+    If the client disconnects the generator is closed and the process group killed.
+    """
+    started = time.perf_counter()
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+            bufsize=0,
+        )
+    except OSError as e:
+        # Same outcome as a background job that cannot spawn: failed, with the reason
+        record_run(cmd, "failed", time.perf_counter() - started, 0)
+        yield sse_event("error", {"error": str(e)})
+        return
+    output_bytes = 0
+    status = "cancelled"
+    timed_out = threading.Event()
+
+    def on_timeout():
+        timed_out.set()
+        kill_process_group(proc)
+
+    timer = threading.Timer(timeout, on_timeout)
+    timer.daemon = True
+    timer.start()
+    fd = proc.stdout.fileno()
+    # Incremental decoder so multi-byte characters split across reads survive
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    # Parsing needs the whole output, so keep a bounded capture alongside the stream
+    capture = OutputCapture() if parse or on_finish else None
+    try:
+        while True:
+            if not select.select([fd], [], [], STREAM_HEARTBEAT)[0]:
+                yield KEEPALIVE
+                continue
+            # os.read returns whatever is available instead of waiting for a full buffer
+            chunk = os.read(fd, CHUNK_SIZE)
+            if not chunk:
+                break
+            output_bytes += len(chunk)
+            if capture is not None:
+                capture.write(chunk)
+            text = decoder.decode(chunk)
+            if text:
+                yield sse_event("output", {"text": text})
+        proc.wait()
+        if timed_out.is_set():
+            status = "timeout"
+        elif proc.returncode != 0:
+            status = "failed"
+        else:
+            status = "finished"
+        record_run(cmd, status, time.perf_counter() - started, output_bytes)
+        yield sse_event("exit", {"exit_code": proc.returncode, "status": status})
+        parsed = parse_output(cmd, capture.iter_bytes()) if parse else None
+        if parsed is not None:
+            yield sse_event("parsed", parsed)
+        if on_finish is not None:
+            result_id = on_finish(capture, proc.returncode, status, parsed)
+            if result_id is not None:
+                yield sse_event("stored", {"result_id": result_id})
+    finally:
+        if capture is not None:
+            capture.close()
+        timer.cancel()
+        if proc.poll() is None:
+            kill_process_group(proc)
+            proc.wait()
+        if status == "cancelled":
+            # The client went away before the command ended
+            record_run(cmd, status, time.perf_counter() - started, output_bytes)
+        proc.stdout.close()
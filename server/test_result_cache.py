@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Result cache check: cache keys and path fingerprints of read-only commands.
+Runs offline on a temp directory: python server/test_result_cache.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from result_cache import ResultCache
+
+def check(label, ok):
+    print(f"{'✅' if ok else '❌'} {label}")
+    return ok
+
+def check_keys():
+    """Only read-only commands get a key; quoting and spacing do not matter"""
+    cache = ResultCache()
+    results = [
+        check("cat gets a key", cache.key("cat /etc/hostname") is not None),
+        check("spacing and quoting normalize to one key",
+              cache.key("cat   '/etc/hostname'") == cache.key("cat /etc/hostname")),
+        check("parse flag is part of the key",
+              cache.key("cat /etc/hostname", True) != cache.key("cat /etc/hostname")),
+        check("nmap is not cached", cache.key("nmap -v a.com") is None),
+        check("pipes and redirects are not cached", cache.key("cat a | tee b") is None
+              and cache.key("cat a > b") is None),
+        check("unbalanced quotes are not cached", cache.key("cat 'a") is None),
+        check("commands that write files are not cached",
+              all(cache.key(c) is None for c in ("sort -o out in", "sort -uo out in", "uniq in out", "xxd -r in", "find . -delete"))),
+        check("recursive listings are not cached",
+              all(cache.key(c) is None for c in ("ls -laR", "find .", "du -sh .", "tree"))),
+        check("uniq options with values are not outputs", cache.key("uniq -f 1 in") is not None),
+    ]
+    return all(results)
+
+def check_fingerprints(workdir):
+    """A file entry is dropped once the file it read changes"""
+    cache = ResultCache()
+    path = os.path.join(workdir, "notes.txt")
+    with open(path, "w") as f:
+        f.write("one\n")
+    command = f"cat {path}"
+    key = cache.key(command)
+    prints = cache.snapshot(command)
+    cache.put(key, command, {"output": "one\n"}, prints)
+    results = [
+        check("fingerprint covers the file", [p[0] for p in prints] == [path]),
+        check("unchanged file is a hit", cache.get(key) == {"output": "one\n"}),
+    ]
+    with open(path, "a") as f:
+        f.write("two\n")
+    results.append(check("changed file is a miss", cache.get(key) is None))
+    results.append(check("invalidation is counted", cache.stats()["invalidations"] == 1))
+    return all(results)
+
+def check_listing(workdir):
+    """A listing without paths fingerprints the working directory"""
+    cache = ResultCache()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        prints = cache.snapshot("ls -la")
+        key = cache.key("ls -la")
+        cache.put(key, "ls -la", {"output": "..."}, prints)
+        time.sleep(0.01)
+        with open(os.path.join(workdir, "new.txt"), "w") as f:
+            f.write("x")
+        return all([
+            check("listing fingerprints the working directory", [p[0] for p in prints] == [os.path.join(workdir, ".")]),
+            check("new file in the directory invalidates the listing", cache.get(key) is None),
+        ])
+    finally:
+        os.chdir(cwd)
+
+def check_bounds():
+    """Entries over max_entry_bytes are skipped; total size stays under max_bytes"""
+    cache = ResultCache(max_bytes=300, max_entry_bytes=200)
+    cache.put(cache.key("whois a.com"), "whois a.com", {"output": "x" * 500}, ())
+    for name in ("a", "b", "c"):
+        cache.put(cache.key(f"whois {name}.org"), f"whois {name}.org", {"output": "x" * 100}, ())
+    stats = cache.stats()
+    return all([
+        check("oversized entry is not stored", cache.get(cache.key("whois a.com")) is None),
+        check("total size stays within max_bytes", stats["bytes"] <= 300),
+        check("oldest entry is evicted first", cache.get(cache.key("whois a.org")) is None
+              and cache.get(cache.key("whois c.org")) is not None),
+    ])
+
+def main():
+    print("🧪 Testing result cache...")
+    print("=" * 50)
+    workdir = tempfile.mkdtemp(prefix="result-cache-test-")
+    tests = [
+        ("Cache keys", check_keys),
+        ("Fingerprints", lambda: check_fingerprints(workdir)),
+        ("Listings", lambda: check_listing(workdir)),
+        ("Size bounds", check_bounds),
+    ]
+    passed = 0
+    try:
+        for test_name, test_func in tests:
+            print(f"\n🔍 {test_name}...")
+            if test_func():
+                passed += 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("\n" + "=" * 50)
+    print(f"📊 Test Results: {passed}/{len(tests)} tests passed")
+    return 0 if passed == len(tests) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Result store check: output round-trip, blob dedup, queries and retention.
+Runs offline on a temp database: python server/test_result_store.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+from result_store import ResultStore, SPOOL_BYTES
+
+def check(label, ok):
+    print(f"{'✅' if ok else '❌'} {label}")
+    return ok
+
+def check_round_trip(workdir):
+    """Output comes back byte for byte, including outputs too big to spool in memory"""
+    store = ResultStore(os.path.join(workdir, "round-trip.db"))
+    small = [b"PORT   STATE SERVICE\n", b"22/tcp open  ssh\n"]
+    big = [os.urandom(64 * 1024) for _ in range(2 * SPOOL_BYTES // (64 * 1024) + 1)]
+    small_id = store.add("nmap -v a.com", iter(small), "finished", 0, {"hosts": []}, task="scan a.com")
+    big_id = store.add("cat /tmp/big.bin", iter(big), "finished", 0)
+    result = store.get(small_id)
+    return all([
+        check("small output round-trips", b"".join(store.iter_output(small_id)) == b"".join(small)),
+        check("output larger than the spool round-trips", b"".join(store.iter_output(big_id)) == b"".join(big)),
+        check("metadata is kept", result["task"] == "scan a.com" and result["parsed"] == {"hosts": []}
+              and result["targets"] == ["a.com"]),
+        check("unknown id has no output", store.iter_output(big_id + 1) is None),
+    ])
+
+def check_dedup(workdir):
+    """Identical outputs share one blob, which goes away with its last result"""
+    store = ResultStore(os.path.join(workdir, "dedup.db"))
+    output = [b"same output\n" * 100]
+    first = store.add("nmap -v a.com", iter(output))
+    second = store.add("nmap -v b.com", iter(output))
+    stats = store.stats()
+    results = [
+        check("two results, one blob", stats["results"] == 2 and stats["blobs"] == 1),
+        check("results are found by target", [r["id"] for r in store.query(target="b.com")[0]] == [second]),
+    ]
+    store.delete(first)
+    results.append(check("blob kept while referenced", store.stats()["blobs"] == 1
+                         and b"".join(store.iter_output(second)) == output[0]))
+    store.delete(second)
+    results.append(check("blob deleted with its last result", store.stats()["blobs"] == 0))
+    return all(results)
+
+def check_retention(workdir):
+    """Oldest results are pruned past max_rows / max_bytes, never the newest"""
+    store = ResultStore(os.path.join(workdir, "rows.db"), max_rows=3, max_bytes=0)
+    ids = [store.add(f"echo {i}", [f"line {i}\n".encode()]) for i in range(5)]
+    kept = [r["id"] for r in store.query()[0]]
+    results = [
+        check("row limit keeps the newest results", kept == ids[:1:-1]),
+        check("pruned results are counted", store.stats()["pruned"] == 2),
+    ]
+    store = ResultStore(os.path.join(workdir, "bytes.db"), max_rows=0, max_bytes=4096)
+    ids = [store.add(f"cat /tmp/{i}.bin", [os.urandom(3000)]) for i in range(3)]
+    stats = store.stats()
+    results.append(check("byte limit keeps the newest result", [r["id"] for r in store.query()[0]] == [ids[-1]]))
+    results.append(check("stored bytes are under the limit", stats["stored_bytes"] <= 4096))
+    reopened = ResultStore(os.path.join(workdir, "bytes.db"), max_rows=0, max_bytes=4096)
+    reopened.add("cat /tmp/3.bin", [os.urandom(3000)])
+    results.append(check("totals survive a reopen", reopened.stats()["results"] == 1))
+    return all(results)
+
+def main():
+    print("🧪 Testing result store...")
+    print("=" * 50)
+    workdir = tempfile.mkdtemp(prefix="result-store-test-")
+    tests = [
+        ("Round-trip", lambda: check_round_trip(workdir)),
+        ("Dedup", lambda: check_dedup(workdir)),
+        ("Retention", lambda: check_retention(workdir)),
+    ]
+    passed = 0
+    try:
+        for test_name, test_func in tests:
+            print(f"\n🔍 {test_name}...")
+            if test_func():
+                passed += 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("\n" + "=" * 50)
+    print(f"📊 Test Results: {passed}/{len(tests)} tests passed")
+    return 0 if passed == len(tests) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
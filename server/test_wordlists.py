@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Wordlist check: external sort and merge, sparse-index lookups, shards, and the
+source restrictions. Runs offline on temp directories: python server/test_wordlists.py
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from wordlists import INDEX_STRIDE, WordlistError, WordlistStore
+
+def check(label, ok):
+    print(f"{'✅' if ok else '❌'} {label}")
+    return ok
+
+def write_source(directory, name, words):
+    with open(os.path.join(directory, name), "wb") as f:
+        f.write(b"".join(word + b"\n" for word in words))
+
+def make_store(workdir):
+    sources = os.path.join(workdir, "sources")
+    os.makedirs(sources, exist_ok=True)
+    rng = random.Random(7)
+    words = [f"word{rng.randrange(20 * INDEX_STRIDE):05d}".encode() for _ in range(30 * INDEX_STRIDE)]
+    write_source(sources, "a.txt", words[:20 * INDEX_STRIDE] + [b"", b"  padded  ", b"#comment"])
+    write_source(sources, "b.txt", words[10 * INDEX_STRIDE:] + [b"Upper"])
+    # Small slices so the sort really runs in several worker processes
+    return WordlistStore(sources, os.path.join(workdir, "store"), workers=2, chunk_bytes=16 * 1024), words
+
+def check_merge(store, words):
+    """Compiled lists are stripped, deduplicated and sorted; lists merge with files"""
+    store.compile("a", ["a.txt"])
+    meta = store.compile("ab", ["a", "b.txt"])
+    expected = sorted(set(words) | {b"padded", b"#comment", b"Upper"})
+    wordlist = store.open("ab")
+    try:
+        entries = list(wordlist.entries())
+    finally:
+        wordlist.close()
+    with open(os.path.join(store.store, "ab.txt"), "rb") as f:
+        text = f.read()
+    return all([
+        check("entries are sorted and unique", entries == expected),
+        check("metadata counts entries", meta["entries"] == len(expected)),
+        check("compiled file is one entry per line", text == b"".join(w + b"\n" for w in expected)),
+        check("source files were cut into several slices", meta["input_bytes"] > store.chunk_bytes),
+    ])
+
+def check_index(store, words):
+    """Membership and paging go through the sparse index"""
+    wordlist = store.open("ab")
+    try:
+        expected = list(wordlist.entries())
+        middle = len(expected) // 2
+        return all([
+            check("every entry is found", all(word in wordlist for word in words)),
+            check("absent entries are not found", not any(w in wordlist for w in (b"word", b"word99999", b"", b"zzz"))),
+            check("first and last entries are found", expected[0] in wordlist and expected[-1] in wordlist),
+            check("paging from the middle matches", list(wordlist.entries(middle, middle + 5)) == expected[middle:middle + 5]),
+            check("offsets land on entry starts",
+                  all(wordlist.offset(i) == sum(len(w) + 1 for w in expected[:i]) for i in (0, 1, INDEX_STRIDE, INDEX_STRIDE + 3))),
+        ])
+    finally:
+        wordlist.close()
+
+def check_shards(store):
+    """Shards are contiguous, cover the list exactly once and are balanced"""
+    paths = store.shard("ab", 3)
+    parts = []
+    for path in paths:
+        with open(path, "rb") as f:
+            parts.append(f.read())
+    with open(os.path.join(store.store, "ab.txt"), "rb") as f:
+        whole = f.read()
+    counts = [part.count(b"\n") for part in parts]
+    return all([
+        check("three shards", len(paths) == 3),
+        check("shards concatenate to the list", b"".join(parts) == whole),
+        check("shard sizes differ by at most one entry", max(counts) - min(counts) <= 1),
+        check("shards are reused", store.shard("ab", 3) == paths),
+    ])
+
+def check_restrictions(store, workdir):
+    """File sources stay inside the source directory; options are not silently dropped"""
+    outside = os.path.join(workdir, "secret.txt")
+    write_source(workdir, "secret.txt", [b"secret"])
+    os.symlink(outside, os.path.join(store.sources, "link.txt"))
+    results = []
+    for source in (outside, "../secret.txt", "link.txt"):
+        try:
+            store.compile("leak", [source])
+            results.append(check(f"{source} is refused", False))
+        except WordlistError:
+            results.append(check(f"{source} is refused", True))
+    try:
+        store.compile("lower", ["a", "b.txt"], lowercase=True)
+        results.append(check("lowercase with a plain compiled list is refused", False))
+    except WordlistError:
+        results.append(check("lowercase with a plain compiled list is refused", True))
+    store.compile("a-lower", ["a.txt"], lowercase=True)
+    meta = store.compile("lower", ["a-lower", "b.txt"], lowercase=True)
+    results.append(check("lowercase with a lowercased compiled list is merged", meta["entries"] > 0))
+    return all(results)
+
+def main():
+    print("🧪 Testing wordlists...")
+    print("=" * 50)
+    workdir = tempfile.mkdtemp(prefix="wordlists-test-")
+    passed = 0
+    try:
+        store, words = make_store(workdir)
+        tests = [
+            ("Sort and merge", lambda: check_merge(store, words)),
+            ("Index lookups", lambda: check_index(store, words)),
+            ("Shards", lambda: check_shards(store)),
+            ("Source restrictions", lambda: check_restrictions(store, workdir)),
+        ]
+        for test_name, test_func in tests:
+            print(f"\n🔍 {test_name}...")
+            if test_func():
+                passed += 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("\n" + "=" * 50)
+    print(f"📊 Test Results: {passed}/{len(tests)} tests passed")
+    return 0 if passed == len(tests) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
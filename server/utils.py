@@ -1,27 +1,143 @@
 # Utility functions for tool management
+import hashlib
+import json
 import os
-import subprocess
+import shutil
+import threading
+import time
+
+DEFAULT_CATEGORIES_PATH = '/app/categories'
+CATEGORIES_PATH = os.environ.get('CLI_CATEGORIES_PATH') or (
+    DEFAULT_CATEGORIES_PATH if os.path.isdir(DEFAULT_CATEGORIES_PATH)
+    else os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'categories')
+)
+# How often (seconds) the directory mtimes are re-checked; lookups in between are pure dict reads
+TOOLS_REFRESH_INTERVAL = float(os.environ.get('CLI_TOOLS_REFRESH_INTERVAL', '2'))
+
+# Executables a tool directory stands for, when they differ from the directory name
+TOOL_BINARIES = {
+    'ghidra': ['analyzeHeadless', 'ghidraRun'],
+}
+
+
+class ToolRegistry:
+    """
+    Index of categories/<category>/<tool>/ with each tool's scripts and the
+    resolved path of its binary. Rebuilt only when the mtime of the categories
+    tree or of a PATH directory changes, checked at most every
+    TOOLS_REFRESH_INTERVAL seconds. PATH lookups use shutil.which, in-process.
+    """
+
+    def __init__(self, categories_path=CATEGORIES_PATH, refresh_interval=TOOLS_REFRESH_INTERVAL):
+        self.categories_path = os.path.normpath(categories_path)
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._index = {"categories": {}, "tools": {}}
+        self._which = {}
+        self.etag = ""
+        self.generation = 0
+        self.refresh()
+
+    def _dirs(self):
+        # Every directory whose mtime changes when a tool, script or binary is added/removed
+        dirs = [self.categories_path]
+        for category in self._listdirs(self.categories_path):
+            category_path = os.path.join(self.categories_path, category)
+            dirs.append(category_path)
+            dirs.extend(os.path.join(category_path, tool) for tool in self._listdirs(category_path))
+        dirs.extend(p for p in os.environ.get('PATH', '').split(os.pathsep) if p)
+        return dirs
+
+    @staticmethod
+    def _listdirs(path):
+        try:
+            return sorted(e.name for e in os.scandir(path) if e.is_dir() and not e.name.startswith('.'))
+        except OSError:
+            return []
+
+    def _compute_signature(self):
+        signature = []
+        for path in self._dirs():
+            try:
+                signature.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                signature.append((path, None))
+        return tuple(signature)
+
+    def _build(self):
+        categories = {}
+        tools = {}
+        for category in self._listdirs(self.categories_path):
+            category_path = os.path.join(self.categories_path, category)
+            categories[category] = []
+            for tool in self._listdirs(category_path):
+                tool_path = os.path.join(category_path, tool)
+                categories[category].append(tool)
+                scripts = {}
+                for entry in sorted(os.scandir(tool_path), key=lambda e: e.name):
+                    if entry.is_file() and (os.access(entry.path, os.X_OK) or entry.name.endswith('.sh')):
+                        scripts[entry.name] = entry.path
+                binaries = {name: shutil.which(name) for name in [tool] + TOOL_BINARIES.get(tool, [])}
+                tools[tool] = {
+                    "category": category,
+                    "path": tool_path,
+                    "scripts": scripts,
+                    "binaries": binaries,
+                    "installed": any(binaries.values()),
+                    "intents": os.path.isfile(os.path.join(tool_path, 'intents.json')),
+                }
+        return {"categories": categories, "tools": tools}
+
+    def refresh(self, force=False):
+        """Rebuild the index if anything it depends on changed; returns True if it did"""
+        signature = self._compute_signature()
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if not force and signature == self._signature:
+                return False
+        index = self._build()
+        with self._lock:
+            self._signature = signature
+            self._index = index
+            self._which = {}
+            self.generation += 1
+            self.etag = hashlib.sha256(json.dumps(index, sort_keys=True).encode()).hexdigest()[:16]
+        return True
+
+    def _maybe_refresh(self):
+        with self._lock:
+            due = time.monotonic() - self._checked_at >= self.refresh_interval
+        if due:
+            self.refresh()
+
+    def snapshot(self):
+        """{"categories": {category: [tool, ...]}, "tools": {tool: {...}}}"""
+        self._maybe_refresh()
+        with self._lock:
+            return self._index
+
+    def which(self, name):
+        """Resolved path of an executable on PATH, or None (cached until PATH dirs change)"""
+        self._maybe_refresh()
+        with self._lock:
+            if name in self._which:
+                return self._which[name]
+        path = shutil.which(name)
+        with self._lock:
+            self._which[name] = path
+        return path
+
+
+registry = ToolRegistry()
+
 
 def get_available_tools():
     """Return a list of available tools in categories"""
-    tools = {}
-    categories_path = "/app/categories"
-    
-    for category in os.listdir(categories_path):
-        category_path = os.path.join(categories_path, category)
-        if os.path.isdir(category_path):
-            tools[category] = []
-            for tool in os.listdir(category_path):
-                tool_path = os.path.join(category_path, tool)
-                if os.path.isdir(tool_path):
-                    tools[category].append(tool)
-    
-    return tools
+    return {category: list(tools) for category, tools in registry.snapshot()["categories"].items()}
+
 
 def check_tool_installed(tool_name):
     """Check if a tool is installed and available in PATH"""
-    try:
-        subprocess.check_output(['which', tool_name], stderr=subprocess.STDOUT)
-        return True
-    except subprocess.CalledProcessError:
-        return False
\ No newline at end of file
+    return registry.which(tool_name) is not None
@@ -0,0 +1,396 @@
+# Wordlists compiled to sorted, deduplicated, memory-mapped files with a sparse index,
+# merged and split into shards for parallel runs (see /wordlists and /batch "wordlist")
+import array
+import heapq
+import json
+import mmap
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from result_store import DEFAULT_DB_DIR
+from utils import CATEGORIES_PATH
+
+# Source lists (plain text, one entry per line); relative source names resolve here
+WORDLIST_DIR = os.environ.get('CLI_WORDLIST_DIR') or os.path.join(
+    CATEGORIES_PATH, 'penetration_testing', 'sqlmap', 'wordlists')
+# Compiled lists and their shards
+WORDLIST_STORE = os.environ.get('CLI_WORDLIST_STORE') or os.path.join(DEFAULT_DB_DIR, 'wordlists')
+# Sorting runs in parallel worker processes, each taking a slice of about CHUNK_BYTES
+# of input; that (times a few) is the most memory one worker holds
+WORDLIST_WORKERS = int(os.environ.get('CLI_WORDLIST_WORKERS', str(os.cpu_count() or 2)))
+WORDLIST_CHUNK_BYTES = int(os.environ.get('CLI_WORDLIST_CHUNK_BYTES', str(16 * 1024 * 1024)))
+# One index entry (a byte offset) per this many words
+INDEX_STRIDE = 256
+
+NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,99}$')
+
+
+class WordlistError(ValueError):
+    """Bad name, missing source, or a list that cannot be sharded as asked"""
+
+
+def _key(word):
+    # Entries are compared as whole lines, newline included, everywhere (sort, merge, lookup)
+    return word + b"\n"
+
+
+def _split_ranges(path, chunk_bytes):
+    """(start, end) byte ranges of about chunk_bytes, each ending at a line boundary"""
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        start = 0
+        while start < size:
+            end = min(size, start + chunk_bytes)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def sort_run(path, start, end, out, lowercase=False, strip_comments=False):
+    """Normalize, dedupe and sort one byte range of a source list into a run file"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    words = set()
+    for line in data.splitlines():
+        word = line.strip()
+        if not word or (strip_comments and word.startswith(b"#")):
+            continue
+        words.add(_key(word.lower() if lowercase else word))
+    del data
+    with open(out, 'wb') as f:
+        f.writelines(sorted(words))
+
+
+class Wordlist:
+    """
+    A compiled list: <name>.txt holds the unique entries sorted bytewise, one per
+    line, so tools can read it directly; <name>.idx holds the byte offset of every
+    INDEX_STRIDE-th entry; <name>.json the metadata. The text is memory-mapped,
+    so lookups and slicing touch only the pages they need.
+    """
+
+    def __init__(self, store, name):
+        self.name = name
+        self.path = os.path.join(store, name + '.txt')
+        with open(os.path.join(store, name + '.json')) as f:
+            self.meta = json.load(f)
+        self.index = array.array('Q')
+        with open(os.path.join(store, name + '.idx'), 'rb') as f:
+            self.index.frombytes(f.read())
+        self._file = open(self.path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.meta["entries"]
+
+    def offset(self, i):
+        """Byte offset of entry i (len(self) gives the end of the file)"""
+        if i >= len(self):
+            return len(self._mm)
+        pos = self.index[i // INDEX_STRIDE]
+        for _ in range(i % INDEX_STRIDE):
+            pos = self._mm.find(b"\n", pos) + 1
+        return pos
+
+    def _line(self, pos):
+        return self._mm[pos:self._mm.find(b"\n", pos) + 1]
+
+    def entries(self, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        pos = self.offset(start)
+        for _ in range(max(0, stop - start)):
+            end = self._mm.find(b"\n", pos) + 1
+            yield self._mm[pos:end - 1]
+            pos = end
+
+    def __contains__(self, word):
+        key = _key(word)
+        # Last index block whose first entry is <= key, then a scan of that block
+        lo, hi = 0, len(self.index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._line(self.index[mid]) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return False
+        pos = self.index[lo - 1]
+        end = self.index[lo] if lo < len(self.index) else len(self._mm)
+        while pos < end:
+            line = self._line(pos)
+            if line >= key:
+                return line == key
+            pos += len(line)
+        return False
+
+    def to_dict(self):
+        return dict(self.meta, name=self.name, path=self.path)
+
+
+class WordlistStore:
+    """Compiles, merges, looks up and shards wordlists kept under `store`"""
+
+    def __init__(self, sources=WORDLIST_DIR, store=WORDLIST_STORE, workers=WORDLIST_WORKERS,
+                 chunk_bytes=WORDLIST_CHUNK_BYTES):
+        self.sources = sources
+        self.store = store
+        self.workers = workers
+        self.chunk_bytes = chunk_bytes
+        self._lock = threading.Lock()
+        # Compiles of different names may run at once; the same name is serialized
+        self._building = {}
+        os.makedirs(store, exist_ok=True)
+
+    def _check_name(self, name):
+        if not isinstance(name, str) or not NAME_RE.match(name):
+            raise WordlistError("name must be letters, digits, '.', '_' or '-' (at most 100)")
+
+    def _compiled(self, name):
+        return os.path.isfile(os.path.join(self.store, name + '.json'))
+
+    def open(self, name):
+        """The compiled list, or None; close it when done"""
+        self._check_name(name)
+        return Wordlist(self.store, name) if self._compiled(name) else None
+
+    def list(self):
+        """Compiled lists, and source files in the wordlist directory"""
+        compiled = []
+        for entry in sorted(os.listdir(self.store)):
+            if entry.endswith('.json'):
+                with open(os.path.join(self.store, entry)) as f:
+                    compiled.append(dict(json.load(f), name=entry[:-5]))
+        try:
+            sources = [{"name": e.name, "bytes": e.stat().st_size}
+                       for e in sorted(os.scandir(self.sources), key=lambda e: e.name)
+                       if e.is_file() and not e.name.startswith('.')]
+        except OSError:
+            sources = []
+        return {"wordlists": compiled, "sources": sources, "source_dir": self.sources}
+
+    def _resolve(self, source):
+        """A compiled list name -> ("list", name); a file in the source directory -> ("file", path)"""
+        if not isinstance(source, str) or not source:
+            raise WordlistError("sources must be wordlist names or file paths")
+        if NAME_RE.match(source) and self._compiled(source):
+            return "list", source
+        if os.path.isabs(source):
+            raise WordlistError(f"file sources must be relative to the wordlist directory: {source}")
+        root = os.path.realpath(self.sources)
+        path = os.path.realpath(os.path.join(root, source))
+        # Symlinks and ".." count too: what matters is where the file really is
+        if os.path.commonpath([root, path]) != root:
+            raise WordlistError(f"{source} is outside the wordlist directory")
+        if not os.path.isfile(path):
+            raise WordlistError(f"no such wordlist or file: {source}")
+        return "file", path
+
+    def _check_options(self, name, lowercase, strip_comments):
+        # Compiled lists are merged as they are, so they must already have the options asked for
+        with open(os.path.join(self.store, name + '.json')) as f:
+            meta = json.load(f)
+        if (lowercase and not meta.get("lowercase")) or (strip_comments and not meta.get("strip_comments")):
+            raise WordlistError(f"{name} was compiled without lowercase/strip_comments; "
+                                "those options only apply to source files")
+
+    def compile(self, name, sources, lowercase=False, strip_comments=False):
+        """
+        Build `name` from source files and/or compiled lists: every entry
+        stripped, empty lines dropped, duplicates removed, sorted. lowercase
+        and strip_comments are applied to source files; a compiled list is
+        only accepted if it was built with them too. Source files
+        are cut into slices that are sorted by parallel worker processes, then
+        all runs (and any compiled lists, which are already sorted) are merged
+        in one streaming pass. Returns the new list's metadata.
+        """
+        self._check_name(name)
+        if not isinstance(sources, list) or not sources:
+            raise WordlistError("sources must be a non-empty list")
+        resolved = [self._resolve(s) for s in sources]
+        for kind, source in resolved:
+            if kind == "list":
+                self._check_options(source, lowercase, strip_comments)
+        with self._lock:
+            if name in self._building:
+                raise WordlistError(f"{name} is already being built")
+            self._building[name] = True
+        start = time.perf_counter()
+        tmp = tempfile.mkdtemp(dir=self.store, prefix='.build-')
+        try:
+            runs = [os.path.join(self.store, n + '.txt') for kind, n in resolved if kind == "list"]
+            slices = [(path, a, b) for kind, path in resolved if kind == "file"
+                      for a, b in _split_ranges(path, self.chunk_bytes)]
+            runs += self._sort_slices(slices, tmp, lowercase, strip_comments)
+            sorted_at = time.perf_counter()
+            entries, size = self._merge(runs, tmp)
+            meta = {
+                "entries": entries,
+                "bytes": size,
+                "sources": [os.path.basename(s) if kind == "file" else s for (kind, _), s in zip(resolved, sources)],
+                "lowercase": bool(lowercase),
+                "strip_comments": bool(strip_comments),
+                "input_bytes": sum(b - a for _, a, b in slices),
+                "created_at": time.time(),
+                "timings": {"sort": round(sorted_at - start, 3), "merge": round(time.perf_counter() - sorted_at, 3)},
+            }
+            with open(os.path.join(tmp, 'list.json'), 'w') as f:
+                json.dump(meta, f)
+            with self._lock:
+                self._drop_shards(name)
+                # The index and data go first; the .json is what marks the list as present
+                for ext in ('.txt', '.idx', '.json'):
+                    os.replace(os.path.join(tmp, 'list' + ext), os.path.join(self.store, name + ext))
+            return dict(meta, name=name)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+            with self._lock:
+                self._building.pop(name, None)
+
+    def _sort_slices(self, slices, tmp, lowercase, strip_comments):
+        # Each slice is sorted by a fresh interpreter running this file, so the
+        # work spreads over cores without forking the (threaded) server
+        def run(i):
+            path, a, b = slices[i]
+            out = os.path.join(tmp, f"run-{i}")
+            cmd = [sys.executable, os.path.abspath(__file__), 'sort-run', path, str(a), str(b), out]
+            cmd += ['--lowercase'] * bool(lowercase) + ['--strip-comments'] * bool(strip_comments)
+            result = subprocess.run(cmd, capture_output=True)
+            if result.returncode != 0:
+                raise WordlistError(f"sorting {path} failed: {result.stderr.decode(errors='replace')[-500:]}")
+            return out
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="wordlist") as pool:
+            return list(pool.map(run, range(len(slices))))
+
+    @staticmethod
+    def _merge(runs, tmp):
+        # k-way merge of sorted runs, dropping repeats, writing data and index together
+        files = [open(path, 'rb') for path in runs]
+        index = array.array('Q')
+        entries = size = 0
+        previous = None
+        try:
+            with open(os.path.join(tmp, 'list.txt'), 'wb', buffering=1024 * 1024) as out:
+                for line in heapq.merge(*files):
+                    if line == previous:
+                        continue
+                    if not line.endswith(b"\n"):
+                        line += b"\n"
+                    if entries % INDEX_STRIDE == 0:
+                        index.append(size)
+                    out.write(line)
+                    previous = line
+                    entries += 1
+                    size += len(line)
+        finally:
+            for f in files:
+                f.close()
+        with open(os.path.join(tmp, 'list.idx'), 'wb') as f:
+            index.tofile(f)
+        return entries, size
+
+    def _shard_dir(self, name, count):
+        return os.path.join(self.store, name + '.shards', str(count))
+
+    def _drop_shards(self, name):
+        shutil.rmtree(os.path.join(self.store, name + '.shards'), ignore_errors=True)
+
+    def shard(self, name, count):
+        """
+        Split a compiled list into `count` contiguous slices of (nearly) equal
+        entry counts and return their paths. Slices are byte ranges of the
+        compiled file, copied once and reused until the list is rebuilt.
+        """
+        wordlist = self.open(name)
+        if wordlist is None:
+            raise WordlistError(f"no compiled wordlist named {name}")
+        try:
+            count = min(count, len(wordlist))
+            if count < 1:
+                raise WordlistError(f"{name} is empty")
+            directory = self._shard_dir(name, count)
+            paths = [os.path.join(directory, f"{i}.txt") for i in range(count)]
+            if os.path.isdir(directory):
+                return paths
+            bounds = [wordlist.offset(len(wordlist) * i // count) for i in range(count + 1)]
+            tmp = tempfile.mkdtemp(dir=self.store, prefix='.shards-')
+            try:
+                with open(wordlist.path, 'rb') as src:
+                    for i in range(count):
+                        with open(os.path.join(tmp, f"{i}.txt"), 'wb') as dst:
+                            _copy_range(src, dst, bounds[i], bounds[i + 1] - bounds[i])
+                os.makedirs(os.path.dirname(directory), exist_ok=True)
+                try:
+                    os.rename(tmp, directory)
+                except OSError:
+                    # Another request made the same shards first
+                    shutil.rmtree(tmp, ignore_errors=True)
+            except BaseException:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+            return paths
+        finally:
+            wordlist.close()
+
+    def delete(self, name):
+        self._check_name(name)
+        with self._lock:
+            if not self._compiled(name):
+                return False
+            os.unlink(os.path.join(self.store, name + '.json'))
+            for ext in ('.txt', '.idx'):
+                try:
+                    os.unlink(os.path.join(self.store, name + ext))
+                except OSError:
+                    pass
+            self._drop_shards(name)
+        return True
+
+
+def _copy_range(src, dst, offset, length):
+    # In-kernel copy where available; a plain read/write loop otherwise
+    try:
+        while length > 0:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), length, offset)
+            if copied == 0:
+                break
+            offset += copied
+            length -= copied
+        return
+    except (AttributeError, OSError):
+        pass
+    src.seek(offset)
+    while length > 0:
+        chunk = src.read(min(length, 1024 * 1024))
+        if not chunk:
+            break
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+if __name__ == '__main__':
+    # Worker mode for WordlistStore._sort_slices: sort-run <source> <start> <end> <out> [flags]
+    if len(sys.argv) < 6 or sys.argv[1] != 'sort-run':
+        sys.exit("Usage: wordlists.py sort-run <source> <start> <end> <out> [--lowercase] [--strip-comments]")
+    sort_run(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), sys.argv[5],
+             lowercase='--lowercase' in sys.argv[6:], strip_comments='--strip-comments' in sys.argv[6:])
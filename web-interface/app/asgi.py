@@ -0,0 +1,590 @@
+# web-interface/app/asgi.py
+"""ASGI serving mode: the same /api contract as server.py on Starlette with async CLI I/O."""
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import anyio
+import httpx
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.datastructures import MutableHeaders
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+# Keys, caches, intent rules, the tool catalog and the model calls are shared with
+# the Flask app; only the request handling differs
+from key_health import WORKING
+from key_scheduler import NoKeyAvailable
+from compaction import RollingSummary
+from metrics import REGISTRY, ServerTiming
+from summaries import render_summary, renders_command
+from server import (
+    CLI_ARTIFACTS_URL, CLI_BATCH_URL, CLI_RESULTS_URL, CLI_RUN_TIMEOUT, CLI_RUN_URL, HTTP_SECONDS, STREAM_IDLE_TIMEOUT,
+    STREAM_SUMMARY_TAIL, ModelError, cache_stats_body, guarded_summary, intents, key_health,
+    profile_response, scheduler, summarize_output, summarize_text, translate_task,
+)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Model calls are blocking (key scheduling, retries, micro-batching) and run on at
+# most this many worker threads; everything that waits on the CLI server is async
+MODEL_THREADS = int(os.environ.get('MODEL_THREADS', '64'))
+# Connections to the CLI server; every streamed command holds one for its lifetime
+CLI_MAX_CONNECTIONS = int(os.environ.get('CLI_MAX_CONNECTIONS', '512'))
+# Worker processes; each has its own key state and caches (see GEMINI_API_KEYS)
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', '1'))
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+log = logging.getLogger("gateway")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    limits = httpx.Limits(max_connections=CLI_MAX_CONNECTIONS, max_keepalive_connections=64)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(CLI_RUN_TIMEOUT, connect=5)) as client:
+        app.state.cli = client
+        app.state.model_threads = anyio.CapacityLimiter(MODEL_THREADS)
+        yield
+
+
+class TimingMiddleware:
+    """
+    Gives each request a ServerTiming (request.state.timing) and sends it as
+    the Server-Timing header with a total, like the Flask app's hooks.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = ServerTiming()
+        scope.setdefault("state", {})["timing"] = timing
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - started
+                timing.add("total", elapsed)
+                MutableHeaders(scope=message).append("Server-Timing", timing.header())
+                endpoint = getattr(scope.get("endpoint"), "__name__", None)
+                if endpoint is None:
+                    endpoint = "static" if scope["path"].startswith("/static/") else "unmatched"
+                HTTP_SECONDS.observe(elapsed, endpoint=endpoint, method=scope["method"],
+                                     status=message["status"])
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+
+async def in_thread(request: Request, fn, *args):
+    """Run a blocking model call off the event loop; a cancelled caller does not wait for it"""
+    return await anyio.to_thread.run_sync(fn, *args, limiter=request.app.state.model_threads,
+                                          abandon_on_cancel=True)
+
+
+async def until_disconnect(request: Request, handler) -> Response:
+    """
+    Await handler() unless the client goes away first, in which case it is
+    cancelled (closing any CLI request it has open, which kills the command).
+    """
+    response: Optional[Response] = None
+
+    async def watch(scope):
+        while True:
+            message = await request.receive()
+            if message["type"] == "http.disconnect":
+                scope.cancel()
+                return
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(watch, tg.cancel_scope)
+        response = await handler()
+        tg.cancel_scope.cancel()
+    # 499: client closed request (nobody reads it, but the access log shows it)
+    return response if response is not None else Response(status_code=499)
+
+
+async def read_json(request: Request) -> Dict:
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def cli_unreachable(e: Exception, url: str) -> JSONResponse:
+    return JSONResponse({"error": "failed to reach CLI server", "detail": str(e), "cli_url": url}, 502)
+
+
+def no_key_response(e: NoKeyAvailable) -> JSONResponse:
+    headers = {"Retry-After": str(int(e.retry_after + 0.999))} if e.retry_after else None
+    return JSONResponse({"error": "no working API key available"}, 503, headers=headers)
+
+
+async def cli_error_response(r: httpx.Response) -> JSONResponse:
+    """Forward a CLI server error, keeping its Retry-After (429 when the run queue is full)"""
+    await r.aread()
+    try:
+        body = r.json()
+    except ValueError:
+        body = r.text
+    headers = {"Retry-After": r.headers["Retry-After"]} if r.headers.get("Retry-After") else None
+    return JSONResponse({"error": "cli_server_error", "body": body}, r.status_code, headers=headers)
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventStreamResponse(StreamingResponse):
+    """
+    Streams while watching for the client to disconnect, also during long
+    silences (a scan printing nothing for minutes). Starlette on ASGI 2.4
+    servers only notices a disconnect when a send fails.
+    """
+
+    async def __call__(self, scope, receive, send):
+        async with anyio.create_task_group() as tg:
+            async def stream():
+                try:
+                    await self.stream_response(send)
+                except OSError:
+                    pass
+                tg.cancel_scope.cancel()
+
+            tg.start_soon(stream)
+            await self.listen_for_disconnect(receive)
+            tg.cancel_scope.cancel()
+        if self.background is not None:
+            await self.background()
+
+
+def sse_response(gen) -> StreamingResponse:
+    # A disconnect cancels the generator; its finally blocks close the upstream
+    # request, which makes the CLI server kill the command
+    return EventStreamResponse(gen, media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+async def close_upstream(resp: httpx.Response):
+    # Runs in finally blocks that may be unwinding a cancellation
+    with anyio.CancelScope(shield=True):
+        await resp.aclose()
+
+
+async def aiter_sse(resp: httpx.Response) -> AsyncIterator[Tuple[str, Dict]]:
+    event, data = "message", []
+    async for line in resp.aiter_lines():
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+
+async def open_cli_stream(request: Request, url: str, payload: Dict):
+    """Start a streaming POST to the CLI server; returns (response, error_response)"""
+    client: httpx.AsyncClient = request.app.state.cli
+    req = client.build_request("POST", url, json=payload,
+                               timeout=httpx.Timeout(STREAM_IDLE_TIMEOUT, connect=5))
+    try:
+        with request.state.timing.stage("cli_open"):
+            r = await client.send(req, stream=True)
+    except httpx.HTTPError as e:
+        return None, cli_unreachable(e, url)
+    if r.status_code != 200:
+        error = await cli_error_response(r)
+        await r.aclose()
+        return None, error
+    return r, None
+
+
+async def translate(request: Request, task: str):
+    """Returns ((command, source), None) or (None, error_response)"""
+    try:
+        with request.state.timing.stage("translate"):
+            return await in_thread(request, translate_task, task), None
+    except ModelError as e:
+        return None, JSONResponse(e.body, 502)
+    except NoKeyAvailable as e:
+        return None, no_key_response(e)
+
+
+async def summarize(request: Request, parsed, raw_output: str):
+    with request.state.timing.stage("summarize"):
+        summary = render_summary(parsed)
+        if summary is not None:
+            return summary, "parser"
+        return await in_thread(request, summarize_output, raw_output), "model"
+
+
+async def save_summary(request: Request, result_id, summary):
+    """Attach the summary to the CLI server's stored result; best effort"""
+    if result_id is None or not summary:
+        return
+    try:
+        with request.state.timing.stage("save_summary"):
+            await request.app.state.cli.patch(f"{CLI_RESULTS_URL}/{result_id}", json={"summary": summary},
+                                              timeout=5)
+    except httpx.HTTPError as e:
+        log.warning("could not store summary for result %s: %s", result_id, e)
+
+
+async def index(request: Request):
+    return FileResponse(os.path.join(APP_DIR, 'templates', 'index.html'))
+
+
+async def init_keys(request: Request):
+    data = await read_json(request)
+    keys = data.get('keys', [])
+    if not isinstance(keys, list):
+        return JSONResponse({"error": "keys must be a list"}, 400)
+    checked = await anyio.to_thread.run_sync(key_health.check_many, keys)
+    results, new_working = [], []
+    for k in keys:
+        status, info = checked[k]
+        ok = status == WORKING
+        results.append({"key": k, "status": status, "info": info if not ok else ""})
+        if ok and k not in new_working:
+            new_working.append(k)
+    scheduler.set_keys(new_working)
+    return JSONResponse({"keys": results, "working_count": len(new_working)})
+
+
+async def key_status(request: Request):
+    return JSONResponse({"keys": scheduler.status()})
+
+
+async def process_command(request: Request):
+    """Same contract as server.process_command"""
+    data = await read_json(request)
+    task = data.get('task', '').strip()
+    if not task:
+        return JSONResponse({"error": "task is required"}, 400)
+    if data.get('stream'):
+        translated, error = await translate(request, task)
+        if error:
+            return error
+        return await stream_process_command(request, *translated, data.get('timeout'), task)
+
+    async def handle():
+        translated, error = await translate(request, task)
+        if error:
+            return error
+        command, command_source = translated
+        timing = request.state.timing
+        try:
+            with timing.stage("cli"):
+                cli_resp = await request.app.state.cli.post(
+                    CLI_RUN_URL, json={"command": command, "parse": True, "cache": bool(data.get('cache', False)), "task": task})
+        except httpx.HTTPError as e:
+            return cli_unreachable(e, CLI_RUN_URL)
+        timing.merge(cli_resp.headers.get("Server-Timing"), "cli-")
+        if cli_resp.status_code not in (200, 201):
+            return await cli_error_response(cli_resp)
+        cli_body = cli_resp.json()
+        raw_output = cli_body.get('output', cli_resp.text)
+        parsed = cli_body.get('parsed')
+        summary, summary_source = await summarize(request, parsed, raw_output)
+        await save_summary(request, cli_body.get('result_id'), summary)
+        return JSONResponse({"command": command, "command_source": command_source, "raw": raw_output,
+                             "parsed": parsed, "summary": summary, "summary_source": summary_source,
+                             "result_id": cli_body.get('result_id')})
+
+    return await until_disconnect(request, handle)
+
+
+async def stream_process_command(request: Request, command, command_source, timeout, task=None):
+    payload = {"command": command, "stream": True, "parse": True}
+    if timeout is not None:
+        payload["timeout"] = timeout
+    if task:
+        payload["task"] = task
+    cli_resp, error = await open_cli_stream(request, CLI_RUN_URL, payload)
+    if error:
+        return error
+
+    async def generate():
+        tail = deque()
+        tail_size = 0
+        parsed = None
+        result_id = None
+        rolling = None if renders_command(command) else RollingSummary(summarize_text)
+        running = None
+        try:
+            yield sse_event("command", {"command": command, "command_source": command_source})
+            async for event, payload in aiter_sse(cli_resp):
+                if event == "output":
+                    text = payload.get("text", "")
+                    tail.append(text)
+                    tail_size += len(text)
+                    while tail_size > STREAM_SUMMARY_TAIL and len(tail) > 1:
+                        tail_size -= len(tail.popleft())
+                    if rolling is not None:
+                        rolling.feed(text)
+                elif event == "parsed":
+                    parsed = payload
+                elif event == "stored":
+                    result_id = payload.get("result_id")
+                yield sse_event(event, payload)
+                if rolling is not None and rolling.running() != running:
+                    running = rolling.running()
+                    yield sse_event("partial_summary", {"summary": running})
+            if rolling is not None and render_summary(parsed) is None:
+                with request.state.timing.stage("summarize"):
+                    summary = await in_thread(request, guarded_summary, rolling.finish)
+                summary_source = "model"
+            else:
+                summary, summary_source = await summarize(request, parsed, "".join(tail))
+            yield sse_event("summary", {"summary": summary, "summary_source": summary_source})
+            await save_summary(request, result_id, summary)
+        finally:
+            if rolling is not None:
+                rolling.cancel()
+            await close_upstream(cli_resp)
+
+    return sse_response(generate())
+
+
+async def batch_command(request: Request):
+    """Same contract as server.batch_command"""
+    data = await read_json(request)
+    command = data.get('command', '').strip()
+    command_source = "direct"
+    task = data.get('task', '').strip()
+    if not command:
+        if not task:
+            return JSONResponse({"error": "task or command is required"}, 400)
+        translated, error = await translate(request, task)
+        if error:
+            return error
+        command, command_source = translated
+
+    payload = {"command": command, "stream": True}
+    for field in ("targets", "shards", "timeout", "task"):
+        if data.get(field) is not None:
+            payload[field] = data[field]
+    cli_resp, error = await open_cli_stream(request, CLI_BATCH_URL, payload)
+    if error:
+        return error
+
+    async def events():
+        tail = deque()
+        tail_size = 0
+        report = None
+        result_id = None
+        try:
+            async for event, payload in aiter_sse(cli_resp):
+                if event == "shard":
+                    text = f"# shard {payload.get('index')} ({' '.join(payload.get('targets', []))})\n{payload.get('output', '')}"
+                    tail.append(text)
+                    tail_size += len(text)
+                    while tail_size > STREAM_SUMMARY_TAIL and len(tail) > 1:
+                        tail_size -= len(tail.popleft())
+                elif event == "report":
+                    report = payload
+                elif event == "stored":
+                    result_id = payload.get("result_id")
+                yield event, payload
+            summary, summary_source = await summarize(request, report, "\n".join(tail))
+            yield "summary", {"summary": summary, "summary_source": summary_source}
+            await save_summary(request, result_id, summary)
+        finally:
+            await close_upstream(cli_resp)
+
+    if data.get('stream'):
+        async def generate():
+            yield sse_event("command", {"command": command, "command_source": command_source})
+            async for event, payload in events():
+                yield sse_event(event, payload)
+
+        return sse_response(generate())
+
+    async def collect():
+        body = {"command": command, "command_source": command_source, "shards": []}
+        async for event, payload in events():
+            if event == "shard":
+                body["shards"].append(payload)
+            elif event == "plan":
+                body["batch_id"] = payload.get("batch_id")
+            elif event == "done":
+                body.update({k: v for k, v in payload.items() if k != "shards"})
+            elif event in ("report", "summary", "stored"):
+                body.update({"report": payload} if event == "report" else payload)
+        body["shards"].sort(key=lambda shard: shard.get("index", 0))
+        return JSONResponse(body)
+
+    try:
+        return await until_disconnect(request, collect)
+    finally:
+        await close_upstream(cli_resp)
+
+
+async def proxy_results(request: Request, path: str = ""):
+    client: httpx.AsyncClient = request.app.state.cli
+    req = client.build_request("GET", CLI_RESULTS_URL + path, params=request.query_params,
+                               timeout=httpx.Timeout(30, connect=5))
+    try:
+        r = await client.send(req, stream=True)
+    except httpx.HTTPError as e:
+        return cli_unreachable(e, CLI_RESULTS_URL)
+    return StreamingResponse(r.aiter_raw(), status_code=r.status_code,
+                             media_type=r.headers.get('Content-Type', 'application/json'),
+                             background=BackgroundTask(r.aclose))
+
+
+async def history(request: Request):
+    return await proxy_results(request)
+
+
+async def history_item(request: Request):
+    return await proxy_results(request, f"/{request.path_params['result_id']}")
+
+
+async def history_output(request: Request):
+    return await proxy_results(request, f"/{request.path_params['result_id']}/output")
+
+
+async def proxy_artifacts(request: Request, method: str, path: str = "", timeout: Optional[float] = 30,
+                          **kwargs) -> Response:
+    client: httpx.AsyncClient = request.app.state.cli
+    req = client.build_request(method, CLI_ARTIFACTS_URL + path, params=request.query_params,
+                               timeout=httpx.Timeout(timeout, connect=5), **kwargs)
+    try:
+        r = await client.send(req, stream=True)
+    except httpx.HTTPError as e:
+        return cli_unreachable(e, CLI_ARTIFACTS_URL)
+    return StreamingResponse(r.aiter_raw(), status_code=r.status_code,
+                             media_type=r.headers.get('Content-Type', 'application/json'),
+                             background=BackgroundTask(r.aclose))
+
+
+async def upload_artifact(request: Request):
+    # The body goes to the CLI server as it arrives, so the gateway never holds a whole sample
+    headers = {"Content-Type": "application/octet-stream"}
+    for name in ("Content-Length", "X-Content-SHA256"):
+        if request.headers.get(name):
+            headers[name] = request.headers[name]
+    with request.state.timing.stage("upload"):
+        return await proxy_artifacts(request, "POST", content=request.stream(), headers=headers, timeout=300)
+
+
+async def artifact_info(request: Request):
+    return await proxy_artifacts(request, "GET", f"/{request.path_params['sha256']}")
+
+
+async def analyze_artifact(request: Request):
+    data = await read_json(request)
+    with request.state.timing.stage("analyze"):
+        return await proxy_artifacts(request, "POST", f"/{request.path_params['sha256']}/analyze", json=data,
+                                     timeout=None if data.get('wait') else 30)
+
+
+async def intent_stats(request: Request):
+    return JSONResponse(intents.stats())
+
+
+async def reload_intents(request: Request):
+    await anyio.to_thread.run_sync(intents.reload)
+    return JSONResponse(intents.stats())
+
+
+async def cache_stats(request: Request):
+    return JSONResponse(cache_stats_body())
+
+
+async def direct_command(request: Request):
+    """Same contract as server.direct_command"""
+    data = await read_json(request)
+    cmd = data.get('command', '').strip()
+    if not cmd:
+        return JSONResponse({"error": "command required"}, 400)
+
+    if data.get('stream'):
+        payload = {"command": cmd, "stream": True, "parse": False}
+        if data.get('timeout') is not None:
+            payload["timeout"] = data['timeout']
+        cli_resp, error = await open_cli_stream(request, CLI_RUN_URL, payload)
+        if error:
+            return error
+
+        async def relay():
+            # Pass upstream SSE frames straight through; nothing is buffered here
+            try:
+                async for chunk in cli_resp.aiter_raw():
+                    yield chunk
+            finally:
+                await close_upstream(cli_resp)
+
+        return sse_response(relay())
+
+    async def handle():
+        try:
+            with request.state.timing.stage("cli"):
+                r = await request.app.state.cli.post(
+                    CLI_RUN_URL, json={"command": cmd, "cache": bool(data.get('cache', False))})
+        except httpx.HTTPError as e:
+            return cli_unreachable(e, CLI_RUN_URL)
+        request.state.timing.merge(r.headers.get("Server-Timing"), "cli-")
+        if r.status_code not in (200, 201):
+            return await cli_error_response(r)
+        return Response(r.content, status_code=r.status_code, media_type='application/json')
+
+    return await until_disconnect(request, handle)
+
+
+async def metrics(request: Request):
+    return Response(REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+
+async def profile(request: Request):
+    # Sampling blocks its thread for the whole profile, so it does not take a model thread
+    body, status, media_type = await anyio.to_thread.run_sync(profile_response, request.query_params.get('seconds'))
+    return Response(body, status, media_type=media_type)
+
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/api/initKeys', init_keys, methods=['POST']),
+        Route('/api/keyStatus', key_status, methods=['GET']),
+        Route('/api/processCommand', process_command, methods=['POST']),
+        Route('/api/batchCommand', batch_command, methods=['POST']),
+        Route('/api/history', history, methods=['GET']),
+        Route('/api/history/{result_id:int}', history_item, methods=['GET']),
+        Route('/api/history/{result_id:int}/output', history_output, methods=['GET']),
+        Route('/api/artifacts', upload_artifact, methods=['POST']),
+        Route('/api/artifacts/{sha256}', artifact_info, methods=['GET']),
+        Route('/api/artifacts/{sha256}/analyze', analyze_artifact, methods=['POST']),
+        Route('/api/intents', intent_stats, methods=['GET']),
+        Route('/api/intents/reload', reload_intents, methods=['POST']),
+        Route('/api/cacheStats', cache_stats, methods=['GET']),
+        Route('/api/directCommand', direct_command, methods=['POST']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/debug/profile', profile, methods=['GET']),
+        Mount('/static', StaticFiles(directory=os.path.join(APP_DIR, 'static')), name='static'),
+    ],
+    middleware=[Middleware(TimingMiddleware)],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run('asgi:app', app_dir=APP_DIR,
+                host=os.environ.get('WEB_HOST', '0.0.0.0'),
+                port=int(os.environ.get('WEB_PORT', '3000')),
+                workers=WEB_WORKERS)
@@ -0,0 +1,249 @@
+# web-interface/app/compaction.py
+"""Shrink terminal output before it is sent to the model for summarization."""
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, List, Optional
+
+from key_scheduler import estimate_tokens
+
+# Token budget for one summarization prompt, and the size of map-step chunks
+SUMMARY_TOKEN_BUDGET = int(os.environ.get('SUMMARY_TOKEN_BUDGET', '6000'))
+SUMMARY_CHUNK_TOKENS = int(os.environ.get('SUMMARY_CHUNK_TOKENS', '3000'))
+CHUNK_SUMMARY_CACHE_SIZE = int(os.environ.get('CHUNK_SUMMARY_CACHE_SIZE', '512'))
+# Keep at most this many chunks; the middle of anything longer is dropped
+SUMMARY_MAX_CHUNKS = int(os.environ.get('SUMMARY_MAX_CHUNKS', '8'))
+# Chunk summaries (the map step) run concurrently
+SUMMARY_MAP_WORKERS = int(os.environ.get('SUMMARY_MAP_WORKERS', '4'))
+# Streamed output is summarized in windows of this many (compacted) tokens while it runs
+ROLLING_SUMMARY_WINDOW_TOKENS = int(os.environ.get('ROLLING_SUMMARY_WINDOW_TOKENS', '1500'))
+
+_map_pool = ThreadPoolExecutor(max_workers=SUMMARY_MAP_WORKERS, thread_name_prefix="summary-map")
+
+# Progress / status spam that carries no findings
+PROGRESS_RES = [re.compile(p) for p in (
+    r"^Stats: \d+:\d+:\d+ elapsed",                             # nmap --stats-every
+    r"^[\w ]+ Timing: About [\d.]+% done",                     # nmap timing lines
+    r"^Initiating \w",                                         # nmap phase starts
+    r"^Completed \w.* at \d+:\d+",                             # nmap phase ends
+    r"^Discovered open port ",                                 # repeated in the port table
+    r"^(?:\[\d{2}:\d{2}:\d{2}\] )?\[INFO\] (?:testing|checking|resuming|fetching|retrieved:|heuristic)",  # sqlmap chatter
+    r"^(?:\[\d{2}:\d{2}:\d{2}\] )?\[DEBUG\]",
+    r"^\s*\d{1,3}(?:\.\d+)?%\s*(?:\||\[|$)",                   # generic progress bars
+    r"^[\s.\-=#*|/\\]*$",                                      # rulers and spinners
+)]
+
+# Banners and legal boilerplate at the start of tool output
+BANNER_RES = [re.compile(p, re.IGNORECASE) for p in (
+    r"^Starting Nmap [\d.]+ \(",
+    r"^Read data files from: ",
+    r"^\s*___\s*$|^\s*__H__|^\s*___ ___\[|^\s*\|_ -\| |^\s*\|___|^\s*\|_\|V",  # sqlmap ascii logo
+    r"^\s*https?://sqlmap\.org",
+    r"^\[!\] legal disclaimer:",
+    r"^\[\*\] (?:starting|ending) @ ",
+)]
+
+
+TIMESTAMP_RE = re.compile(r"^\[\d{2}:\d{2}:\d{2}\] ")
+
+
+def _is_noise(line: str) -> bool:
+    return any(r.search(line) for r in PROGRESS_RES) or any(r.search(line) for r in BANNER_RES)
+
+
+def compact_output(text: str) -> str:
+    """
+    Strip banners and progress spam and collapse runs of repeated lines
+    ("x" * 40 becomes "x  [repeated 40 times]"). A leading [HH:MM:SS]
+    timestamp is ignored when comparing lines.
+    """
+    out: List[str] = []
+    prev_shape = None
+    repeats = 0
+    for line in text.splitlines():
+        line = line.rstrip()
+        if _is_noise(line):
+            continue
+        shape = TIMESTAMP_RE.sub("", line)
+        if shape == prev_shape:
+            repeats += 1
+            continue
+        if repeats:
+            out[-1] += f"  [repeated {repeats + 1} times]"
+        out.append(line)
+        prev_shape = shape
+        repeats = 0
+    if repeats:
+        out[-1] += f"  [repeated {repeats + 1} times]"
+    return "\n".join(out)
+
+
+def split_chunks(text: str, chunk_tokens: int = SUMMARY_CHUNK_TOKENS) -> List[str]:
+    """Split on line boundaries into pieces of about chunk_tokens tokens"""
+    limit = chunk_tokens * 4
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in text.splitlines():
+        line = line[:limit]
+        if size + len(line) + 1 > limit and current:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+class ChunkSummaryCache:
+    """LRU of chunk summaries keyed by sha256 of the chunk text"""
+
+    def __init__(self, max_entries: int = CHUNK_SUMMARY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.sha256(text.encode(errors='ignore')).hexdigest()
+
+    def get(self, text: str) -> Optional[str]:
+        key = self.digest(text)
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return summary
+
+    def put(self, text: str, summary: str):
+        key = self.digest(text)
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def summarize_compacted(text: str, summarize: Callable[[str], str],
+                        cache: Optional[ChunkSummaryCache] = None,
+                        budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Compact text, then summarize it in one call if it fits the token budget.
+    Otherwise map-reduce: summarize each chunk (concurrently, cached by
+    content hash) and summarize the joined chunk summaries.
+    summarize(text) does one model call and may raise; errors propagate.
+    """
+    compacted = compact_output(text)
+    if estimate_tokens(compacted) <= budget:
+        return summarize(compacted)
+
+    chunks = split_chunks(compacted)
+    if len(chunks) > SUMMARY_MAX_CHUNKS:
+        # Findings cluster at the start (banners/targets) and end (results), keep both
+        head = SUMMARY_MAX_CHUNKS // 2
+        tail = SUMMARY_MAX_CHUNKS - head
+        chunks = chunks[:head] + chunks[-tail:]
+
+    def map_chunk(chunk: str) -> str:
+        summary = cache.get(chunk) if cache else None
+        if summary is None:
+            summary = summarize(chunk)
+            if cache:
+                cache.put(chunk, summary)
+        return summary
+
+    summaries = list(_map_pool.map(map_chunk, chunks))
+    partials = [f"Part {i + 1}:\n{summary}" for i, summary in enumerate(summaries)]
+    return summarize("Combine these partial summaries of one command's output:\n\n" + "\n\n".join(partials))
+
+
+class RollingSummary:
+    """
+    Summarizes output while it is still arriving. Complete lines are compacted
+    as they come in; every ROLLING_SUMMARY_WINDOW_TOKENS of them are summarized
+    in the background. Past SUMMARY_MAX_CHUNKS window summaries, the oldest
+    ones are folded into one. finish() only has to merge the window summaries
+    with the last, partial window: one small model call.
+    """
+
+    def __init__(self, summarize: Callable[[str], str], window: int = ROLLING_SUMMARY_WINDOW_TOKENS,
+                 max_parts: int = SUMMARY_MAX_CHUNKS):
+        self.summarize = summarize
+        self.window = window
+        self.max_parts = max(2, max_parts)
+        self._partial_line = ""
+        self._lines: List[str] = []
+        self._tokens = 0
+        self._parts: List["Future[str]"] = []
+
+    def feed(self, text: str):
+        text = self._partial_line + text
+        complete, _, self._partial_line = text.rpartition("\n")
+        if len(self._partial_line) > self.window * 4:
+            # Output without newlines still has to move through the windows
+            complete, self._partial_line = text, ""
+        if not complete:
+            return
+        compacted = compact_output(complete)
+        if not compacted:
+            return
+        self._lines.append(compacted)
+        self._tokens += estimate_tokens(compacted)
+        if self._tokens >= self.window:
+            self._submit("\n".join(self._lines))
+            self._lines, self._tokens = [], 0
+
+    def _submit(self, window: str):
+        self._parts.append(_map_pool.submit(self.summarize, window))
+        if len(self._parts) > self.max_parts and all(f.done() for f in self._parts[:self.max_parts // 2]):
+            # Fold the oldest half into one part so the final merge stays small
+            head = self._parts[:self.max_parts // 2]
+            self._parts[:len(head)] = [_map_pool.submit(self.summarize, self._combine_prompt(head, ""))]
+
+    @staticmethod
+    def _part_text(future: "Future[str]") -> str:
+        try:
+            return future.result()
+        except Exception as e:
+            return f"(this part could not be summarized: {e})"
+
+    def _combine_prompt(self, parts: List["Future[str]"], rest: str) -> str:
+        partials = "\n\n".join(f"Part {i + 1}:\n{self._part_text(f)}" for i, f in enumerate(parts))
+        prompt = "Combine these partial summaries of one command's output, in order:\n\n" + partials
+        if rest:
+            prompt += "\n\nFinal part of the output (not yet summarized):\n" + rest
+        return prompt
+
+    def running(self) -> Optional[str]:
+        """Window summaries finished so far, in order, or None if there are none yet"""
+        done = []
+        for future in self._parts:
+            if not future.done():
+                break
+            done.append(self._part_text(future))
+        return "\n".join(done) if done else None
+
+    def finish(self) -> str:
+        """Final summary; raises what summarize() raises"""
+        rest = compact_output("\n".join(self._lines + [self._partial_line]))
+        if not self._parts:
+            # Short output: nothing was summarized yet, one call over all of it
+            return self.summarize(rest)
+        return self.summarize(self._combine_prompt(self._parts, rest))
+
+    def cancel(self):
+        for future in self._parts:
+            future.cancel()
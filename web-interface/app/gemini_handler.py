@@ -1,73 +1,109 @@
-import google.generativeai as genai
+import google.ai.generativelanguage as glm
 import requests
 from typing import List, Dict, Optional
 import time
+from threading import Lock
+
+from key_health import KeyHealthCache, WORKING
+from key_scheduler import KeyCallError, KeyScheduler, estimate_tokens
+from translation_cache import TranslationCache
+from intent_rules import IntentMatcher
+from summaries import render_summary
+from compaction import ChunkSummaryCache, summarize_compacted
+from tool_catalog import ToolCatalog
+
+MODEL_NAME = 'models/gemini-pro'
 
 class GeminiHandler:
-    def __init__(self):
+    def __init__(self, scheduler: Optional[KeyScheduler] = None,
+                 translations: Optional[TranslationCache] = None,
+                 intents: Optional[IntentMatcher] = None,
+                 tools: Optional[ToolCatalog] = None):
         self.api_keys: List[str] = []
         self.key_status: Dict[str, bool] = {}
-        self.current_key_index = 0
+        # Pass the gateway's scheduler to share rate limits and circuit state with it
+        self.scheduler = scheduler or KeyScheduler()
+        self.translations = translations or TranslationCache()
+        self.intents = intents or IntentMatcher()
+        # Tool list for the prompt and allow-list, cached from the CLI server's /tools
+        self.tools = tools or ToolCatalog()
+        self.chunk_summaries = ChunkSummaryCache()
+        self.health = KeyHealthCache(lambda key: (self._validate_key(key), ""))
+        # One client (and gRPC channel) per key, built on first use and reused
+        self._clients: Dict[str, glm.GenerativeServiceClient] = {}
+        self._clients_lock = Lock()
         
     def add_keys(self, keys: List[str]) -> Dict[str, bool]:
-        """Add and validate API keys"""
+        """Add and validate API keys (in parallel, cached per key)"""
         self.api_keys = [key.strip() for key in keys if key.strip()]
-        self.key_status = {}
         
-        # Validate each key
-        for key in self.api_keys:
-            self.key_status[key] = self._validate_key(key)
+        checked = self.health.check_many(self.api_keys)
+        self.key_status = {key: status == WORKING for key, (status, _) in checked.items()}
+        self.scheduler.set_keys([key for key in self.api_keys if self.key_status.get(key)])
+        with self._clients_lock:
+            for key in set(self._clients) - set(self.api_keys):
+                del self._clients[key]
             
         return self.key_status
     
+    def _client_for(self, api_key: str) -> glm.GenerativeServiceClient:
+        """
+        Cached per-key client; the key travels in its client options, so no
+        process-wide genai.configure() is involved and clients are safe to
+        share across threads
+        """
+        with self._clients_lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                client = self._clients[api_key] = glm.GenerativeServiceClient(
+                    client_options={"api_key": api_key})
+            return client
+    
+    def _complete(self, api_key: str, prompt: str) -> str:
+        """One generateContent call with the given key; returns the first candidate's text"""
+        response = self._client_for(api_key).generate_content(request=glm.GenerateContentRequest(
+            model=MODEL_NAME, contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])]))
+        return "".join(part.text for part in response.candidates[0].content.parts)
+    
     def _validate_key(self, api_key: str) -> bool:
         """Test if an API key is valid"""
         try:
             print(f"Validating key: {api_key[:8]}...")
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-pro')
-            
             # Simple test prompt
-            response = model.generate_content("Hello")
-            result = response.text is not None
+            result = self._complete(api_key, "Hello") is not None
             print(f"Key validation result: {result}")
             return result
         except Exception as e:
             print(f"Key validation failed for {api_key[:8]}...: {e}")
             return False
     
-    def _get_working_key(self) -> Optional[str]:
-        """Get the next working API key"""
-        attempts = 0
-        while attempts < len(self.api_keys):
-            key = self.api_keys[self.current_key_index]
-            if self.key_status.get(key, False):
-                return key
-            
-            # Try next key
-            self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-            attempts += 1
-            
-        return None
+    def _generate(self, prompt: str) -> str:
+        """Run one prompt through the scheduler (bounded retries across keys)"""
+        def call(key: str) -> str:
+            try:
+                return self._complete(key, prompt).strip()
+            except Exception as e:
+                # google.api_core errors carry the HTTP status in .code (429, 403, ...)
+                status = getattr(e, 'code', None)
+                raise KeyCallError(str(e), status if isinstance(status, int) else None)
+        return self.scheduler.call(call, est_tokens=estimate_tokens(prompt))
     
     def convert_task_to_command(self, task: str) -> str:
         """Convert natural language task to CLI command"""
-        working_key = self._get_working_key()
-        if not working_key:
-            raise Exception("No working API keys available")
+        # Local rules first: common tasks never reach the model
+        matched = self.intents.match(task)
+        if matched is not None:
+            return self._ensure_allowed(matched[0])
         
-        try:
-            genai.configure(api_key=working_key)
-            model = genai.GenerativeModel('gemini-pro')
-            
-            prompt = f"""
+        cached = self.translations.get(task)
+        if cached is not None:
+            return self._ensure_allowed(cached)
+        
+        prompt = f"""
             Convert this task to a CLI command. Return ONLY the command, nothing else.
             
             Available tools in /app/categories:
-            - nmap: Network scanning
-            - sqlmap: SQL injection testing
-            - peframe: PE file analysis
-            - ghidra: Reverse engineering
+{self.tools.prompt_lines(indent="            ")}
             
             Task: {task}
             
@@ -75,50 +111,39 @@ class GeminiHandler:
             - "scan example.com" → "nmap -v example.com"
             - "check for SQL injection on example.com" → "sqlmap -u http://example.com"
             """
-            
-            response = model.generate_content(prompt)
-            command = response.text.strip()
-            
-            # Basic safety check - only allow certain commands
-            allowed_prefixes = ['nmap', 'sqlmap', 'peframe', 'ghidra', 'ls', 'cat', 'head', 'tail']
-            if not any(command.startswith(prefix) for prefix in allowed_prefixes):
-                raise Exception("Command not allowed for security reasons")
-                
-            return command
-            
-        except Exception as e:
-            # Mark current key as failed and retry
-            self.key_status[working_key] = False
-            return self.convert_task_to_command(task)
+        
+        command = self._ensure_allowed(self._generate(prompt))
+        self.translations.put(task, command)
+        return command
+    
+    def _ensure_allowed(self, command: str) -> str:
+        """Basic safety check - only allow certain commands, whichever source produced them"""
+        allowed_prefixes = self.tools.allowed_prefixes()
+        if not any(command.startswith(prefix) for prefix in allowed_prefixes):
+            raise Exception("Command not allowed for security reasons")
+        return command
     
-    def summarize_output(self, output: str, original_task: str) -> str:
-        """Summarize CLI output using Gemini"""
-        working_key = self._get_working_key()
-        if not working_key:
-            raise Exception("No working API keys available")
+    def summarize_output(self, output: str, original_task: str, parsed: Optional[Dict] = None) -> str:
+        """Summarize CLI output; rendered locally when the CLI server parsed it, else via Gemini"""
+        local = render_summary(parsed)
+        if local is not None:
+            return local
         
-        try:
-            genai.configure(api_key=working_key)
-            model = genai.GenerativeModel('gemini-pro')
-            
+        def summarize(text: str) -> str:
             prompt = f"""
             Summarize this CLI output in a clear, concise way. Focus on important findings and actionable information.
             
             Original task: {original_task}
             CLI Output:
-            {output}
+            {text}
             
             Provide a structured summary with key findings, open ports, vulnerabilities, or other important information.
             """
-            
-            response = model.generate_content(prompt)
-            return response.text.strip()
-            
-        except Exception as e:
-            # Mark current key as failed and retry
-            self.key_status[working_key] = False
-            return self.summarize_output(output, original_task)
+            return self._generate(prompt)
+        
+        # Compacted first; map-reduced in cached chunks if still over the token budget
+        return summarize_compacted(output, summarize, self.chunk_summaries)
     
     def get_key_status(self) -> Dict[str, bool]:
-        """Get current status of all keys"""
-        return self.key_status.copy() 
\ No newline at end of file
+        """Get current status of all keys (False while a key's circuit is open)"""
+        return {key: ok and self.scheduler.available(key) for key, ok in self.key_status.items()} 
\ No newline at end of file
@@ -0,0 +1,111 @@
+# web-interface/app/intent_rules.py
+"""Local task -> command rules tried before asking the model."""
+import glob
+import json
+import os
+import re
+import shlex
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+# Rules live next to the tools: categories/<category>/<tool>/intents.json
+DEFAULT_CATEGORIES_PATH = '/app/categories'
+CATEGORIES_PATH = os.environ.get('CATEGORIES_PATH') or (
+    DEFAULT_CATEGORIES_PATH if os.path.isdir(DEFAULT_CATEGORIES_PATH)
+    else os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'categories')
+)
+
+# A bare name (no "/") only counts as a path with one of these extensions, so
+# hostnames ("example.com") and IP addresses never read as files
+FILE_EXTENSIONS = "|".join([
+    "txt", "log", "out", "csv", "tsv", "json", "xml", "html?", "ya?ml", "conf", "cfg", "ini", "md",
+    "py", "sh", "js", "c", "h", "cpp", "java", "lst", "list", "nmap", "gnmap", "pcap", "pdf",
+    "exe", "dll", "sys", "scr", "ocx", "bin", "elf", "so", "o", "apk", "jar", "dex", "zip", "gz", "tar",
+])
+
+# Macros usable inside rule patterns; each expands to a regex for one value.
+# $HOST is a bare host, IP or CIDR range (what nmap takes); $TARGET also allows
+# a :port. Neither accepts a scheme or path, so URLs only match $URL
+MACROS = {
+    '$HOST': r"[\w.-]+(?:/\d{1,3})?|[0-9a-f:]+(?:/\d{1,3})?",
+    '$TARGET': r"[\w.-]+(?::\d+)?(?:/\d{1,3})?|[0-9a-f:]+(?:/\d{1,3})?",
+    '$URL': r"https?://[^\s'\"]+",
+    '$PATH': r"(?:~|\.{1,2})?/[^\s'\"]*|[\w-]+(?:\.[\w-]+)*\.(?:" + FILE_EXTENSIONS + ")",
+    '$PORTS': r"\d+(?:-\d+)?(?:,\d+(?:-\d+)?)*",
+    '$NUM': r"\d{1,6}",
+}
+
+# Shell utilities already on the allow-list; always available, even without a categories tree
+BUILTIN_RULES = [
+    {"pattern": r"(?:list|show) (?:the )?files(?: in (?:the )?current (?:dir|directory))?", "command": "ls -la"},
+    {"pattern": r"(?:list|show) (?:the )?(?:files|contents) (?:in|of) (?P<path>$PATH)", "command": "ls -la {path}"},
+    {"pattern": r"ls (?P<path>$PATH)", "command": "ls -la {path}"},
+    {"pattern": r"(?:show|read|print|display|cat) (?:the )?(?:contents of )?(?:the )?(?:file )?(?P<path>$PATH)", "command": "cat {path}"},
+    {"pattern": r"(?:show )?(?:the )?first (?P<n>$NUM) lines (?:of|in) (?P<path>$PATH)", "command": "head -n {n} {path}"},
+    {"pattern": r"(?:show )?(?:the )?last (?P<n>$NUM) lines (?:of|in) (?P<path>$PATH)", "command": "tail -n {n} {path}"},
+    {"pattern": r"head (?P<path>$PATH)", "command": "head {path}"},
+    {"pattern": r"tail (?P<path>$PATH)", "command": "tail {path}"},
+]
+
+
+class IntentRule:
+    def __init__(self, pattern: str, command: str, tool: str = "", source: str = "builtin"):
+        for macro, regex in MACROS.items():
+            pattern = pattern.replace(macro, regex)
+        # Whole-task match, ignoring case and a trailing "please"/punctuation
+        self.regex = re.compile(rf"^(?:please )?(?:{pattern})(?: please)?[.!?]*$", re.IGNORECASE)
+        self.command = command
+        self.tool = tool
+        self.source = source
+
+    def match(self, task: str) -> Optional[str]:
+        m = self.regex.match(task)
+        if m is None:
+            return None
+        # Every captured value is shell-quoted (no-op for plain hosts/paths)
+        values = {k: shlex.quote(v) for k, v in m.groupdict().items() if v is not None}
+        return self.command.format(**values)
+
+
+class IntentMatcher:
+    """Ordered rule list; the first rule whose pattern matches the whole task wins"""
+
+    def __init__(self, categories_path: str = CATEGORIES_PATH):
+        self.categories_path = categories_path
+        self._rules: List[IntentRule] = []
+        self._lock = Lock()
+        self.errors: List[str] = []
+        self.reload()
+
+    def reload(self):
+        """(Re)load built-ins plus every categories/*/*/intents.json"""
+        rules = [IntentRule(r["pattern"], r["command"], r["command"].split()[0]) for r in BUILTIN_RULES]
+        errors = []
+        for path in sorted(glob.glob(os.path.join(self.categories_path, '*', '*', 'intents.json'))):
+            tool = os.path.basename(os.path.dirname(path))
+            try:
+                with open(path) as f:
+                    spec = json.load(f)
+                for r in spec.get("intents", []):
+                    rules.append(IntentRule(r["pattern"], r["command"], spec.get("tool", tool), path))
+            except (OSError, ValueError, KeyError, re.error) as e:
+                errors.append(f"{path}: {e}")
+        with self._lock:
+            self._rules = rules
+            self.errors = errors
+
+    def match(self, task: str) -> Optional[Tuple[str, str]]:
+        """Return (command, tool) for the first matching rule, or None"""
+        task = " ".join(task.split())
+        with self._lock:
+            rules = self._rules
+        for rule in rules:
+            command = rule.match(task)
+            if command is not None:
+                return command, rule.tool
+        return None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            tools = sorted({r.tool for r in self._rules})
+            return {"rules": len(self._rules), "tools": tools, "errors": list(self.errors)}
@@ -0,0 +1,90 @@
+# web-interface/app/key_health.py
+"""Parallel API key validation with a per-key, TTL-based health cache."""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+KEY_HEALTH_TTL = float(os.environ.get('KEY_HEALTH_TTL', '300'))
+KEY_VALIDATION_DEADLINE = float(os.environ.get('KEY_VALIDATION_DEADLINE', '8'))
+KEY_VALIDATION_WORKERS = int(os.environ.get('KEY_VALIDATION_WORKERS', '8'))
+
+# Status values reported per key
+WORKING = "working"
+INVALID = "invalid"
+PENDING = "pending"
+
+# probe(key) -> (ok, info)
+Probe = Callable[[str], Tuple[bool, str]]
+
+
+class KeyHealthCache:
+    """Caches probe results per key and runs probes concurrently"""
+
+    def __init__(self, probe: Probe, ttl: float = KEY_HEALTH_TTL,
+                 max_workers: int = KEY_VALIDATION_WORKERS):
+        self.probe = probe
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="key-probe")
+        self._results: Dict[str, Tuple[bool, str, float]] = {}
+        self._inflight = {}
+        self._lock = Lock()
+
+    def _run_probe(self, key: str):
+        try:
+            ok, info = self.probe(key)
+        except Exception as e:
+            ok, info = False, str(e)
+        with self._lock:
+            self._results[key] = (ok, info, time.monotonic())
+            self._inflight.pop(key, None)
+        return ok, info
+
+    def _schedule(self, key: str):
+        # One in-flight probe per key; concurrent callers share the future (caller holds the lock)
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._pool.submit(self._run_probe, key)
+            self._inflight[key] = future
+        return future
+
+    def cached(self, key: str) -> Optional[Tuple[bool, str]]:
+        with self._lock:
+            entry = self._results.get(key)
+        return (entry[0], entry[1]) if entry else None
+
+    def check_many(self, keys: Iterable[str],
+                   deadline: float = KEY_VALIDATION_DEADLINE) -> Dict[str, Tuple[str, str]]:
+        """
+        Return {key: (status, info)} for every key within `deadline` seconds.
+        Fresh cache entries are returned as-is; stale ones are returned as-is and
+        re-probed in the background; unknown keys are probed in parallel. Keys
+        whose probe misses the deadline are reported PENDING and their result
+        lands in the cache when the probe finishes.
+        """
+        now = time.monotonic()
+        results: Dict[str, Tuple[str, str]] = {}
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                if key in results or key in waiting:
+                    continue
+                entry = self._results.get(key)
+                if entry is not None:
+                    ok, info, checked_at = entry
+                    results[key] = (WORKING if ok else INVALID, info)
+                    if now - checked_at > self.ttl:
+                        self._schedule(key)
+                else:
+                    waiting[key] = self._schedule(key)
+
+        if waiting:
+            wait(list(waiting.values()), timeout=deadline)
+        for key, future in waiting.items():
+            if future.done():
+                ok, info = future.result()
+                results[key] = (WORKING if ok else INVALID, info)
+            else:
+                results[key] = (PENDING, f"validation still running after {deadline:g}s")
+        return results
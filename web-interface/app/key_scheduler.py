@@ -0,0 +1,304 @@
+# web-interface/app/key_scheduler.py
+"""Rate-limit-aware API key scheduling shared by the gateway and GeminiHandler."""
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from threading import Condition
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from metrics import REGISTRY
+
+# Per-key quotas (requests per minute / estimated tokens per minute)
+KEY_RPM = float(os.environ.get('KEY_RPM', '60'))
+KEY_TPM = float(os.environ.get('KEY_TPM', '120000'))
+# Circuit breaker tuning
+KEY_FAILURE_THRESHOLD = int(os.environ.get('KEY_FAILURE_THRESHOLD', '3'))
+KEY_OPEN_SECONDS = float(os.environ.get('KEY_OPEN_SECONDS', '30'))
+KEY_MAX_OPEN_SECONDS = float(os.environ.get('KEY_MAX_OPEN_SECONDS', '600'))
+KEY_AUTH_OPEN_SECONDS = float(os.environ.get('KEY_AUTH_OPEN_SECONDS', '3600'))
+# Retry policy for scheduler.call()
+KEY_MAX_ATTEMPTS = int(os.environ.get('KEY_MAX_ATTEMPTS', '3'))
+KEY_RETRY_BASE_DELAY = float(os.environ.get('KEY_RETRY_BASE_DELAY', '0.25'))
+KEY_RETRY_MAX_DELAY = float(os.environ.get('KEY_RETRY_MAX_DELAY', '4'))
+KEY_ACQUIRE_TIMEOUT = float(os.environ.get('KEY_ACQUIRE_TIMEOUT', '5'))
+# How often a waiter re-checks a half-open key whose probe is still running
+KEY_PROBE_POLL_SECONDS = float(os.environ.get('KEY_PROBE_POLL_SECONDS', '1'))
+
+# Circuit states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+T = TypeVar('T')
+
+MODEL_SECONDS = REGISTRY.histogram('gateway_model_seconds', 'Model call latency per key and outcome',
+                                   ('key', 'outcome'))
+KEY_WAIT_SECONDS = REGISTRY.histogram('gateway_key_wait_seconds', 'Time spent waiting for a usable key')
+
+
+def key_label(key: str) -> str:
+    """Abbreviated key for status output and metric labels"""
+    return key[:8] + "..."
+
+
+class KeyCallError(Exception):
+    """A model call failed; status is the upstream HTTP status (None for network errors)"""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class NoKeyAvailable(Exception):
+    """No key could be acquired; retry_after is a hint in seconds"""
+
+    def __init__(self, retry_after: Optional[float] = None):
+        super().__init__("no working API key available")
+        self.retry_after = retry_after
+
+
+def is_key_failure(status: Optional[int]) -> bool:
+    """
+    True if a failed call says something about the key rather than the request:
+    throttling, auth errors, server errors and transport errors (status None).
+    Other statuses (e.g. a 400 for a bad prompt) leave the key's circuit alone.
+    """
+    return status is None or status in (401, 403, 429) or status >= 500
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) used for TPM accounting"""
+    return len(text) // 4 + 1
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Classic token bucket; capacity is one minute's worth of quota"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class KeyState:
+    def __init__(self, key: str):
+        self.key = key
+        self.requests = TokenBucket(KEY_RPM)
+        self.tokens = TokenBucket(KEY_TPM)
+        self.state = CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self.open_seconds = KEY_OPEN_SECONDS
+        self.probe_inflight = False
+        self.last_throttled = 0.0
+        self.last_used = 0.0
+        self.last_error = ""
+
+    def to_dict(self, now: float) -> Dict:
+        return {
+            "key": key_label(self.key),
+            "state": self.state,
+            "failures": self.failures,
+            "retry_in": round(max(0.0, self.open_until - now), 1) if self.state == OPEN else 0,
+            "last_error": self.last_error,
+        }
+
+
+class KeyScheduler:
+    """
+    Hands out keys so load spreads across them:
+      - each key has request and token buckets (KEY_RPM / KEY_TPM)
+      - among keys with capacity, the least recently throttled one wins
+      - failures open a per-key circuit; after the cool-down one half-open
+        probe is allowed through and success closes the circuit again
+      - Retry-After from a 429 sets the cool-down directly
+    """
+
+    def __init__(self, keys: Optional[List[str]] = None):
+        self._cond = Condition()
+        self._keys: Dict[str, KeyState] = {}
+        if keys:
+            self.set_keys(keys)
+
+    def set_keys(self, keys: List[str]):
+        """Replace the key set, keeping state for keys that stay"""
+        with self._cond:
+            self._keys = {k: self._keys.get(k) or KeyState(k) for k in keys}
+            self._cond.notify_all()
+
+    def keys(self) -> List[str]:
+        with self._cond:
+            return list(self._keys)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._keys)
+
+    def _pick(self, est_tokens: float, now: float):
+        # Returns (KeyState or None, seconds until something may free up); caller holds the lock
+        best = None
+        soonest = None
+        for ks in self._keys.values():
+            if ks.state == OPEN:
+                if now < ks.open_until:
+                    soonest = min(soonest or float('inf'), ks.open_until - now)
+                    continue
+                ks.state = HALF_OPEN
+            if ks.state == HALF_OPEN and ks.probe_inflight:
+                # The probe's outcome wakes waiters; poll too in case it never reports
+                soonest = min(soonest or float('inf'), KEY_PROBE_POLL_SECONDS)
+                continue
+            wait_s = max(ks.requests.wait_time(1, now), ks.tokens.wait_time(est_tokens, now))
+            if wait_s > 0:
+                soonest = min(soonest or float('inf'), wait_s)
+                continue
+            if best is None or (ks.last_throttled, ks.last_used) < (best.last_throttled, best.last_used):
+                best = ks
+        return best, soonest
+
+    def acquire(self, est_tokens: float = 0, timeout: float = KEY_ACQUIRE_TIMEOUT) -> str:
+        """Block up to `timeout` seconds for a usable key; raises NoKeyAvailable"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                ks, soonest = self._pick(est_tokens, now)
+                if ks is not None:
+                    ks.requests.take(1, now)
+                    ks.tokens.take(est_tokens, now)
+                    ks.last_used = now
+                    if ks.state == HALF_OPEN:
+                        ks.probe_inflight = True
+                    return ks.key
+                remaining = deadline - now
+                if not self._keys or soonest is None or soonest > remaining:
+                    raise NoKeyAvailable(soonest)
+                self._cond.wait(soonest)
+
+    def report_success(self, key: str):
+        with self._cond:
+            ks = self._keys.get(key)
+            if ks is None:
+                return
+            ks.state = CLOSED
+            ks.failures = 0
+            ks.probe_inflight = False
+            ks.open_seconds = KEY_OPEN_SECONDS
+            ks.last_error = ""
+            self._cond.notify_all()
+
+    def report_failure(self, key: str, status: Optional[int] = None,
+                       retry_after: Optional[float] = None, message: str = ""):
+        with self._cond:
+            ks = self._keys.get(key)
+            if ks is None:
+                return
+            now = time.monotonic()
+            ks.failures += 1
+            ks.last_error = message[:200]
+            if status == 429:
+                ks.last_throttled = now
+                cool_down = retry_after if retry_after is not None else ks.open_seconds
+            elif status in (401, 403):
+                cool_down = KEY_AUTH_OPEN_SECONDS
+            elif ks.state == HALF_OPEN or ks.failures >= KEY_FAILURE_THRESHOLD:
+                cool_down = ks.open_seconds
+            else:
+                cool_down = None
+            ks.probe_inflight = False
+            if cool_down is not None:
+                # Back off harder each time the circuit re-opens without a success in between
+                if ks.state == HALF_OPEN and retry_after is None:
+                    ks.open_seconds = min(ks.open_seconds * 2, KEY_MAX_OPEN_SECONDS)
+                    cool_down = max(cool_down, ks.open_seconds)
+                ks.state = OPEN
+                ks.open_until = now + cool_down
+            self._cond.notify_all()
+
+    def call(self, fn: Callable[[str], T], est_tokens: float = 0,
+             max_attempts: int = KEY_MAX_ATTEMPTS) -> T:
+        """
+        Run fn(key) with bounded, jittered retries. fn raises KeyCallError on
+        failure; key failures (see is_key_failure) are reported against the key
+        and the next attempt picks a (possibly different) key after a
+        full-jitter backoff. Other failures are raised straight away.
+        """
+        last_error: Optional[Exception] = None
+        for attempt in range(max_attempts):
+            if attempt:
+                delay = min(KEY_RETRY_MAX_DELAY, KEY_RETRY_BASE_DELAY * (2 ** attempt))
+                time.sleep(random.uniform(0, delay))
+            start = time.perf_counter()
+            try:
+                key = self.acquire(est_tokens)
+            except NoKeyAvailable:
+                if last_error is not None:
+                    raise last_error
+                raise
+            finally:
+                KEY_WAIT_SECONDS.observe(time.perf_counter() - start)
+            start = time.perf_counter()
+            try:
+                result = fn(key)
+            except KeyCallError as e:
+                MODEL_SECONDS.observe(time.perf_counter() - start, key=key_label(key),
+                                      outcome="throttled" if e.status == 429 else "error")
+                if not is_key_failure(e.status):
+                    # The key answered; the request itself was rejected, so another key would not help
+                    self.report_success(key)
+                    raise
+                self.report_failure(key, e.status, e.retry_after, str(e))
+                last_error = e
+                continue
+            except Exception as e:
+                MODEL_SECONDS.observe(time.perf_counter() - start, key=key_label(key), outcome="error")
+                self.report_failure(key, None, None, str(e))
+                raise
+            MODEL_SECONDS.observe(time.perf_counter() - start, key=key_label(key), outcome="ok")
+            self.report_success(key)
+            return result
+        raise last_error
+
+    def status(self) -> List[Dict]:
+        now = time.monotonic()
+        with self._cond:
+            return [ks.to_dict(now) for ks in self._keys.values()]
+
+    def available(self, key: str) -> bool:
+        """True unless the key's circuit is open and still cooling down"""
+        with self._cond:
+            ks = self._keys.get(key)
+            return ks is not None and not (ks.state == OPEN and time.monotonic() < ks.open_until)
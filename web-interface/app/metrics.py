@@ -0,0 +1,246 @@
+# web-interface/app/metrics.py
+"""Counters, latency histograms and Server-Timing for the gateway, in Prometheus text format."""
+import collections
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# GET /debug/profile is only served with WEB_PROFILER=1; it shows code paths and blocks a thread
+PROFILER_ENABLED = os.environ.get('WEB_PROFILER', '0') == '1'
+PROFILE_INTERVAL = float(os.environ.get('WEB_PROFILE_INTERVAL_MS', '10')) / 1000
+PROFILE_MAX_SECONDS = float(os.environ.get('WEB_PROFILE_MAX_SECONDS', '60'))
+
+Sample = Tuple[str, List[Tuple[str, str]], float]
+# (name, kind, help, [(labels, value), ...]) as returned by collectors
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    """Monotonic total per label set"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, list(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    """Observation counts per bucket, plus their sum and count, per label set"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+            counts[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = sorted((key, ([*counts[0]], counts[1], counts[2])) for key, counts in self._values.items())
+        for key, (buckets, total, count) in items:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets, buckets):
+                cumulative += n
+                yield self.name + "_bucket", pairs + [("le", _number(bound))], cumulative
+            yield self.name + "_sum", pairs, round(total, 6)
+            yield self.name + "_count", pairs, count
+
+
+class MetricsRegistry:
+    """
+    Metrics created here are rendered by render(). Collectors are callables
+    returning Family tuples, for values read at scrape time (cache counters,
+    circuit states kept by other components).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def register(self, collector: Callable[[], Iterable[Family]]):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{_labels(pairs)} {_number(value)}" for name, pairs, value in metric.samples())
+        for collector in collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_labels(sorted(labels.items()))} {_number(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram('gateway_stage_seconds', 'Time spent per request stage', ('stage',))
+
+
+class ServerTiming:
+    """
+    Durations of the stages of one request, rendered as a Server-Timing
+    header. Stages timed with stage() also go to gateway_stage_seconds.
+    """
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+
+    def add(self, name: str, seconds: Optional[float]):
+        if seconds is not None:
+            self.stages.append((name, seconds))
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add(name, elapsed)
+            STAGE_SECONDS.observe(elapsed, stage=name)
+
+    def merge(self, header: Optional[str], prefix: str):
+        """Add the stages of an upstream Server-Timing header, names prefixed"""
+        for entry in (header or "").split(","):
+            name, _, params = entry.strip().partition(";")
+            for param in params.split(";"):
+                key, _, value = param.strip().partition("=")
+                if name and key == "dur":
+                    try:
+                        self.add(prefix + name, float(value) / 1000)
+                    except ValueError:
+                        pass
+
+    def header(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages)
+
+
+class ProfilerBusy(Exception):
+    """Another profile is being taken"""
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread each `interval` seconds while a
+    profile is taken. The result is in collapsed-stack format ("thread;file:func;... N"),
+    which flamegraph.pl and speedscope read. Costs nothing when not profiling.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("a profile is already running")
+        try:
+            me = threading.get_ident()
+            stacks: "collections.Counter[str]" = collections.Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    stacks[";".join(reversed(stack))] += 1
+                time.sleep(self.interval)
+            return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        finally:
+            self._lock.release()
+
+
+profiler = SamplingProfiler()
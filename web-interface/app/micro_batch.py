@@ -0,0 +1,148 @@
+# web-interface/app/micro_batch.py
+"""Coalesce model calls that arrive close together into one multi-item request."""
+import json
+import os
+import re
+import time
+from concurrent.futures import Future
+from threading import Condition
+from typing import Callable, Generic, List, Optional, TypeVar
+
+# How long the first caller of a batch waits for others to join (0 disables batching)
+LLM_BATCH_WINDOW_MS = float(os.environ.get('LLM_BATCH_WINDOW_MS', '25'))
+LLM_BATCH_MAX_ITEMS = int(os.environ.get('LLM_BATCH_MAX_ITEMS', '8'))
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def numbered_items(items: List[str], label: str) -> str:
+    """Items as "### <label> 1" ... sections for a multi-item prompt"""
+    return "\n\n".join(f"### {label} {i}\n{item}" for i, item in enumerate(items, 1))
+
+
+def parse_numbered(text: str, count: int) -> List[Optional[str]]:
+    """
+    Read a {"1": "...", "2": "..."} answer back into a list of `count` strings.
+    Items the model skipped or mangled come back as None.
+    """
+    answers: List[Optional[str]] = [None] * count
+    match = JSON_OBJECT_RE.search(text or "")
+    if not match:
+        return answers
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return answers
+    if not isinstance(data, dict):
+        return answers
+    for i in range(count):
+        value = data.get(str(i + 1))
+        if isinstance(value, list):
+            value = "\n".join(str(v) for v in value)
+        if isinstance(value, str) and value.strip():
+            answers[i] = value.strip()
+    return answers
+
+
+class _Batch(Generic[T, R]):
+    def __init__(self):
+        self.items: List[T] = []
+        self.futures: List["Future[R]"] = []
+        self.weight = 0.0
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    submit(item) blocks until the item's result is ready. The first caller
+    of a batch waits up to `window` seconds (less if the batch fills up) for
+    others, then runs run(items) -> results for everyone in its own thread.
+    A batch holds at most max_items items and max_weight total weight.
+    An exception from run() is raised in every caller of that batch.
+    """
+
+    def __init__(self, run: Callable[[List[T]], List[R]], window: float = LLM_BATCH_WINDOW_MS / 1000,
+                 max_items: int = LLM_BATCH_MAX_ITEMS, max_weight: float = float('inf'),
+                 weight: Callable[[T], float] = lambda item: 1):
+        self.run = run
+        self.window = window
+        self.max_items = max_items
+        self.max_weight = max_weight
+        self.weight = weight
+        self._cond = Condition()
+        self._pending: Optional[_Batch] = None
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+
+    def _full(self, batch: _Batch, weight: float = 0) -> bool:
+        return len(batch.items) >= self.max_items or (batch.items and batch.weight + weight > self.max_weight)
+
+    def submit(self, item: T) -> R:
+        if self.window <= 0 or self.max_items <= 1:
+            return self._execute_one(item)
+        future: "Future[R]" = Future()
+        weight = self.weight(item)
+        with self._cond:
+            batch = self._pending
+            if batch is not None and self._full(batch, weight):
+                # Close the current batch early and start a new one with this item
+                self._pending = None
+                self._cond.notify_all()
+                batch = None
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._pending = batch
+            batch.items.append(item)
+            batch.futures.append(future)
+            batch.weight += weight
+            if self._full(batch):
+                self._pending = None
+                self._cond.notify_all()
+            if leader:
+                deadline = time.monotonic() + self.window
+                while self._pending is batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._pending = None
+                        break
+                    self._cond.wait(remaining)
+        if leader:
+            self._execute(batch)
+        return future.result()
+
+    def _execute_one(self, item: T) -> R:
+        with self._cond:
+            self.batches += 1
+            self.items += 1
+            self.largest = max(self.largest, 1)
+        return self.run([item])[0]
+
+    def _execute(self, batch: _Batch):
+        with self._cond:
+            self.batches += 1
+            self.items += len(batch.items)
+            self.largest = max(self.largest, len(batch.items))
+        try:
+            results = self.run(batch.items)
+            if len(results) != len(batch.items):
+                raise RuntimeError(f"batch returned {len(results)} results for {len(batch.items)} items")
+        except Exception as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch": round(self.items / self.batches, 2) if self.batches else 0,
+                "largest": self.largest,
+                "window_ms": round(self.window * 1000, 1),
+            }
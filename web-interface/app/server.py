@@ -1,30 +1,69 @@
 # web-interface/app/server.py
 import os
+import json
+import time
 import requests
-from flask import Flask, request, jsonify, send_from_directory
-from threading import Lock
+from collections import deque
+from requests.adapters import HTTPAdapter
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context
+
+from key_health import KeyHealthCache, WORKING
+from key_scheduler import KeyCallError, KeyScheduler, NoKeyAvailable, estimate_tokens, parse_retry_after
+from translation_cache import TranslationCache
+from intent_rules import IntentMatcher
+from summaries import render_summary, renders_command
+from compaction import SUMMARY_TOKEN_BUDGET, ChunkSummaryCache, RollingSummary, summarize_compacted
+from tool_catalog import ToolCatalog
+from micro_batch import MicroBatcher, numbered_items, parse_numbered
+from metrics import PROFILE_MAX_SECONDS, PROFILER_ENABLED, REGISTRY, ProfilerBusy, ServerTiming, profiler
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
 # Read CLI server host from env (use service name when using docker-compose)
 CLI_SERVER_HOST = os.environ.get('CLI_SERVER_HOST', 'cli-server:5000')
 CLI_RUN_URL = f'http://{CLI_SERVER_HOST}/run'
+CLI_TOOLS_URL = f'http://{CLI_SERVER_HOST}/tools'
+CLI_BATCH_URL = f'http://{CLI_SERVER_HOST}/batch'
+CLI_RESULTS_URL = f'http://{CLI_SERVER_HOST}/results'
+CLI_ARTIFACTS_URL = f'http://{CLI_SERVER_HOST}/artifacts'
+
+# Overridable so benchmarks can point the gateway at a local stand-in (see benchmark.py)
+MODEL_URL = os.environ.get('MODEL_URL', "https://generativelanguage.googleapis.com/v1/models/gemini-pro:generateContent")
+
+# Max keep-alive connections kept open per upstream
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '32'))
+
+# Helper: a Session with its own keep-alive pool, so TCP/TLS setup happens once per
+# connection instead of once per request
+def make_session(pool_size=HTTP_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# One pooled session per upstream
+MODEL_SESSION = make_session()
+CLI_SESSION = make_session()
 
-# In-memory keys store (simple)
-key_lock = Lock()
-KEYS = []  # list of dicts: { "key": "...", "status": "working"|"invalid" }
+# Tools the CLI server has, refreshed from its /tools registry in the background
+tool_catalog = ToolCatalog(CLI_TOOLS_URL, CLI_SESSION)
+
+# In-memory keys store: working keys with per-key rate limits and circuit breakers.
+# GEMINI_API_KEYS (comma-separated) preloads it, e.g. for every ASGI worker process
+scheduler = KeyScheduler([k.strip() for k in os.environ.get('GEMINI_API_KEYS', '').split(',') if k.strip()])
 
 # Helper: test a single Gemini-like key with a minimal "health check" request
 # NOTE: adapt the URL/payload to your actual Gemini endpoint if different.
 def test_key_health(key):
-    url = "https://generativelanguage.googleapis.com/v1/models/gemini-pro:generateContent"
+    url = MODEL_URL
     headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
     payload = {
         "prompt": {"messages":[{"role":"user", "content":"Say ok"}]},
         "temperature": 0
     }
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=6)
+        r = MODEL_SESSION.post(url, headers=headers, json=payload, timeout=6)
         # treat 200 as ok, 401/403 as invalid
         if r.status_code == 200:
             return True, r.text
@@ -33,6 +72,31 @@ def test_key_health(key):
     except Exception as e:
         return False, str(e)
 
+# Probes run in parallel under one deadline; results are cached per key (KEY_HEALTH_TTL)
+key_health = KeyHealthCache(test_key_health)
+
+HTTP_SECONDS = REGISTRY.histogram('gateway_http_request_seconds', 'Time to response headers per endpoint',
+                                  ('endpoint', 'method', 'status'))
+TRANSLATIONS = REGISTRY.counter('gateway_translations_total', 'Tasks translated, by source', ('source',))
+
+# Every response carries Server-Timing: the stages a handler recorded in g.timing, plus total
+@app.before_request
+def start_timing():
+    g.timing = ServerTiming()
+    g.started = time.perf_counter()
+
+@app.after_request
+def finish_timing(response):
+    timing = g.get('timing')
+    if timing is None:
+        return response
+    elapsed = time.perf_counter() - g.started
+    timing.add("total", elapsed)
+    response.headers["Server-Timing"] = timing.header()
+    HTTP_SECONDS.observe(elapsed, endpoint=request.endpoint or "unmatched", method=request.method,
+                         status=response.status_code)
+    return response
+
 @app.route('/')
 def index():
     return send_from_directory('templates', 'index.html')
@@ -46,172 +110,673 @@ def init_keys():
 
     results = []
     new_working = []
-    # Test each key (quick)
+    # Test all keys concurrently; cached keys answer immediately
+    checked = key_health.check_many(keys)
     for k in keys:
-        ok, info = test_key_health(k)
-        status = "working" if ok else "invalid"
+        status, info = checked[k]
+        ok = status == WORKING
         results.append({"key": k, "status": status, "info": info if not ok else ""})
-        if ok:
+        if ok and k not in new_working:
             new_working.append(k)
 
-    # Save working keys in-memory, order preserved (first = preferred)
-    with key_lock:
-        KEYS.clear()
-        for wk in new_working:
-            KEYS.append({"key": wk, "status": "working"})
+    # Hand working keys to the scheduler; state is kept for keys that were already known
+    scheduler.set_keys(new_working)
 
     return jsonify({"keys": results, "working_count": len(new_working)})
 
-# Internal: pick a working key (rotate if needed)
-def pick_working_key():
-    with key_lock:
-        if not KEYS:
-            return None
-        # simple rotation: pop first and append it back
-        k = KEYS.pop(0)
-        KEYS.append(k)
-        return k["key"]
+@app.route('/api/keyStatus', methods=['GET'])
+def key_status():
+    """Circuit state and failure counts per scheduled key (keys are abbreviated)"""
+    return jsonify({"keys": scheduler.status()})
+
+# Helper: JSON error for when no key can be scheduled, with a Retry-After hint
+def no_key_response(e):
+    resp = jsonify({"error": "no working API key available"})
+    if e.retry_after:
+        resp.headers["Retry-After"] = str(int(e.retry_after + 0.999))
+    return resp, 503
+
+# Keep at most this much of a streamed output around for the summary step
+STREAM_SUMMARY_TAIL = int(os.environ.get('STREAM_SUMMARY_TAIL', str(64 * 1024)))
+# Max silence between output chunks before we give up on a streamed command
+STREAM_IDLE_TIMEOUT = int(os.environ.get('STREAM_IDLE_TIMEOUT', '300'))
+# Read timeout for a synchronous /run: the CLI server's 30 s limit plus time spent in its run queue
+CLI_RUN_TIMEOUT = int(os.environ.get('CLI_RUN_TIMEOUT', '60'))
+
+class ModelError(KeyCallError):
+    """Model request failed; carries the JSON body to return (as a 502)"""
+    def __init__(self, body, status=None, retry_after=None):
+        super().__init__(body.get("error"), status, retry_after)
+        self.body = body
+
+# Helper: search for first string in nested structure
+def find_first_string(o):
+    if isinstance(o, str):
+        return o
+    if isinstance(o, dict):
+        for v in o.values():
+            s = find_first_string(v)
+            if s:
+                return s
+    if isinstance(o, list):
+        for v in o:
+            s = find_first_string(v)
+            if s:
+                return s
+    return None
+
+def model_headers(key):
+    return {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
+
+# Helper: POST to the model with one key; raises ModelError so the scheduler can react
+def model_request(key, payload, timeout=12):
+    try:
+        r = MODEL_SESSION.post(MODEL_URL, headers=model_headers(key), json=payload, timeout=timeout)
+    except Exception as e:
+        raise ModelError({"error": "model request failed", "detail": str(e)})
+    if r.status_code != 200:
+        raise ModelError({"error": "model error", "status": r.status_code, "body": r.text},
+                         r.status_code, parse_retry_after(r.headers.get("Retry-After")))
+    return r
+
+# 1) Convert user task -> CLI command (here we assume the model returns a plain command string)
+# NOTE: Replace URL/payload with your real Gemini conversion flow.
+def request_translation(key, task):
+    prompt_payload = {
+        "prompt": {
+            "messages": [
+                {"role":"system", "content": "You convert user tasks to a single CLI command only.\n"
+                                             "Available tools:\n" + tool_catalog.prompt_lines()},
+                {"role":"user", "content": f"Task: {task}\nRespond with only the command to run (no explanation)."}
+            ]
+        },
+        "temperature": 0
+    }
+    r = model_request(key, prompt_payload)
+    # Extract text - adapt to your model's response structure
+    model_resp_text = r.text
+    # crude attempt: assume the full response body contains the command; you may need to parse JSON
+    # For safety, try to parse JSON and extract likely field(s)
+    try:
+        jr = r.json()
+        # Attempt common paths (update if your Gemini wrapper differs)
+        # Example: jr['candidates'][0]['content'][0]['text'] etc.
+        command = find_first_string(jr) if isinstance(jr, dict) else None
+        if not command:
+            command = model_resp_text.strip()
+    except Exception:
+        command = model_resp_text.strip()
+    return command
+
+# Several tasks in one prompt; the model answers {"1": "<command>", ...}.
+# Returns one command per task, None where the answer could not be read back
+def request_translations(key, tasks):
+    prompt_payload = {
+        "prompt": {
+            "messages": [
+                {"role":"system", "content": "You convert user tasks to a single CLI command each.\n"
+                                             "Available tools:\n" + tool_catalog.prompt_lines()},
+                {"role":"user", "content": numbered_items(tasks, "Task") +
+                    "\n\nRespond with only a JSON object mapping each task number to its command "
+                    "(no explanation), e.g. {\"1\": \"nmap -v example.com\"}."}
+            ]
+        },
+        "temperature": 0
+    }
+    r = model_request(key, prompt_payload)
+    try:
+        text = find_first_string(r.json()) or r.text
+    except Exception:
+        text = r.text
+    return parse_numbered(text, len(tasks))
+
+# Helper: run a batch through one multi-item call; single items, and items the
+# combined answer missed, go through the one-item request
+def call_batched(items, single, multi):
+    if len(items) == 1:
+        return [scheduler.call(lambda key: single(key, items[0]), est_tokens=estimate_tokens(items[0]))]
+    answers = scheduler.call(lambda key: multi(key, items),
+                             est_tokens=sum(estimate_tokens(item) for item in items))
+    return [answer if answer is not None else
+            scheduler.call(lambda key: single(key, item), est_tokens=estimate_tokens(item))
+            for item, answer in zip(items, answers)]
+
+# Translations arriving within LLM_BATCH_WINDOW_MS of each other share one model request
+translation_batcher = MicroBatcher(lambda tasks: call_batched(tasks, request_translation, request_translations))
+
+# Normalized task -> command cache; repeated workflows skip the model entirely
+translations = TranslationCache()
+# Deterministic rules for common tasks (built-ins + categories/*/*/intents.json)
+intents = IntentMatcher()
+
+# Returns (command, source) where source is "rules", "cache" or "model".
+# Raises ModelError / NoKeyAvailable once the scheduler's retries are used up
+def translate_task(task):
+    matched = intents.match(task)
+    if matched is not None:
+        TRANSLATIONS.inc(source="rules")
+        return matched[0], "rules"
+    command = translations.get(task)
+    if command is not None:
+        TRANSLATIONS.inc(source="cache")
+        return command, "cache"
+    command = translation_batcher.submit(task)
+    translations.put(task, command)
+    TRANSLATIONS.inc(source="model")
+    return command, "model"
+
+def request_summary(key, raw_output):
+    summarize_payload = {
+        "prompt": {
+            "messages": [
+                {"role":"system", "content": "You must summarize terminal output in short bullet points."},
+                {"role":"user", "content": f"Summarize the following output:\n\n{raw_output}"}
+            ]
+        },
+        "temperature": 0.2
+    }
+    rsum = model_request(key, summarize_payload)
+    # The prompt is already within the token budget, so the answer is not truncated here
+    try:
+        return find_first_string(rsum.json()) or rsum.text
+    except Exception:
+        return rsum.text
+
+# Several outputs in one prompt; returns one summary per output (None if missing)
+def request_summaries(key, texts):
+    summarize_payload = {
+        "prompt": {
+            "messages": [
+                {"role":"system", "content": "You must summarize terminal output in short bullet points."},
+                {"role":"user", "content": "Summarize each of the following outputs separately:\n\n" +
+                    numbered_items(texts, "Output") +
+                    "\n\nRespond with only a JSON object mapping each output number to its summary."}
+            ]
+        },
+        "temperature": 0.2
+    }
+    rsum = model_request(key, summarize_payload)
+    try:
+        text = find_first_string(rsum.json()) or rsum.text
+    except Exception:
+        text = rsum.text
+    return parse_numbered(text, len(texts))
+
+# Chunk summaries keyed by content hash, reused across map-reduce runs
+chunk_summaries = ChunkSummaryCache()
+
+# Summaries share a request too, as long as the combined prompt fits SUMMARY_TOKEN_BUDGET
+summary_batcher = MicroBatcher(lambda texts: call_batched(texts, request_summary, request_summaries),
+                               max_weight=SUMMARY_TOKEN_BUDGET, weight=estimate_tokens)
+
+def summarize_text(text):
+    return summary_batcher.submit(text)
+
+# Helper: run a model summarization; never raises, failures become the summary text
+def guarded_summary(fn):
+    try:
+        return fn()
+    except ModelError as e:
+        return f"summary_failed status:{e.status}"
+    except NoKeyAvailable as e:
+        return f"summary_failed: {e}"
+    except Exception as e:
+        return f"summary_exception: {e}"
+
+# 3) Ask model to summarize raw_output.
+# Output is compacted first and map-reduced in chunks when it exceeds SUMMARY_TOKEN_BUDGET
+def summarize_output(raw_output):
+    return guarded_summary(lambda: summarize_compacted(raw_output, summarize_text, chunk_summaries))
+
+# Helper: format one Server-Sent Events frame
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(gen):
+    return Response(
+        stream_with_context(gen),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Helper: parse an upstream SSE byte stream into (event, data) pairs
+def iter_sse(resp):
+    event, data = "message", []
+    for line in resp.iter_lines(chunk_size=None, decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+# Helper: forward a CLI server error, keeping its Retry-After (429 when the run queue is full)
+def cli_error_response(r):
+    try:
+        body = r.json()
+    except Exception:
+        body = r.text
+    resp = jsonify({"error": "cli_server_error", "body": body})
+    if r.headers.get("Retry-After"):
+        resp.headers["Retry-After"] = r.headers["Retry-After"]
+    return resp, r.status_code
+
+# Helper: open a streaming /run request; returns (response, error_response)
+def open_cli_stream(cmd, timeout=None, parse=False, task=None):
+    payload = {"command": cmd, "stream": True, "parse": parse}
+    if timeout is not None:
+        payload["timeout"] = timeout
+    if task:
+        payload["task"] = task
+    try:
+        r = CLI_SESSION.post(CLI_RUN_URL, json=payload, stream=True, timeout=(5, STREAM_IDLE_TIMEOUT))
+    except Exception as e:
+        return None, (jsonify({"error": "failed to reach CLI server", "detail": str(e), "cli_url": CLI_RUN_URL}), 502)
+    if r.status_code != 200:
+        return None, cli_error_response(r)
+    return r, None
 
 @app.route('/api/processCommand', methods=['POST'])
 def process_command():
     """
-    Accepts: { "task": "scan example.com" }
+    Accepts: { "task": "scan example.com", "stream": false }
     Flow:
       - Use a working key to send 'task -> cli command' request to Gemini (pseudo)
       - Send generated command to CLI server at CLI_RUN_URL
       - Get raw output, optionally summarize via Gemini
       - Return both raw and summary
+    With "stream": true the response is an SSE stream of
+    command / output / exit / parsed / summary events; only a bounded tail of the
+    output is kept for the summary.
+    Output of nmap, sqlmap and peframe --json is parsed by the CLI server and
+    summarized locally; the model only summarizes tools without a parser.
+    With "cache": true a read-only command may be answered from the CLI
+    server's result cache.
     """
     data = request.json or {}
     task = data.get('task', '').strip()
     if not task:
         return jsonify({"error": "task is required"}), 400
 
-    key = pick_working_key()
-    if not key:
-        return jsonify({"error": "no working API key available"}), 503
-
-    # 1) Convert user task -> CLI command (here we assume the model returns a plain command string)
-    # NOTE: Replace URL/payload with your real Gemini conversion flow.
-    model_url = "https://generativelanguage.googleapis.com/v1/models/gemini-pro:generateContent"
-    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
-    prompt_payload = {
-        "prompt": {
-            "messages": [
-                {"role":"system", "content": "You convert user tasks to a single CLI command only."},
-                {"role":"user", "content": f"Task: {task}\nRespond with only the command to run (no explanation)."}
-            ]
-        },
-        "temperature": 0
-    }
     try:
-        r = requests.post(model_url, headers=headers, json=prompt_payload, timeout=12)
-        if r.status_code != 200:
-            return jsonify({"error": "model error", "status": r.status_code, "body": r.text}), 502
-        # Extract text - adapt to your model's response structure
-        model_resp_text = r.text
-        # crude attempt: assume the full response body contains the command; you may need to parse JSON
-        # For safety, try to parse JSON and extract likely field(s)
-        try:
-            jr = r.json()
-            # Attempt common paths (update if your Gemini wrapper differs)
-            # These are defensive; change to the real field names you receive.
-            # Example: jr['candidates'][0]['content'][0]['text'] etc.
-            command = None
-            if isinstance(jr, dict):
-                # search for first string in nested structure
-                import collections, json
-                def find_first_string(o):
-                    if isinstance(o, str):
-                        return o
-                    if isinstance(o, dict):
-                        for v in o.values():
-                            s = find_first_string(v)
-                            if s:
-                                return s
-                    if isinstance(o, list):
-                        for v in o:
-                            s = find_first_string(v)
-                            if s:
-                                return s
-                    return None
-                command = find_first_string(jr)
-            if not command:
-                command = model_resp_text.strip()
-        except Exception:
-            command = model_resp_text.strip()
-    except Exception as e:
-        return jsonify({"error": "model request failed", "detail": str(e)}), 502
+        with g.timing.stage("translate"):
+            command, command_source = translate_task(task)
+    except ModelError as e:
+        return jsonify(e.body), 502
+    except NoKeyAvailable as e:
+        return no_key_response(e)
+
+    if data.get('stream'):
+        return stream_process_command(command, command_source, data.get('timeout'), task)
 
-    # 2) Send command to CLI server
+    # 2) Send command to CLI server; its own stages (queue, exec, ...) come back as cli-*
     try:
-        cli_resp = requests.post(CLI_RUN_URL, json={"command": command}, timeout=30)
+        with g.timing.stage("cli"):
+            cli_resp = CLI_SESSION.post(CLI_RUN_URL, json={"command": command, "parse": True, "cache": bool(data.get('cache', False)), "task": task},
+                                        timeout=CLI_RUN_TIMEOUT)
     except Exception as e:
         return jsonify({"error": "failed to reach CLI server", "detail": str(e), "cli_url": CLI_RUN_URL}), 502
+    g.timing.merge(cli_resp.headers.get("Server-Timing"), "cli-")
 
     if cli_resp.status_code not in (200, 201):
         # forward CLI server error
+        return cli_error_response(cli_resp)
+
+    cli_body = cli_resp.json()
+    raw_output = cli_body.get('output', cli_resp.text)
+    parsed = cli_body.get('parsed')
+
+    # 3) Known tools are summarized locally from the parsed result; others go to the model
+    with g.timing.stage("summarize"):
+        summary, summary_source = summarize(parsed, raw_output)
+    with g.timing.stage("save_summary"):
+        save_summary(cli_body.get('result_id'), summary)
+
+    return jsonify({"command": command, "command_source": command_source, "raw": raw_output,
+                    "parsed": parsed, "summary": summary, "summary_source": summary_source,
+                    "result_id": cli_body.get('result_id')})
+
+# Helper: attach a summary to the CLI server's stored result so history lookups
+# never summarize again; best effort, a failure only costs the stored summary
+def save_summary(result_id, summary):
+    if result_id is None or not summary:
+        return
+    try:
+        CLI_SESSION.patch(f"{CLI_RESULTS_URL}/{result_id}", json={"summary": summary}, timeout=5)
+    except Exception as e:
+        app.logger.warning("could not store summary for result %s: %s", result_id, e)
+
+# Returns (summary, source): "parser" when rendered from structured output, else "model"
+def summarize(parsed, raw_output):
+    summary = render_summary(parsed)
+    if summary is not None:
+        return summary, "parser"
+    return summarize_output(raw_output), "model"
+
+def stream_process_command(command, command_source, timeout, task=None):
+    with g.timing.stage("cli_open"):
+        cli_resp, error = open_cli_stream(command, timeout, parse=True, task=task)
+    if error:
+        return error
+    timing = g.timing
+
+    def generate():
+        tail = deque()
+        tail_size = 0
+        parsed = None
+        result_id = None
+        # Output that no parser will cover is summarized while the command runs
+        rolling = None if renders_command(command) else RollingSummary(summarize_text)
+        running = None
         try:
-            return jsonify({"error": "cli_server_error", "body": cli_resp.json()}), cli_resp.status_code
-        except Exception:
-            return jsonify({"error": "cli_server_error", "body": cli_resp.text}), cli_resp.status_code
-
-    raw_output = cli_resp.json().get('output', cli_resp.text)
-
-    # 3) Ask model to summarize raw_output (optional) - we'll skip heavy summarization if no key
-    try:
-        summarize_payload = {
-            "prompt": {
-                "messages": [
-                    {"role":"system", "content": "You must summarize terminal output in short bullet points."},
-                    {"role":"user", "content": f"Summarize the following output:\n\n{raw_output}"}
-                ]
-            },
-            "temperature": 0.2
-        }
-        # Reuse same key for summarization
-        rsum = requests.post(model_url, headers=headers, json=summarize_payload, timeout=12)
-        summary = None
-        if rsum.status_code == 200:
-            try:
-                summary = rsum.json()
-                # fallback to text
-                summary = str(summary)[:2000]
-            except Exception:
-                summary = rsum.text
-        else:
-            summary = f"summary_failed status:{rsum.status_code}"
+            yield sse_event("command", {"command": command, "command_source": command_source})
+            for event, payload in iter_sse(cli_resp):
+                if event == "output":
+                    text = payload.get("text", "")
+                    tail.append(text)
+                    tail_size += len(text)
+                    while tail_size > STREAM_SUMMARY_TAIL and len(tail) > 1:
+                        tail_size -= len(tail.popleft())
+                    if rolling is not None:
+                        rolling.feed(text)
+                elif event == "parsed":
+                    parsed = payload
+                elif event == "stored":
+                    result_id = payload.get("result_id")
+                yield sse_event(event, payload)
+                if rolling is not None and rolling.running() != running:
+                    running = rolling.running()
+                    yield sse_event("partial_summary", {"summary": running})
+            # Headers are long gone; these stages only reach gateway_stage_seconds
+            with timing.stage("summarize"):
+                summary = render_summary(parsed)
+                if summary is not None:
+                    summary_source = "parser"
+                elif rolling is not None:
+                    summary, summary_source = guarded_summary(rolling.finish), "model"
+                else:
+                    summary, summary_source = summarize_output("".join(tail)), "model"
+            yield sse_event("summary", {"summary": summary, "summary_source": summary_source})
+            with timing.stage("save_summary"):
+                save_summary(result_id, summary)
+        finally:
+            if rolling is not None:
+                rolling.cancel()
+            cli_resp.close()
+
+    return sse_response(generate())
+
+@app.route('/api/batchCommand', methods=['POST'])
+def batch_command():
+    """
+    Accepts: { "task": "scan 10.0.0.0/22" } or { "command": "nmap -sV 10.0.0.0/22" }
+             plus optional "targets" (with a "{target}" command template), "shards",
+             "timeout" (per shard) and "stream".
+    The CLI server splits the targets into shards and runs them in parallel.
+    With "stream": true shard results are relayed as SSE as they finish
+    (command / plan / shard / report / done / summary events); otherwise one JSON
+    body with every shard, the merged report and its summary is returned.
+    """
+    data = request.json or {}
+    command = data.get('command', '').strip()
+    command_source = "direct"
+    task = data.get('task', '').strip()
+    if not command:
+        if not task:
+            return jsonify({"error": "task or command is required"}), 400
+        try:
+            with g.timing.stage("translate"):
+                command, command_source = translate_task(task)
+        except ModelError as e:
+            return jsonify(e.body), 502
+        except NoKeyAvailable as e:
+            return no_key_response(e)
+
+    payload = {"command": command, "stream": True}
+    for field in ("targets", "shards", "timeout", "task"):
+        if data.get(field) is not None:
+            payload[field] = data[field]
+    timing = g.timing
+    try:
+        with timing.stage("cli_open"):
+            cli_resp = CLI_SESSION.post(CLI_BATCH_URL, json=payload, stream=True, timeout=(5, STREAM_IDLE_TIMEOUT))
     except Exception as e:
-        summary = f"summary_exception: {e}"
+        return jsonify({"error": "failed to reach CLI server", "detail": str(e), "cli_url": CLI_BATCH_URL}), 502
+    if cli_resp.status_code != 200:
+        return cli_error_response(cli_resp)
+
+    def events():
+        # Yields every upstream event, then a summary built from the merged report
+        # (or, for tools without a parser, from a bounded tail of shard output)
+        tail = deque()
+        tail_size = 0
+        report = None
+        result_id = None
+        try:
+            for event, payload in iter_sse(cli_resp):
+                if event == "shard":
+                    text = f"# shard {payload.get('index')} ({' '.join(payload.get('targets', []))})\n{payload.get('output', '')}"
+                    tail.append(text)
+                    tail_size += len(text)
+                    while tail_size > STREAM_SUMMARY_TAIL and len(tail) > 1:
+                        tail_size -= len(tail.popleft())
+                elif event == "report":
+                    report = payload
+                elif event == "stored":
+                    result_id = payload.get("result_id")
+                yield event, payload
+            with timing.stage("summarize"):
+                summary, summary_source = summarize(report, "\n".join(tail))
+            yield "summary", {"summary": summary, "summary_source": summary_source}
+            with timing.stage("save_summary"):
+                save_summary(result_id, summary)
+        finally:
+            cli_resp.close()
 
-    return jsonify({"command": command, "raw": raw_output, "summary": summary})
+    if data.get('stream'):
+        def generate():
+            yield sse_event("command", {"command": command, "command_source": command_source})
+            for event, payload in events():
+                yield sse_event(event, payload)
+
+        return sse_response(generate())
+
+    body = {"command": command, "command_source": command_source, "shards": []}
+    for event, payload in events():
+        if event == "shard":
+            body["shards"].append(payload)
+        elif event == "plan":
+            body["batch_id"] = payload.get("batch_id")
+        elif event == "done":
+            body.update({k: v for k, v in payload.items() if k != "shards"})
+        elif event in ("report", "summary", "stored"):
+            body.update({"report": payload} if event == "report" else payload)
+    body["shards"].sort(key=lambda shard: shard.get("index", 0))
+    return jsonify(body)
+
+# Helper: relay a GET on the CLI server's result store
+def proxy_results(path=""):
+    try:
+        r = CLI_SESSION.get(CLI_RESULTS_URL + path, params=request.args, stream=True, timeout=(5, 30))
+    except Exception as e:
+        return jsonify({"error": "failed to reach CLI server", "detail": str(e), "cli_url": CLI_RESULTS_URL}), 502
+    return Response(r.iter_content(chunk_size=None), status=r.status_code,
+                    mimetype=r.headers.get('Content-Type', 'application/json'))
+
+@app.route('/api/history', methods=['GET'])
+def history():
+    """
+    Past results from the CLI server's result store, newest first.
+    Same filters and paging as its /results: ?target=&tool=&task=&status=&since=&until=&limit=&cursor=
+    """
+    return proxy_results()
+
+@app.route('/api/history/<int:result_id>', methods=['GET'])
+def history_item(result_id):
+    """One stored result with its parsed data and stored summary"""
+    return proxy_results(f"/{result_id}")
+
+@app.route('/api/history/<int:result_id>/output', methods=['GET'])
+def history_output(result_id):
+    """Full stored raw output"""
+    return proxy_results(f"/{result_id}/output")
+
+# Helper: relay a call on the CLI server's artifact store; uploads are streamed
+# through chunk by chunk rather than read into memory
+def proxy_artifacts(method, path="", timeout=(5, 30), **kwargs):
+    try:
+        r = CLI_SESSION.request(method, CLI_ARTIFACTS_URL + path, params=request.args, stream=True,
+                                timeout=timeout, **kwargs)
+    except Exception as e:
+        return jsonify({"error": "failed to reach CLI server", "detail": str(e), "cli_url": CLI_ARTIFACTS_URL}), 502
+    return Response(r.iter_content(chunk_size=None), status=r.status_code,
+                    mimetype=r.headers.get('Content-Type', 'application/json'))
+
+@app.route('/api/artifacts', methods=['POST'])
+def upload_artifact():
+    """Raw sample in the body; stored by sha256 on the CLI server (see its POST /artifacts)"""
+    # requests cannot size the input stream, so it goes upstream chunked (no Content-Length)
+    headers = {"Content-Type": "application/octet-stream"}
+    if request.headers.get('X-Content-SHA256'):
+        headers["X-Content-SHA256"] = request.headers['X-Content-SHA256']
+    with g.timing.stage("upload"):
+        return proxy_artifacts('POST', data=request.stream, headers=headers, timeout=(5, 300))
+
+@app.route('/api/artifacts/<sha256>', methods=['GET'])
+def artifact_info(sha256):
+    """Size of a stored sample and its cached analyses"""
+    return proxy_artifacts('GET', f"/{sha256}")
+
+@app.route('/api/artifacts/<sha256>/analyze', methods=['POST'])
+def analyze_artifact(sha256):
+    """{ "tool": "peframe" | "ghidra", "refresh", "wait" }; known samples are answered from the cache"""
+    data = request.json or {}
+    # A waited-for Ghidra run can take many minutes
+    timeout = (5, None) if data.get('wait') else (5, 30)
+    with g.timing.stage("analyze"):
+        return proxy_artifacts('POST', f"/{sha256}/analyze", json=data, timeout=timeout)
+
+@app.route('/api/intents', methods=['GET'])
+def intent_stats():
+    """Loaded fast-path rules (count, tools, load errors)"""
+    return jsonify(intents.stats())
+
+@app.route('/api/intents/reload', methods=['POST'])
+def reload_intents():
+    """Re-read intents.json files after editing them"""
+    intents.reload()
+    return jsonify(intents.stats())
+
+def cache_stats_body():
+    return {"translation": translations.stats(), "chunk_summaries": chunk_summaries.stats(),
+            "tools": tool_catalog.stats(),
+            "batching": {"translation": translation_batcher.stats(), "summary": summary_batcher.stats()}}
+
+@app.route('/api/cacheStats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the gateway caches"""
+    return jsonify(cache_stats_body())
+
+# Values kept by the caches, batchers and key scheduler, read when /metrics is scraped
+def collect_metrics():
+    caches = {"translation": translations.stats(), "chunk_summary": chunk_summaries.stats()}
+    batchers = {"translation": translation_batcher.stats(), "summary": summary_batcher.stats()}
+    return [
+        ("gateway_cache_hits_total", "counter", "Cache lookups answered from the cache",
+         [({"cache": name}, stats["hits"]) for name, stats in caches.items()]),
+        ("gateway_cache_misses_total", "counter", "Cache lookups that missed",
+         [({"cache": name}, stats["misses"]) for name, stats in caches.items()]),
+        ("gateway_cache_entries", "gauge", "Entries held per cache",
+         [({"cache": name}, stats["entries"]) for name, stats in caches.items()]),
+        ("gateway_model_batches_total", "counter", "Model requests sent by the micro-batchers",
+         [({"kind": name}, stats["batches"]) for name, stats in batchers.items()]),
+        ("gateway_model_batch_items_total", "counter", "Items carried by those requests",
+         [({"kind": name}, stats["items"]) for name, stats in batchers.items()]),
+        ("gateway_key_open", "gauge", "1 while a key's circuit is open",
+         [({"key": k["key"]}, int(k["state"] == "open")) for k in scheduler.status()]),
+    ]
+
+REGISTRY.register(collect_metrics)
+
+def profile_response(seconds_arg):
+    """(body, status, mimetype) for /debug/profile; shared with the ASGI app"""
+    if not PROFILER_ENABLED:
+        return json.dumps({"error": "profiler disabled (set WEB_PROFILER=1)"}), 404, 'application/json'
+    try:
+        seconds = float(seconds_arg or '10')
+    except ValueError:
+        return json.dumps({"error": "seconds must be a number"}), 400, 'application/json'
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return (json.dumps({"error": f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}), 400,
+                'application/json')
+    try:
+        return profiler.profile(seconds), 200, 'text/plain'
+    except ProfilerBusy as e:
+        return json.dumps({"error": str(e)}), 409, 'application/json'
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage timings, per-key model latency and cache counters in Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile', methods=['GET'])
+def profile():
+    """
+    ?seconds=N (default 10): samples every thread's stack for N seconds and
+    returns collapsed stacks for flamegraph.pl / speedscope. Needs WEB_PROFILER=1.
+    """
+    body, status, mimetype = profile_response(request.args.get('seconds'))
+    return Response(body, status=status, mimetype=mimetype)
 
 @app.route('/api/directCommand', methods=['POST'])
 def direct_command():
     """
     Bypass AI: directly forward { "command": "<shell command>" } to the CLI server.
     Useful for testing connectivity or for when keys fail.
+    With "stream": true the CLI server's SSE output is relayed as it arrives.
+    With "cache": true, read-only commands (cat, ls, whois, ...) may be served
+    from the CLI server's result cache; by default they always run.
     """
     data = request.json or {}
     cmd = data.get('command', '').strip()
     if not cmd:
         return jsonify({"error": "command required"}), 400
 
+    if data.get('stream'):
+        cli_resp, error = open_cli_stream(cmd, data.get('timeout'))
+        if error:
+            return error
+
+        def relay():
+            # Pass upstream SSE frames straight through; nothing is buffered here
+            try:
+                for chunk in cli_resp.iter_content(chunk_size=None):
+                    yield chunk
+            finally:
+                cli_resp.close()
+
+        return sse_response(relay())
+
     try:
-        r = requests.post(CLI_RUN_URL, json={"command": cmd}, timeout=30)
+        with g.timing.stage("cli"):
+            r = CLI_SESSION.post(CLI_RUN_URL, json={"command": cmd, "cache": bool(data.get('cache', False))},
+                                 timeout=CLI_RUN_TIMEOUT)
     except Exception as e:
         return jsonify({"error": "failed to reach CLI server", "detail": str(e), "cli_url": CLI_RUN_URL}), 502
+    g.timing.merge(r.headers.get("Server-Timing"), "cli-")
 
     if r.status_code not in (200, 201):
-        try:
-            return jsonify({"error": "cli_server_error", "body": r.json()}), r.status_code
-        except Exception:
-            return jsonify({"error": "cli_server_error", "body": r.text}), r.status_code
+        return cli_error_response(r)
 
-    return jsonify(r.json())
+    # Relay the CLI server's JSON body as-is instead of decoding and re-encoding it
+    return Response(r.content, status=r.status_code, mimetype='application/json')
 
 if __name__ == '__main__':
     # Allow external Docker container to specify host/port via env
     host = os.environ.get('WEB_HOST', '0.0.0.0')
     port = int(os.environ.get('WEB_PORT', '3000'))
-    app.run(host=host, port=port, debug=True)
+    app.run(host=host, port=port, debug=os.environ.get('WEB_DEBUG', '0') == '1', threaded=True)
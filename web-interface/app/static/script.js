@@ -32,28 +32,71 @@ async function initKeys() {
   }
 }
 
+// Read a text/event-stream response and call onEvent(event, data) per frame
+async function readEventStream(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const frame = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = "message";
+      const dataLines = [];
+      for (const line of frame.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+      }
+      if (dataLines.length) onEvent(event, JSON.parse(dataLines.join("\n")));
+    }
+  }
+}
+
+function isEventStream(res) {
+  return (res.headers.get('Content-Type') || '').startsWith('text/event-stream');
+}
+
 async function processTask() {
   const task = document.getElementById('task-input').value;
   if (!task || !task.trim()) {
     alert("Enter a task");
     return;
   }
-  document.getElementById('task-output').innerText = "Processing...";
+  const out = document.getElementById('task-output');
+  out.innerText = "Processing...";
   try {
     const res = await fetch('/api/processCommand', {
       method: 'POST',
       headers: {'Content-Type':'application/json'},
-      body: JSON.stringify({ task })
+      body: JSON.stringify({ task, stream: true })
     });
-    const data = await res.json();
-    if (data.error) {
-      document.getElementById('task-output').innerText = `Error: ${data.error}\n${data.detail || ''}`;
-    } else {
-      document.getElementById('task-output').innerText = `Command:\n${data.command}\n\nRaw Output:\n${data.raw}\n\nSummary:\n${data.summary}`;
+    if (!isEventStream(res)) {
+      const data = await res.json();
+      if (data.error) {
+        out.innerText = `Error: ${data.error}\n${data.detail || ''}`;
+      } else {
+        out.innerText = `Command:\n${data.command}\n\nRaw Output:\n${data.raw}\n\nSummary:\n${data.summary}`;
+      }
+      return;
     }
+    await readEventStream(res, (event, data) => {
+      if (event === 'command') {
+        out.innerText = `Command:\n${data.command}\n\nRaw Output:\n`;
+      } else if (event === 'output') {
+        out.innerText += data.text;
+      } else if (event === 'exit') {
+        out.innerText += `\n[${data.status}, exit code ${data.exit_code}]\n\nSummary:\n...`;
+      } else if (event === 'summary') {
+        out.innerText = out.innerText.replace(/\.\.\.$/, '') + data.summary;
+      }
+    });
   } catch (err) {
     console.error(err);
-    document.getElementById('task-output').innerText = "Failed to process (network). See console.";
+    out.innerText = "Failed to process (network). See console.";
   }
 }
 
@@ -63,22 +106,34 @@ async function sendDirectCommand() {
     alert("Enter a command");
     return;
   }
-  document.getElementById('direct-output').innerText = "Sending...";
+  const out = document.getElementById('direct-output');
+  out.innerText = "Sending...";
   try {
     const res = await fetch('/api/directCommand', {
       method: 'POST',
       headers: {'Content-Type':'application/json'},
-      body: JSON.stringify({ command: cmd })
+      body: JSON.stringify({ command: cmd, stream: true })
     });
-    const data = await res.json();
-    if (data.error) {
-      document.getElementById('direct-output').innerText = `Error: ${data.error} ${data.detail || ''}`;
-    } else {
-      document.getElementById('direct-output').innerText = data.output || JSON.stringify(data);
+    if (!isEventStream(res)) {
+      const data = await res.json();
+      if (data.error) {
+        out.innerText = `Error: ${data.error} ${data.detail || ''}`;
+      } else {
+        out.innerText = data.output || JSON.stringify(data);
+      }
+      return;
     }
+    out.innerText = "";
+    await readEventStream(res, (event, data) => {
+      if (event === 'output') {
+        out.innerText += data.text;
+      } else if (event === 'exit') {
+        out.innerText += `\n[${data.status}, exit code ${data.exit_code}]`;
+      }
+    });
   } catch (err) {
     console.error(err);
-    document.getElementById('direct-output').innerText = "Failed to reach CLI server.";
+    out.innerText = "Failed to reach CLI server.";
   }
 }
 
@@ -0,0 +1,112 @@
+# web-interface/app/summaries.py
+"""Render summaries from the CLI server's structured "parsed" results, no model needed."""
+import os
+import shlex
+from typing import Dict, List, Optional
+
+# Cap list lengths so a /16 sweep still yields a readable summary
+MAX_HOSTS = 50
+MAX_PORTS = 40
+
+
+def _nmap(parsed: Dict) -> str:
+    hosts = parsed.get("hosts", [])
+    stats = parsed.get("stats", {})
+    up = [h for h in hosts if h.get("status") == "up"]
+    lines: List[str] = []
+    if stats:
+        lines.append(f"- {stats.get('up', len(up))} of {stats.get('total', len(hosts))} hosts up"
+                     + (f", scanned in {stats['elapsed']:g}s" if stats.get('elapsed') is not None else ""))
+    else:
+        lines.append(f"- {len(up)} host(s) up")
+    for host in up[:MAX_HOSTS]:
+        name = host.get("address") or "?"
+        if host.get("hostname"):
+            name = f"{host['hostname']} ({name})"
+        open_ports = [p for p in host.get("ports", []) if p.get("state") == "open"]
+        lines.append(f"- {name}: {len(open_ports)} open port(s)")
+        for p in open_ports[:MAX_PORTS]:
+            version = f" {p['version']}" if p.get("version") else ""
+            lines.append(f"  - {p['port']}/{p['protocol']} {p['service']}{version}")
+        if len(open_ports) > MAX_PORTS:
+            lines.append(f"  - ... {len(open_ports) - MAX_PORTS} more")
+        if host.get("os"):
+            best = host["os"][0]
+            accuracy = f" ({best['accuracy']}%)" if best.get("accuracy") else ""
+            lines.append(f"  - OS: {best['name']}{accuracy}")
+    if len(up) > MAX_HOSTS:
+        lines.append(f"- ... {len(up) - MAX_HOSTS} more hosts")
+    return "\n".join(lines)
+
+
+def _sqlmap(parsed: Dict) -> str:
+    lines: List[str] = []
+    points = parsed.get("injection_points", [])
+    if points:
+        lines.append(f"- VULNERABLE: {len(points)} injection point(s)")
+        for point in points:
+            kinds = ", ".join(t["type"] for t in point.get("techniques", []))
+            lines.append(f"  - {point['place']} parameter '{point['parameter']}': {kinds}")
+    else:
+        lines.append("- No injection point found")
+    if parsed.get("dbms"):
+        lines.append(f"- Back-end DBMS: {parsed['dbms']}")
+    if parsed.get("databases"):
+        lines.append(f"- Databases: {', '.join(parsed['databases'])}")
+    if parsed.get("not_injectable"):
+        lines.append(f"- Not injectable: {', '.join(parsed['not_injectable'])}")
+    return "\n".join(lines)
+
+
+def _peframe(parsed: Dict) -> str:
+    lines = [f"- {parsed.get('filename') or 'sample'}: {parsed.get('filetype') or 'unknown type'}"
+             + (f", {parsed['filesize']} bytes" if parsed.get('filesize') else "")]
+    hashes = parsed.get("hashes") or {}
+    if hashes.get("sha256") or hashes.get("md5"):
+        lines.append(f"- {'sha256' if hashes.get('sha256') else 'md5'}: {hashes.get('sha256') or hashes.get('md5')}")
+    if parsed.get("imphash"):
+        lines.append(f"- imphash: {parsed['imphash']}")
+    sections = parsed.get("sections", [])
+    if sections:
+        lines.append(f"- {len(sections)} section(s)")
+        for s in sections:
+            flags = []
+            if s.get("suspicious"):
+                flags.append("suspicious")
+            if isinstance(s.get("entropy"), (int, float)) and s["entropy"] > 7.0:
+                flags.append("high entropy, likely packed")
+            flag_text = f" [{', '.join(flags)}]" if flags else ""
+            lines.append(f"  - {s.get('name')}: entropy {s.get('entropy')}{flag_text}")
+    imports = parsed.get("imports") or {}
+    if imports:
+        total = sum(len(f) for f in imports.values())
+        lines.append(f"- Imports: {total} function(s) from {len(imports)} DLL(s): {', '.join(sorted(imports))}")
+    return "\n".join(lines)
+
+
+RENDERERS = {
+    "nmap": _nmap,
+    "sqlmap": _sqlmap,
+    "peframe": _peframe,
+}
+
+
+# Commands whose output the CLI server parses into a result we can render
+PARSED_COMMANDS = {"nmap", "sqlmap", "peframe", "quick-scan.sh"}
+
+
+def renders_command(command: str) -> bool:
+    """True if the command's summary will most likely come from its parsed result"""
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return False
+    return bool(words) and os.path.basename(words[0]) in PARSED_COMMANDS
+
+
+def render_summary(parsed: Optional[Dict]) -> Optional[str]:
+    """Bullet-point summary for a parsed result, or None if there is no renderer"""
+    if not parsed:
+        return None
+    renderer = RENDERERS.get(parsed.get("tool"))
+    return renderer(parsed) if renderer else None
@@ -0,0 +1,115 @@
+# web-interface/app/tool_catalog.py
+"""Cached copy of the CLI server's /tools registry for prompts and the allow-list."""
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+# Seconds before the catalog is re-fetched (in the background, with If-None-Match)
+TOOL_CATALOG_TTL = float(os.environ.get('TOOL_CATALOG_TTL', '60'))
+TOOL_CATALOG_TIMEOUT = float(os.environ.get('TOOL_CATALOG_TIMEOUT', '2'))
+TOOLS_URL = f"http://{os.environ.get('CLI_SERVER_HOST', 'cli-server:5000')}/tools"
+
+# Where the CLI server container keeps categories/; intent rules call scripts by these paths
+CLI_CATEGORIES_PATH = '/app/categories'
+# Used until the CLI server has answered once (and whenever it never does)
+DEFAULT_TOOLS = {
+    "nmap": {"category": "penetration_testing", "binaries": {"nmap": None},
+             "scripts": {"quick-scan.sh": f"{CLI_CATEGORIES_PATH}/penetration_testing/nmap/quick-scan.sh"}},
+    "sqlmap": {"category": "penetration_testing", "scripts": {}, "binaries": {"sqlmap": None}},
+    "peframe": {"category": "malware_analysis", "scripts": {}, "binaries": {"peframe": None}},
+    "ghidra": {"category": "reverse_engineering", "binaries": {"ghidra": None, "analyzeHeadless": None},
+               "scripts": {"ghidra-pool.sh": f"{CLI_CATEGORIES_PATH}/reverse_engineering/ghidra/ghidra-pool.sh"}},
+}
+DESCRIPTIONS = {
+    "nmap": "Network scanning",
+    "sqlmap": "SQL injection testing",
+    "peframe": "PE file analysis",
+    "ghidra": "Reverse engineering (analyzeHeadless)",
+}
+# Read-only shell utilities that are always allowed
+SHELL_COMMANDS = ['ls', 'cat', 'head', 'tail']
+
+
+class ToolCatalog:
+    """
+    Holds the last /tools response. Readers never wait on the network after
+    the first fetch: a stale catalog is served while one background refresh
+    runs, and a 304 just renews it.
+    """
+
+    def __init__(self, url: str = TOOLS_URL, session: Optional[requests.Session] = None,
+                 ttl: float = TOOL_CATALOG_TTL, timeout: float = TOOL_CATALOG_TIMEOUT):
+        self.url = url
+        self.session = session or requests.Session()
+        self.ttl = ttl
+        self.timeout = timeout
+        self._tools: Dict[str, Dict] = DEFAULT_TOOLS
+        self._etag: Optional[str] = None
+        self._fetched_at: Optional[float] = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.source = "default"
+
+    def _fetch(self):
+        headers = {"If-None-Match": self._etag} if self._etag else {}
+        try:
+            r = self.session.get(self.url, headers=headers, timeout=self.timeout)
+            if r.status_code == 200:
+                tools = r.json().get("tools") or {}
+                with self._lock:
+                    self._tools = tools or DEFAULT_TOOLS
+                    self._etag = r.headers.get("ETag")
+                    self.source = "cli-server"
+        except (requests.RequestException, ValueError):
+            # Keep whatever we had; the next read retries after the TTL
+            pass
+        finally:
+            with self._lock:
+                self._fetched_at = time.monotonic()
+                self._refreshing = False
+
+    def tools(self) -> Dict[str, Dict]:
+        with self._lock:
+            first = self._fetched_at is None
+            stale = first or time.monotonic() - self._fetched_at >= self.ttl
+            start = stale and not self._refreshing
+            if start:
+                self._refreshing = True
+        if start:
+            if first:
+                self._fetch()
+            else:
+                threading.Thread(target=self._fetch, daemon=True).start()
+        with self._lock:
+            return self._tools
+
+    def prompt_lines(self, indent: str = "") -> str:
+        """Tool list for the translation prompt, one "- name: description" line per tool"""
+        lines = []
+        for name, info in sorted(self.tools().items()):
+            line = f"- {name}: {DESCRIPTIONS.get(name, info.get('category', '').replace('_', ' '))}"
+            if info.get("scripts"):
+                line += f" (scripts: {', '.join(sorted(info['scripts']))})"
+            lines.append(indent + line)
+        return "\n".join(lines)
+
+    def allowed_prefixes(self) -> List[str]:
+        """Command names a translated command may start with"""
+        prefixes = list(SHELL_COMMANDS)
+        for name, info in self.tools().items():
+            prefixes.append(name)
+            prefixes.extend(info.get("binaries") or {})
+            # Scripts may be called by name or by full path
+            for script, path in (info.get("scripts") or {}).items():
+                prefixes.append(script)
+                if path:
+                    prefixes.append(path)
+        return sorted(set(prefixes))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            age = None if self._fetched_at is None else round(time.monotonic() - self._fetched_at, 1)
+            return {"source": self.source, "tools": sorted(self._tools), "etag": self._etag, "age": age}
@@ -0,0 +1,133 @@
+# web-interface/app/translation_cache.py
+"""Cache of task -> CLI command translations keyed by a normalized task template."""
+import os
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+TRANSLATION_CACHE_SIZE = int(os.environ.get('TRANSLATION_CACHE_SIZE', '1024'))
+TRANSLATION_CACHE_TTL = float(os.environ.get('TRANSLATION_CACHE_TTL', '3600'))
+
+# Targets we lift out of a task: URLs, IPv4 (optionally CIDR), IPv6, hostnames, absolute paths
+TARGET_RE = re.compile(
+    r"""
+    (?P<url>\b[a-z][a-z0-9+.-]*://[^\s'"]+)
+    | (?P<ipv4>\b\d{1,3}(?:\.\d{1,3}){3}(?:/\d{1,2})?\b)
+    | (?P<ipv6>\b[0-9a-f]{1,4}:(?:[0-9a-f]{0,4}:){1,6}[0-9a-f]{0,4}(?:/\d{1,3})?)
+    | (?P<host>\b(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}\b)
+    | (?P<path>(?<![\w/])/[^\s'"]+)
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+# Only targets made of these characters are spliced into cached templates;
+# anything that would need shell quoting is cached per exact task instead
+SAFE_PARAM_RE = re.compile(r"^[\w.:/@%+,=-]+$")
+
+
+def _placeholder(i: int) -> str:
+    return f"<<target{i}>>"
+
+
+def normalize_task(task: str) -> Tuple[str, List[str]]:
+    """
+    Split a task into a normalized template and its target parameters:
+    "Scan  Example.COM please" -> ("scan <<target0>> please", ["Example.COM"]).
+    Case and whitespace are folded in the template only; targets keep their case.
+    """
+    params: List[str] = []
+    parts: List[str] = []
+    last = 0
+    for m in TARGET_RE.finditer(task):
+        target = m.group(0).rstrip('.,;:!?)')
+        parts.append(task[last:m.start()].lower())
+        parts.append(_placeholder(len(params)))
+        params.append(target)
+        last = m.start() + len(target)
+    parts.append(task[last:].lower())
+    template = " ".join("".join(parts).split()).strip(" .!?")
+    return template, params
+
+
+def _fill(template: str, params: List[str]) -> str:
+    for i, value in enumerate(params):
+        template = template.replace(_placeholder(i), value)
+    return template
+
+
+def _templatable(params: List[str]) -> bool:
+    return bool(params) and all(SAFE_PARAM_RE.match(p) for p in params)
+
+
+class TranslationCache:
+    """
+    LRU + TTL cache. When every target of a task appears verbatim in the
+    model's command the command is stored as a template, so "scan a.com" and
+    "scan b.com" share one entry; otherwise the exact task is cached.
+    """
+
+    def __init__(self, max_entries: int = TRANSLATION_CACHE_SIZE, ttl: float = TRANSLATION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _literal_key(template: str, params: List[str]) -> str:
+        return "=" + _fill(template, params)
+
+    def get(self, task: str) -> Optional[str]:
+        template, params = normalize_task(task)
+        now = time.monotonic()
+        keys = [self._literal_key(template, params) if params else template]
+        if _templatable(params):
+            keys.insert(0, template)
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                command, expires = entry
+                if expires < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _fill(command, params) if key == template else command
+            self.misses += 1
+            return None
+
+    def put(self, task: str, command: str):
+        template, params = normalize_task(task)
+        if _templatable(params) and all(p in command for p in params):
+            key = template
+            # Longest first so "a.com" inside "http://a.com/x" doesn't split a longer target
+            for i in sorted(range(len(params)), key=lambda i: -len(params[i])):
+                command = command.replace(params[i], _placeholder(i))
+        else:
+            key = self._literal_key(template, params) if params else template
+        with self._lock:
+            self._entries[key] = (command, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
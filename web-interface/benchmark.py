@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the gateway and the CLI server.
+
+Starts a fake Gemini endpoint (configurable latency and 429 rate), a fake or
+real CLI server and the gateway (Flask or ASGI), then drives
+/api/processCommand, /api/directCommand and the CLI server's /run at the
+given concurrency levels and reports throughput and p50/p95/p99 latency.
+Nothing leaves the machine, so runs are comparable across commits:
+
+    python benchmark.py --concurrency 1,8,32 --requests 300 --save before.json
+    python benchmark.py --concurrency 1,8,32 --requests 300 --baseline before.json
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(HERE, 'app')
+SERVER_DIR = os.path.join(HERE, '..', 'server')
+
+TASK_RE = re.compile(r"### Task \d+\n(.*)")
+OUTPUT_RE = re.compile(r"### Output \d+\n")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """JSON-over-HTTP/1.1 handler with keep-alive; subclasses implement respond()"""
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this Nagle adds ~40 ms per response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return {}
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.respond('GET', {})
+
+    def do_POST(self):
+        self.respond('POST', self._body())
+
+    def do_PATCH(self):
+        self.respond('PATCH', self._body())
+
+
+class FakeModel:
+    """
+    Stand-in for the Gemini endpoint. Each call sleeps latency ± jitter
+    seconds, and a fraction rate_429 is answered with 429 and Retry-After.
+    Translations become "echo <task>"; summaries are one bullet. Numbered
+    multi-item prompts from the micro-batcher get a numbered JSON answer.
+    """
+
+    def __init__(self, latency, jitter, rate_429, retry_after):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+
+    def answer(self, payload):
+        messages = (payload.get('prompt') or {}).get('messages') or [{}]
+        system, user = messages[0].get('content', ''), messages[-1].get('content', '')
+        translate = 'convert user tasks' in system
+        if 'JSON object' in user:
+            items = TASK_RE.findall(user) if translate else OUTPUT_RE.findall(user)
+            return json.dumps({str(i): f"echo {item.strip()}" if translate else f"- output {i} looks fine"
+                               for i, item in enumerate(items, 1)})
+        if translate:
+            task = user.split("Task:", 1)[-1].split("\n", 1)[0].strip()
+            return f"echo {task}"
+        return "- output looks fine"
+
+    def handler(self):
+        model = self
+
+        class Handler(FakeHandler):
+            def respond(self, method, body):
+                time.sleep(max(0.0, model.latency + random.uniform(-model.jitter, model.jitter)))
+                with model.lock:
+                    model.calls += 1
+                    throttled = random.random() < model.rate_429
+                    model.throttled += throttled
+                if throttled:
+                    self.send_json(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}},
+                                   {"Retry-After": f"{model.retry_after:g}"})
+                    return
+                text = model.answer(body)
+                self.send_json(200, {"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+        return Handler
+
+
+class FakeCli:
+    """Stand-in for the CLI server: /run answers after `latency` seconds, /results PATCHes succeed"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.result_ids = itertools.count(1)
+
+    def handler(self):
+        cli = self
+
+        class Handler(FakeHandler):
+            def respond(self, method, body):
+                if method == 'POST' and self.path == '/run':
+                    time.sleep(cli.latency)
+                    command = body.get('command', '')
+                    output = command[5:] + "\n" if command.startswith('echo ') else ""
+                    self.send_json(200, {"output": output, "result_id": next(cli.result_ids)})
+                elif method == 'PATCH' and self.path.startswith('/results/'):
+                    self.send_json(200, {"ok": True})
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+        return Handler
+
+
+def serve(handler, port):
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_process(argv, cwd, env, log_path):
+    log = open(log_path, 'wb')
+    return subprocess.Popen(argv, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(url, proc=None, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"process for {url} exited with {proc.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+def drive(scenario, url, payload, concurrency, total, warmup, timeout):
+    """POST payload(i) to url from `concurrency` threads until `total` requests are done"""
+    counter = itertools.count(-warmup)
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+    started = [None]
+
+    def worker():
+        session = requests.Session()
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            if i == 0:
+                with lock:
+                    started[0] = time.perf_counter()
+            begin = time.perf_counter()
+            try:
+                status = session.post(url, json=payload(i), timeout=timeout).status_code
+            except requests.RequestException:
+                status = 0
+            elapsed = time.perf_counter() - begin
+            if i < 0:
+                continue
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - (started[0] or time.perf_counter())
+    latencies.sort()
+    ok = statuses.get(200, 0)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": ok,
+        "errors": {str(k): v for k, v in sorted(statuses.items()) if k != 200},
+        "throughput": round(ok / wall, 1) if wall > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+
+def print_header():
+    print(f"{'scenario':<10} {'conc':>5} {'ok':>6} {'errors':<16} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+
+
+def print_row(r):
+    errors = ",".join(f"{k}:{v}" for k, v in r["errors"].items()) or "-"
+    print(f"{r['scenario']:<10} {r['concurrency']:>5} {r['ok']:>6} {errors:<16} {r['throughput']:>8} "
+          f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8}", flush=True)
+
+
+def compare(rows, baseline, max_regression):
+    """Regressions beyond max_regression percent in p95 or throughput, as messages"""
+    before = {(r["scenario"], r["concurrency"]): r for r in baseline}
+    problems = []
+    for r in rows:
+        b = before.get((r["scenario"], r["concurrency"]))
+        if b is None:
+            continue
+        label = f"{r['scenario']} x{r['concurrency']}"
+        if b["p95_ms"] and r["p95_ms"] > b["p95_ms"] * (1 + max_regression / 100):
+            problems.append(f"{label}: p95 {b['p95_ms']} -> {r['p95_ms']} ms")
+        if b["throughput"] and r["throughput"] < b["throughput"] * (1 - max_regression / 100):
+            problems.append(f"{label}: throughput {b['throughput']} -> {r['throughput']} req/s")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default='process,direct,run',
+                        help='comma-separated: process (/api/processCommand), direct (/api/directCommand), '
+                             'run (CLI server /run)')
+    parser.add_argument('--concurrency', default='1,8,32', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario and level')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests before each run')
+    parser.add_argument('--timeout', type=float, default=120, help='per-request timeout (seconds)')
+    parser.add_argument('--gateway', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--cli', choices=('fake', 'real'), default='fake',
+                        help='fake answers /run after --cli-latency; real starts server/main.py')
+    parser.add_argument('--cli-latency', type=float, default=0.02, help='fake CLI /run latency (seconds)')
+    parser.add_argument('--model-latency', type=float, default=0.3, help='fake model latency (seconds)')
+    parser.add_argument('--model-jitter', type=float, default=0.1, help='± uniform jitter on the latency')
+    parser.add_argument('--model-429-rate', type=float, default=0.0, help='fraction of model calls answered 429')
+    parser.add_argument('--model-retry-after', type=float, default=1.0, help='Retry-After sent with a 429')
+    parser.add_argument('--keys', type=int, default=4, help='fake API keys handed to the gateway')
+    parser.add_argument('--unique-tasks', type=int, default=0,
+                        help='cycle through this many distinct tasks (0: every task is new, so none is cached)')
+    parser.add_argument('--command', default='echo benchmark', help='command for the direct and run scenarios')
+    parser.add_argument('--save', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=20,
+                        help='percent of p95 / throughput regression that fails the run (with --baseline)')
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    processes = []
+
+    model = FakeModel(args.model_latency, args.model_jitter, args.model_429_rate, args.model_retry_after)
+    model_port = free_port()
+    serve(model.handler(), model_port)
+
+    cli_port = free_port()
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    if args.cli == 'fake':
+        serve(FakeCli(args.cli_latency).handler(), cli_port)
+    else:
+        cli_env = dict(env, CLI_PORT=str(cli_port), CLI_RESULT_DB=os.path.join(workdir, 'results.db'))
+        cli = start_process([sys.executable, 'main.py'], SERVER_DIR, cli_env, os.path.join(workdir, 'cli.log'))
+        processes.append(cli)
+    cli_url = f'http://127.0.0.1:{cli_port}'
+
+    gateway_port = free_port()
+    gateway_env = dict(env, CLI_SERVER_HOST=f'127.0.0.1:{cli_port}', WEB_HOST='127.0.0.1',
+                       WEB_PORT=str(gateway_port), MODEL_URL=f'http://127.0.0.1:{model_port}/generate',
+                       GEMINI_API_KEYS=",".join(f"bench-key-{i}" for i in range(args.keys)))
+    # Measure the gateway, not the per-key quotas, unless they are set explicitly
+    gateway_env.setdefault('KEY_RPM', '1000000')
+    gateway_env.setdefault('KEY_TPM', '1000000000')
+    script = 'asgi.py' if args.gateway == 'asgi' else 'server.py'
+    gateway = start_process([sys.executable, script], APP_DIR, gateway_env, os.path.join(workdir, 'gateway.log'))
+    processes.append(gateway)
+    gateway_url = f'http://127.0.0.1:{gateway_port}'
+
+    tasks = itertools.count()
+    targets = {
+        'process': (gateway_url + '/api/processCommand',
+                    lambda i: {"task": f"benchmark task {i % args.unique_tasks if args.unique_tasks else next(tasks)}"}),
+        'direct': (gateway_url + '/api/directCommand', lambda i: {"command": args.command, "cache": False}),
+        'run': (cli_url + '/run', lambda i: {"command": args.command}),
+    }
+    unknown = set(scenarios) - set(targets)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    rows = []
+    try:
+        if args.cli == 'real':
+            wait_ready(cli_url + '/tools', processes[0])
+        wait_ready(gateway_url + '/', gateway)
+        print(f"gateway={args.gateway} cli={args.cli} model latency={args.model_latency}s "
+              f"±{args.model_jitter}s 429 rate={args.model_429_rate} logs={workdir}")
+        print_header()
+        for scenario in scenarios:
+            url, payload = targets[scenario]
+            for level in levels:
+                rows.append(drive(scenario, url, payload, level, args.requests, args.warmup, args.timeout))
+                print_row(rows[-1])
+        print(f"model calls: {model.calls} ({model.throttled} answered 429)")
+    finally:
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(rows, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(rows, json.load(f), args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()